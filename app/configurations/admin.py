@@ -25,7 +25,8 @@ class XDSUIConfigurationAdmin(admin.ModelAdmin):
     list_display = ('search_results_per_page', 'xds_configuration',
                     'created', 'modified',)
     fields = [('search_results_per_page', 'xds_configuration',
-               'course_img_fallback', 'ui_logo')]
+               'course_img_fallback', 'ui_logo'),
+              ('track_total_hits', 'exact_total_on_last_page')]
 
 
 @admin.register(CourseInformationMapping)
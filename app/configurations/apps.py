@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'configurations'
+
+    def ready(self):
+        import configurations.signals
+        configurations.signals.config_changed
+        return super().ready()
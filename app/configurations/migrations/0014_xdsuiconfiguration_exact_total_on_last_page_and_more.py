@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configurations', '0013_xdsconfiguration_lrs_endpoint_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xdsuiconfiguration',
+            name='exact_total_on_last_page',
+            field=models.BooleanField(default=False, help_text='Count the exact total of a search with a separate request when its last page is requested'),
+        ),
+        migrations.AddField(
+            model_name='xdsuiconfiguration',
+            name='track_total_hits',
+            field=models.PositiveIntegerField(blank=True, default=10000, help_text='Enter the number of hits a search counts exactly, larger totals are reported as at least this number. Leave blank to always count every hit', null=True),
+        ),
+    ]
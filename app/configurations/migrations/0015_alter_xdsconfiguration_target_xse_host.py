@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configurations', '0014_xdsuiconfiguration_exact_total_on_last_page_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='xdsconfiguration',
+            name='target_xse_host',
+            field=models.CharField(default='http://localhost:9200', help_text='Enter the XSE Host to search, or the comma separated hosts of several nodes of the cluster', max_length=1000),
+        ),
+    ]
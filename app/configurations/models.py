@@ -24,8 +24,9 @@ class XDSConfiguration(TimeStampedModel):
         default='http://localhost:8080/api/metadata/')
 
     target_xse_host = models.CharField(
-        max_length=200,
-        help_text='Enter the XSE Host to search',
+        max_length=1000,
+        help_text='Enter the XSE Host to search, or the comma separated '
+                  'hosts of several nodes of the cluster',
         default='http://localhost:9200')
     target_xse_index = models.CharField(
         max_length=200,
@@ -104,6 +105,15 @@ class XDSUIConfiguration(TimeStampedModel):
                                                           "results per page "
                                                           "should be at least "
                                                           "1")])
+    track_total_hits = models.PositiveIntegerField(
+        default=10000, null=True, blank=True,
+        help_text="Enter the number of hits a search counts exactly, larger "
+                  "totals are reported as at least this number. Leave "
+                  "blank to always count every hit")
+    exact_total_on_last_page = models.BooleanField(
+        default=False,
+        help_text="Count the exact total of a search with a separate "
+                  "request when its last page is requested")
     xds_configuration = models.OneToOneField(
         XDSConfiguration,
         on_delete=models.CASCADE,
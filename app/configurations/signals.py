@@ -0,0 +1,27 @@
+import logging
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from configurations.models import (CourseInformationMapping, XDSConfiguration,
+                                   XDSUIConfiguration)
+from configurations.utils.snapshot import invalidate_config_snapshot
+from core.models import (CourseDetailHighlight, SearchField, SearchFilter,
+                         SearchSortOption)
+from users.models import Organization
+
+logger = logging.getLogger('dict_config_logger')
+
+
+@receiver([post_save, post_delete], sender=XDSConfiguration)
+@receiver([post_save, post_delete], sender=XDSUIConfiguration)
+@receiver([post_save, post_delete], sender=CourseInformationMapping)
+@receiver([post_save, post_delete], sender=SearchField)
+@receiver([post_save, post_delete], sender=SearchFilter)
+@receiver([post_save, post_delete], sender=SearchSortOption)
+@receiver([post_save, post_delete], sender=CourseDetailHighlight)
+@receiver([post_save, post_delete], sender=Organization)
+def config_changed(sender, **kwargs):
+    """Invalidates the configuration snapshot when a configuration model is
+        saved or deleted"""
+    invalidate_config_snapshot()
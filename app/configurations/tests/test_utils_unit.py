@@ -0,0 +1,84 @@
+from unittest.mock import patch
+
+from configurations.models import (CourseInformationMapping,
+                                   XDSConfiguration, XDSUIConfiguration)
+from configurations.utils import snapshot
+from configurations.utils.snapshot import (CONFIG_VERSION_KEY,
+                                           get_config_snapshot,
+                                           invalidate_config_snapshot)
+from core.models import (CourseDetailHighlight, SearchFilter,
+                         SearchSortOption)
+from django.core.cache import caches
+from django.test import TestCase, override_settings, tag
+
+
+@tag('unit')
+@override_settings(CONFIG_SNAPSHOT_CHECK_INTERVAL=60)
+class ConfigSnapshotTests(TestCase):
+
+    def setUp(self):
+        with patch('configurations.models.BaseQueries'):
+            self.config = XDSConfiguration(target_xse_host='test-host',
+                                           target_xse_index='test-index')
+            self.config.save()
+        self.ui_config = XDSUIConfiguration(search_results_per_page=5,
+                                            xds_configuration=self.config)
+        self.ui_config.save()
+        SearchFilter(display_name='Type', field_name='type',
+                     xds_ui_configuration=self.ui_config).save()
+        SearchSortOption(display_name='Title', field_name='title',
+                         xds_ui_configuration=self.ui_config).save()
+
+    def tearDown(self):
+        invalidate_config_snapshot()
+
+    def test_get_config_snapshot(self):
+        """Test that the snapshot contains the stored configuration"""
+        config = get_config_snapshot()
+
+        self.assertEqual(config.target_xse_host, 'test-host')
+        self.assertEqual(config.target_xse_index, 'test-index')
+        self.assertEqual(config.search_results_per_page, 5)
+        self.assertEqual(config.sort_fields, frozenset(['title']))
+        self.assertEqual(config.get_search_filter('Type').field_name, 'type')
+        self.assertIsNone(config.get_search_filter('Missing'))
+
+    def test_get_config_snapshot_card_fields(self):
+        """Test that the card fields combine the course mapping and the
+            active course highlights"""
+        CourseInformationMapping(xds_ui_configuration=self.ui_config).save()
+        CourseDetailHighlight(display_name='Hours', field_name='Course.Hours',
+                              xds_ui_configuration=self.ui_config).save()
+        CourseDetailHighlight(display_name='Off', field_name='Course.Off',
+                              active=False,
+                              xds_ui_configuration=self.ui_config).save()
+        card_fields = get_config_snapshot().card_fields
+
+        self.assertIn('Course.CourseTitle', card_fields)
+        self.assertIn('Course.Hours', card_fields)
+        self.assertNotIn('Course.Off', card_fields)
+        self.assertEqual(list(card_fields), sorted(card_fields))
+
+    def test_get_config_snapshot_cached(self):
+        """Test that a loaded snapshot is served without database queries"""
+        config = get_config_snapshot()
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_config_snapshot(), config)
+
+    def test_get_config_snapshot_invalidated_on_save(self):
+        """Test that saving a configuration model reloads the snapshot"""
+        get_config_snapshot()
+        self.ui_config.search_results_per_page = 20
+        self.ui_config.save()
+
+        self.assertEqual(get_config_snapshot().search_results_per_page, 20)
+
+    def test_get_config_snapshot_shared_version(self):
+        """Test that a version bumped by another worker reloads the
+            snapshot once the check interval has passed"""
+        config = get_config_snapshot()
+        caches['shared'].incr(CONFIG_VERSION_KEY)
+        snapshot._checked_at = float('-inf')
+
+        self.assertIsNot(get_config_snapshot(), config)
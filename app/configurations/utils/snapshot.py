@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger('dict_config_logger')
+
+CONFIG_VERSION_KEY = 'xds:config-version'
+
+_snapshot = None
+_checked_at = 0.0
+_snapshot_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Immutable view of the XDS configuration models used by the search and
+        XIS request paths. Model instances held here must be treated as read
+        only."""
+    version: int = 0
+    xds_configuration: object = None
+    ui_configuration: object = None
+    course_mapping: object = None
+    search_fields: tuple = ()
+    search_filters: tuple = ()
+    sort_fields: frozenset = field(default_factory=frozenset)
+    card_fields: tuple = ()
+    organization_filters: tuple = ()
+
+    @property
+    def target_xse_host(self):
+        return self.xds_configuration.target_xse_host
+
+    @property
+    def target_xse_index(self):
+        return self.xds_configuration.target_xse_index
+
+    @property
+    def target_xis_metadata_api(self):
+        return self.xds_configuration.target_xis_metadata_api
+
+    @property
+    def search_results_per_page(self):
+        return self.ui_configuration.search_results_per_page
+
+    @property
+    def track_total_hits(self):
+        # None counts every hit exactly
+        threshold = self.ui_configuration.track_total_hits
+
+        return True if threshold is None else threshold
+
+    @property
+    def exact_total_on_last_page(self):
+        return self.ui_configuration.exact_total_on_last_page
+
+    def get_search_filter(self, display_name):
+        """Returns the active search filter with the given display name"""
+        for search_filter in self.search_filters:
+            if search_filter.display_name == display_name:
+                return search_filter
+
+        return None
+
+
+def _shared_version():
+    """This helper method returns the configuration version shared by every
+        worker, initialising it when missing"""
+    cache = caches['shared']
+    cache.add(CONFIG_VERSION_KEY, 0, timeout=None)
+    version = cache.get(CONFIG_VERSION_KEY)
+
+    return 0 if version is None else version
+
+
+def _card_fields(course_mapping, highlights):
+    """This helper method returns the sorted _source fields rendered on a
+        result card, the mapped course fields plus the active highlights"""
+    fields = set(highlights)
+
+    if course_mapping is not None:
+        for mapping_field in course_mapping._meta.concrete_fields:
+            if mapping_field.get_internal_type() == 'CharField':
+                fields.add(getattr(course_mapping, mapping_field.name))
+
+    return tuple(sorted(name for name in fields if name))
+
+
+def load_config_snapshot(version=0):
+    """This method loads every configuration model used on the request path
+        into a new ConfigSnapshot"""
+    from configurations.models import (CourseInformationMapping,
+                                       XDSConfiguration, XDSUIConfiguration)
+    from core.models import (CourseDetailHighlight, SearchField,
+                             SearchFilter, SearchSortOption)
+    from users.models import Organization
+
+    course_mapping = CourseInformationMapping.objects.first()
+
+    return ConfigSnapshot(
+        version=version,
+        xds_configuration=XDSConfiguration.objects.first(),
+        ui_configuration=XDSUIConfiguration.objects.first(),
+        course_mapping=course_mapping,
+        search_fields=tuple(SearchField.objects.filter(active=True)
+                            .values_list('field_name', flat=True)),
+        search_filters=tuple(SearchFilter.objects.filter(active=True)),
+        sort_fields=frozenset(SearchSortOption.objects.filter(active=True)
+                              .values_list('field_name', flat=True)),
+        card_fields=_card_fields(
+            course_mapping,
+            CourseDetailHighlight.objects.filter(active=True)
+            .values_list('field_name', flat=True)),
+        organization_filters=tuple(sorted(
+            Organization.objects.values_list('filter', flat=True))),
+    )
+
+
+def get_config_snapshot():
+    """This method returns the configuration snapshot cached by this worker.
+        The shared version is checked at most once every
+        CONFIG_SNAPSHOT_CHECK_INTERVAL seconds and the snapshot is reloaded
+        when another worker has bumped it."""
+    global _snapshot, _checked_at
+
+    snapshot = _snapshot
+    now = time.monotonic()
+
+    if snapshot is not None and \
+            now - _checked_at < settings.CONFIG_SNAPSHOT_CHECK_INTERVAL:
+        return snapshot
+
+    with _snapshot_lock:
+        version = _shared_version()
+
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = load_config_snapshot(version)
+            logger.info('Loaded configuration snapshot version %s', version)
+
+        _checked_at = now
+
+        return _snapshot
+
+
+def invalidate_config_snapshot():
+    """This method drops this worker's snapshot and bumps the shared version
+        so every other worker reloads on its next check"""
+    global _snapshot
+
+    cache = caches['shared']
+
+    try:
+        cache.incr(CONFIG_VERSION_KEY)
+    except ValueError:
+        cache.set(CONFIG_VERSION_KEY, 1, timeout=None)
+
+    with _snapshot_lock:
+        _snapshot = None
@@ -8,3 +8,7 @@ class CoreConfig(AppConfig):
         super(CoreConfig, self).ready()
         import core.signals
         core.signals.interest_list_notify
+        from health_check.plugins import plugin_dir
+
+        from core.health_checks import CircuitBreakerHealthCheck
+        plugin_dir.register(CircuitBreakerHealthCheck)
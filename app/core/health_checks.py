@@ -0,0 +1,24 @@
+from health_check.backends import BaseHealthCheckBackend
+from health_check.exceptions import ServiceWarning
+
+from core.utils.breaker import CLOSED, breaker_stats
+
+
+class CircuitBreakerHealthCheck(BaseHealthCheckBackend):
+    """Reports the Elasticsearch nodes, XIS and LRS whose circuit breaker is
+        open or probing for recovery"""
+    # XDS keeps serving, from stale copies where it can, while a circuit is
+    # open
+    critical_service = False
+
+    def check_status(self):
+        tripped = [f'{name} ({stats["state"]})'
+                   for name, stats in breaker_stats().items()
+                   if stats['state'] != CLOSED]
+
+        if tripped:
+            self.add_error(ServiceWarning(
+                'circuit breaker tripped for ' + ', '.join(tripped)))
+
+    def identifier(self):
+        return 'CircuitBreakers'
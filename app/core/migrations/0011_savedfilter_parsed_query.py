@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alter_interestlist_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='savedfilter',
+            name='parsed_query',
+            field=models.JSONField(blank=True, editable=False, help_text='query parsed into its keyword, page, sort and filters', null=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from configurations.models import XDSUIConfiguration
+from core.utils.saved_filters import parse_search_query
 from django.conf import settings
 from django.core.validators import MinValueValidator
 from django.db import models
@@ -212,3 +213,20 @@ class SavedFilter(TimeStampedModel):
                             help_text="Enter the name of the filter")
     query = models.CharField(max_length=200,
                              help_text="queryString for the filter")
+    parsed_query = models.JSONField(
+        null=True, blank=True, editable=False,
+        help_text="query parsed into its keyword, page, sort and filters")
+
+    def get_parsed_query(self):
+        """Returns the parsed query, parsing and storing it for filters
+            saved before it was kept on the model"""
+        if self.parsed_query is None:
+            self.parsed_query = parse_search_query(self.query)
+            SavedFilter.objects.filter(pk=self.pk) \
+                .update(parsed_query=self.parsed_query)
+
+        return self.parsed_query
+
+    def save(self, *args, **kwargs):
+        self.parsed_query = parse_search_query(self.query)
+        return super(SavedFilter, self).save(*args, **kwargs)
@@ -0,0 +1,261 @@
+import asyncio
+import threading
+from unittest.mock import Mock, patch
+
+from asgiref.sync import async_to_sync
+from core.health_checks import CircuitBreakerHealthCheck
+from core.utils.breaker import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker,
+                                CircuitOpenError)
+from core.utils.coalesce import SingleFlight
+from core.utils.materialize import MaterializedPayload
+from django.core.cache import caches
+from django.test import TestCase, override_settings, tag
+
+
+@tag('unit')
+class SingleFlightTests(TestCase):
+
+    def test_do_coalesces_concurrent_calls(self):
+        """Test that concurrent callers for the same key share one call"""
+        flight = SingleFlight('test')
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def upstream():
+            started.set()
+            release.wait(5)
+            return 'value'
+
+        func = Mock(side_effect=upstream)
+        leader = threading.Thread(
+            target=lambda: results.append(flight.do('key', func)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(
+            target=lambda: results.append(flight.do('key', func)))
+            for _ in range(4)]
+
+        for follower in followers:
+            follower.start()
+
+        # wait until every follower is waiting on the leader's call
+        while flight.stats()['coalesced'] < 4:
+            threading.Event().wait(0.01)
+
+        release.set()
+
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(flight.stats(), {'calls': 1, 'coalesced': 4,
+                                          'shared': 0, 'in_flight': 0})
+
+    def test_do_sequential_calls(self):
+        """Test that calls which do not overlap are not coalesced"""
+        flight = SingleFlight('test')
+        func = Mock(side_effect=['first', 'second'])
+
+        self.assertEqual(flight.do('key', func), 'first')
+        self.assertEqual(flight.do('key', func), 'second')
+
+    def test_do_raises_error(self):
+        """Test that a failed call raises its error and is not kept"""
+        flight = SingleFlight('test')
+
+        self.assertRaises(ValueError, flight.do, 'key',
+                          Mock(side_effect=ValueError))
+        self.assertEqual(flight.do('key', lambda: 'value'), 'value')
+
+    @override_settings(SINGLE_FLIGHT_SHARED=True)
+    def test_do_shared_result(self):
+        """Test that a result published by another worker is reused"""
+        flight = SingleFlight('test')
+        func = Mock(return_value='value')
+        lock_key, result_key = flight._shared_keys('key')
+        caches['shared'].set(result_key, 'other worker', 2)
+
+        self.assertEqual(flight.do('key', func), 'other worker')
+        self.assertEqual(func.call_count, 0)
+        self.assertEqual(flight.stats()['shared'], 1)
+
+    @override_settings(SINGLE_FLIGHT_SHARED=True, SINGLE_FLIGHT_LOCK_TIMEOUT=0)
+    def test_do_shared_lock_timeout(self):
+        """Test that the call is made when the worker holding the lock never
+            publishes a result"""
+        flight = SingleFlight('test')
+        lock_key, result_key = flight._shared_keys('key')
+        caches['shared'].set(lock_key, 1, 10)
+
+        self.assertEqual(flight.do('key', lambda: 'value'), 'value')
+
+    def test_do_async_coalesces_concurrent_calls(self):
+        """Test that concurrent coroutines for the same key share one call"""
+        flight = SingleFlight('test')
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'value'
+
+        async def run():
+            return await asyncio.gather(
+                *[flight.do_async('key', upstream) for _ in range(3)])
+
+        self.assertEqual(async_to_sync(run)(), ['value'] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()['coalesced'], 2)
+
+
+@tag('unit')
+@override_settings(SPOTLIGHT_REFRESH_INTERVAL=60)
+class MaterializedPayloadTests(TestCase):
+
+    def setUp(self):
+        self.build = Mock(side_effect=['first', 'second'])
+        self.payload = MaterializedPayload('test', self.build,
+                                           'SPOTLIGHT_REFRESH_INTERVAL')
+
+    def test_get_builds_once(self):
+        """Test that the payload is built by the first request only"""
+        with patch.object(self.payload, 'refresh_in_background') as refresh:
+            self.assertEqual(self.payload.get(), 'first')
+            self.assertEqual(self.payload.get(), 'first')
+
+            self.assertEqual(self.build.call_count, 1)
+            refresh.assert_not_called()
+
+    def test_get_stale_payload(self):
+        """Test that a stale payload is served while it is refreshed in
+            the background"""
+        self.payload.refresh()
+
+        with patch.object(self.payload, 'refresh_in_background') as refresh, \
+                override_settings(SPOTLIGHT_REFRESH_INTERVAL=0):
+            self.assertEqual(self.payload.get(), 'first')
+
+            refresh.assert_called_once()
+
+    def test_invalidate(self):
+        """Test that an invalidated payload is served while it is refreshed
+            in the background"""
+        self.payload.refresh()
+
+        with patch.object(self.payload, 'refresh_in_background') as refresh:
+            self.payload.invalidate()
+            self.assertEqual(self.payload.get(), 'first')
+
+            self.assertEqual(refresh.call_count, 2)
+
+    def test_refresh_in_background_once(self):
+        """Test that only one background refresh runs at a time"""
+        with patch('core.utils.materialize.threading.Thread') as thread:
+            self.assertTrue(self.payload.refresh_in_background())
+            self.assertFalse(self.payload.refresh_in_background())
+
+            thread.return_value.start.assert_called_once()
+
+    def test_background_refresh_error(self):
+        """Test that a failed background refresh keeps the stale payload"""
+        self.payload.refresh()
+        self.build.side_effect = ValueError
+
+        with patch('core.utils.materialize.connections'), \
+                patch('core.utils.materialize.threading.Thread'):
+            self.payload.refresh_in_background()
+            self.payload._background_refresh()
+
+            self.assertEqual(self.payload.get(), 'first')
+            self.assertTrue(self.payload.refresh_in_background())
+
+
+@tag('unit')
+@override_settings(BREAKER_MIN_CALLS=2, BREAKER_FAILURE_RATE=0.5,
+                   BREAKER_WINDOW=30, BREAKER_SLOW_CALL=5,
+                   BREAKER_OPEN_SECONDS=30, BREAKER_CHECK_INTERVAL=0)
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('test')
+
+    def trip(self):
+        for _ in range(2):
+            self.assertRaises(ValueError, self.breaker.call,
+                              Mock(side_effect=ValueError))
+
+    def test_trips_on_failures(self):
+        """Test that the circuit opens for every worker once enough calls
+            failed, and calls then fail fast"""
+        self.trip()
+        func = Mock()
+
+        self.assertEqual(CircuitBreaker('test').state(), OPEN)
+        self.assertRaises(CircuitOpenError, self.breaker.call, func)
+        self.assertEqual(func.call_count, 0)
+        self.assertEqual(self.breaker.stats()['rejected'], 1)
+
+    def test_stays_closed_below_rate(self):
+        """Test that the circuit stays closed while most calls succeed"""
+        for _ in range(3):
+            self.breaker.call(lambda: 'value')
+
+        self.assertRaises(ValueError, self.breaker.call,
+                          Mock(side_effect=ValueError))
+        self.assertEqual(self.breaker.state(), CLOSED)
+
+    def test_failed_result(self):
+        """Test that results rejected by failed count as failures"""
+        for _ in range(2):
+            self.breaker.call(lambda: 500, failed=lambda status: status >= 500)
+
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_slow_calls(self):
+        """Test that calls slower than BREAKER_SLOW_CALL count as
+            failures"""
+        with override_settings(BREAKER_SLOW_CALL=-1):
+            for _ in range(2):
+                self.breaker.call(lambda: 'value')
+
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_probe_closes(self):
+        """Test that a single probe is let through once the circuit is
+            half-open and closes it when it succeeds"""
+        self.trip()
+
+        with override_settings(BREAKER_OPEN_SECONDS=0):
+            self.breaker.trip()
+            self.assertEqual(self.breaker.state(), HALF_OPEN)
+            self.assertTrue(self.breaker.before_call())
+            self.assertRaises(CircuitOpenError, self.breaker.before_call)
+            self.breaker.after_call(True, False)
+
+        self.assertEqual(self.breaker.state(), CLOSED)
+        self.assertEqual(self.breaker.call(lambda: 'value'), 'value')
+
+    def test_probe_reopens(self):
+        """Test that a failed probe opens the circuit again"""
+        with override_settings(BREAKER_OPEN_SECONDS=0):
+            self.trip()
+
+        self.assertEqual(self.breaker.state(), HALF_OPEN)
+        self.assertRaises(ValueError, self.breaker.call,
+                          Mock(side_effect=ValueError))
+        self.assertEqual(self.breaker.state(), OPEN)
+
+    def test_health_check(self):
+        """Test that open circuits are reported by the health check"""
+        check = CircuitBreakerHealthCheck()
+
+        with patch('core.health_checks.breaker_stats') as stats:
+            stats.return_value = {'xis': {'state': CLOSED}}
+            check.run_check()
+            self.assertEqual(check.errors, [])
+
+            stats.return_value = {'xis': {'state': OPEN}}
+            check.run_check()
+            self.assertIn('xis (open)', str(check.errors[0]))
@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger('dict_config_logger')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# shared cache key listing the circuits that were opened by any worker
+NAMES_KEY = 'xds:breakers'
+
+# name -> CircuitBreaker of this worker
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+    def __init__(self, name):
+        super().__init__(f'Circuit to {name} is open')
+        self.name = name
+
+
+class CircuitBreaker():
+    """Trips when too many of the recent calls a worker made to an upstream
+        failed or were slow. The open circuit is kept in the shared cache so
+        that every worker fails fast, until BREAKER_OPEN_SECONDS later a
+        single probe call succeeds and closes it again."""
+
+    def __init__(self, name, open_error=CircuitOpenError):
+        self.name = name
+        self.open_error = open_error
+        self.key = f'xds:breaker:{name}'
+        self._probe_key = self.key + ':probe'
+        self._outcomes = deque()
+        self._lock = threading.Lock()
+        # (checked_at, shared open circuit or None)
+        self._checked = None
+        self.rejected = 0
+
+    def _opened(self):
+        """This helper method returns the shared open circuit, read at most
+            once every BREAKER_CHECK_INTERVAL seconds per worker"""
+        now = time.monotonic()
+        checked = self._checked
+
+        if checked is not None and \
+                now - checked[0] < settings.BREAKER_CHECK_INTERVAL:
+            return checked[1]
+
+        opened = caches['shared'].get(self.key)
+        self._checked = (now, opened)
+
+        return opened
+
+    def known_closed(self):
+        """Returns whether the circuit was recently checked and found closed,
+            so a call may be made without reading the shared cache"""
+        checked = self._checked
+
+        return checked is not None and checked[1] is None and \
+            time.monotonic() - checked[0] < settings.BREAKER_CHECK_INTERVAL
+
+    def state(self):
+        """Returns whether the circuit is closed, open or half-open, when a
+            probe call may be made"""
+        opened = self._opened()
+
+        if opened is None:
+            return CLOSED
+
+        return HALF_OPEN if time.time() >= opened['retry_at'] else OPEN
+
+    def before_call(self):
+        """Raises open_error unless a call may be made, returns whether the
+            call is the probe of a half-open circuit"""
+        state = self.state()
+
+        if state == CLOSED:
+            return False
+
+        # a single worker probes the upstream, the others keep failing fast
+        if state == HALF_OPEN and caches['shared'].add(
+                self._probe_key, 1, settings.BREAKER_PROBE_TIMEOUT):
+            return True
+
+        self.rejected += 1
+        raise self.open_error(self.name)
+
+    def after_call(self, probe, failed):
+        """Records the outcome of a call, tripping the circuit when too many
+            of the recent calls failed"""
+        if probe:
+            caches['shared'].delete(self._probe_key)
+
+            if failed:
+                self.trip()
+            else:
+                self.reset()
+
+            return
+
+        now = time.monotonic()
+
+        with self._lock:
+            self._outcomes.append((now, failed))
+
+            while self._outcomes[0][0] <= now - settings.BREAKER_WINDOW:
+                self._outcomes.popleft()
+
+            calls = len(self._outcomes)
+            failures = sum(1 for outcome in self._outcomes if outcome[1])
+
+        if failed and calls >= settings.BREAKER_MIN_CALLS and \
+                failures / calls >= settings.BREAKER_FAILURE_RATE:
+            self.trip()
+
+    def is_slow(self, started):
+        """Returns whether a call started at the given monotonic time took
+            long enough to count as a failure"""
+        return time.monotonic() - started > settings.BREAKER_SLOW_CALL
+
+    def call(self, func, failed=None):
+        """Returns func(), unless the circuit is open. The call fails when it
+            raises, is slow, or failed(result) is true."""
+        probe = self.before_call()
+        started = time.monotonic()
+
+        try:
+            result = func()
+        except Exception:
+            self.after_call(probe, True)
+            raise
+
+        self.after_call(probe, self.is_slow(started) or
+                        (failed is not None and failed(result)))
+
+        return result
+
+    async def before_call_async(self):
+        """Coroutine variant of before_call for the async clients, the
+            shared cache is only read in a thread when it has to be"""
+        if self.known_closed():
+            return False
+
+        return await sync_to_async(self.before_call)()
+
+    async def after_call_async(self, probe, failed):
+        """Coroutine variant of after_call"""
+        # only a probe or a failure may write to the shared cache
+        if probe or failed:
+            await sync_to_async(self.after_call)(probe, failed)
+        else:
+            self.after_call(probe, failed)
+
+    def trip(self):
+        """Opens the circuit for every worker"""
+        now = time.time()
+        opened = {'opened_at': now,
+                  'retry_at': now + settings.BREAKER_OPEN_SECONDS}
+        caches['shared'].set(self.key, opened, None)
+        self._checked = (time.monotonic(), opened)
+        # the circuit is listed for the health check of every worker
+        names = caches['shared'].get(NAMES_KEY, [])
+
+        if self.name not in names:
+            caches['shared'].set(NAMES_KEY, names + [self.name], None)
+
+        with self._lock:
+            self._outcomes.clear()
+
+        logger.warning(f'Circuit to {self.name} opened')
+
+    def reset(self):
+        """Closes the circuit for every worker"""
+        caches['shared'].delete(self.key)
+        self._checked = (time.monotonic(), None)
+
+        with self._lock:
+            self._outcomes.clear()
+
+        logger.info(f'Circuit to {self.name} closed')
+
+    def stats(self):
+        """Returns the state of the circuit and the calls it rejected in this
+            worker"""
+        opened = self._opened()
+
+        return {
+            'state': self.state(),
+            'opened_at': None if opened is None else opened['opened_at'],
+            'rejected': self.rejected,
+        }
+
+
+def get_breaker(name, open_error=CircuitOpenError):
+    """This method returns the circuit breaker of an upstream, creating it
+        the first time it is requested in the worker"""
+    breaker = _breakers.get(name)
+
+    if breaker is not None:
+        return breaker
+
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, open_error)
+
+    return _breakers[name]
+
+
+def breaker_stats():
+    """This method returns the stats of the breakers of this worker and of
+        every circuit that was opened by any worker"""
+    names = set(_breakers) | set(caches['shared'].get(NAMES_KEY, []))
+
+    # circuits only opened by other workers are not registered here, so that
+    # their breaker is later created with the open error of its upstream
+    return {name: (_breakers.get(name) or CircuitBreaker(name)).stats()
+            for name in sorted(names)}
+
+
+def mark_stale(response, age):
+    """This method adds the headers of a response served from a stale copy
+        while the circuit of its upstream is open, age is None when the
+        response is fresh"""
+    if age is not None:
+        response['Age'] = str(age)
+        response['Warning'] = '110 - "Response is Stale"'
+
+    return response
@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger('dict_config_logger')
+
+
+class _Call():
+    """An upstream call in flight that other callers can wait on"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    """Coalesces concurrent identical upstream calls. Callers asking for a
+        key that is already being fetched wait for that call and share its
+        result instead of making their own. With SINGLE_FLIGHT_SHARED set,
+        workers also share calls through a short lock in the shared cache."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.shared = 0
+
+    def do(self, key, func):
+        """Returns func(), or the result of the identical call for key that
+            is already in flight in this worker"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, func)
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    async def do_async(self, key, coro_func):
+        """Coroutine variant of do for the async views, callers on the same
+            event loop share the awaited result of coro_func()"""
+        task = self._tasks.get(key)
+
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.calls += 1
+        task = self._tasks[key] = asyncio.ensure_future(coro_func())
+
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def _shared_keys(self, key):
+        """This helper method returns the shared cache keys used to coalesce
+            a call across workers"""
+        digest = hashlib.sha1(str(key).encode('utf-8')).hexdigest()
+        prefix = f'xds:flight:{self.name}:{digest}'
+
+        return prefix + ':lock', prefix + ':result'
+
+    def _run_shared(self, key, func):
+        """This helper method makes the upstream call, first waiting for an
+            identical call already made by another worker when enabled"""
+        if not settings.SINGLE_FLIGHT_SHARED:
+            return self._call(func)
+
+        cache = caches['shared']
+        lock_key, result_key = self._shared_keys(key)
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_LOCK_TIMEOUT
+
+        while True:
+            result = cache.get(result_key)
+
+            if result is not None:
+                self.shared += 1
+                return result
+
+            if cache.add(lock_key, 1, settings.SINGLE_FLIGHT_LOCK_TIMEOUT):
+                break
+
+            # the worker holding the lock failed to publish in time
+            if time.monotonic() >= deadline:
+                return self._call(func)
+
+            time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+
+        try:
+            result = self._call(func)
+            cache.set(result_key, result, settings.SINGLE_FLIGHT_RESULT_TTL)
+        finally:
+            cache.delete(lock_key)
+
+        return result
+
+    def _call(self, func):
+        self.calls += 1
+
+        return func()
+
+    def stats(self):
+        """Returns the number of upstream calls made and of callers that
+            shared another caller's call"""
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'shared': self.shared,
+            'in_flight': len(self._calls) + len(self._tasks),
+        }
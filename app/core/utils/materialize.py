@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+from core.utils.coalesce import SingleFlight
+
+logger = logging.getLogger('dict_config_logger')
+
+
+class MaterializedPayload():
+    """A small, rarely changing payload built once and kept in the shared
+        cache for every worker. Once older than its refresh interval, or
+        after invalidate is called, the stale payload keeps being served
+        while a single worker rebuilds it in the background."""
+
+    def __init__(self, name, build, interval_setting):
+        self.name = name
+        self.build = build
+        self.interval_setting = interval_setting
+        self.key = f'xds:materialized:{name}'
+        self._version_key = self.key + ':version'
+        self._refresh_key = self.key + ':refresh'
+        self._flight = SingleFlight(f'materialized:{name}')
+
+    def get(self):
+        """Returns the payload, only building it in the request when no
+            worker has built it yet"""
+        cache = caches['shared']
+        found = cache.get_many([self.key, self._version_key])
+        entry = found.get(self.key)
+
+        if entry is None:
+            return self._flight.do(self.key, self.refresh)
+
+        max_age = getattr(settings, self.interval_setting)
+
+        if entry['version'] != found.get(self._version_key, 0) or \
+                time.time() - entry['built'] >= max_age:
+            self.refresh_in_background()
+
+        return entry['payload']
+
+    def refresh(self):
+        """Builds the payload and stores it for every worker"""
+        cache = caches['shared']
+        # the version is read before building so a change made during the
+        # build leaves the stored payload stale
+        version = cache.get(self._version_key, 0)
+        payload = self.build()
+        cache.set(self.key, {'payload': payload, 'built': time.time(),
+                             'version': version}, None)
+
+        return payload
+
+    def refresh_in_background(self):
+        """Starts rebuilding the payload in a background thread unless a
+            worker is already rebuilding it, returns whether it started"""
+        if not caches['shared'].add(self._refresh_key, 1,
+                                    settings.MATERIALIZED_REFRESH_TIMEOUT):
+            return False
+
+        threading.Thread(target=self._background_refresh,
+                         name=f'refresh-{self.name}', daemon=True).start()
+
+        return True
+
+    def invalidate(self):
+        """Marks the stored payload stale in every worker and starts
+            rebuilding it"""
+        cache = caches['shared']
+
+        if not cache.add(self._version_key, 1, None):
+            cache.incr(self._version_key)
+
+        self.refresh_in_background()
+
+    def _background_refresh(self):
+        """This helper method rebuilds the payload, keeping the stale copy
+            when the build fails"""
+        try:
+            self.refresh()
+        except Exception as err:
+            logger.error(f'Could not refresh {self.name}: {err}')
+        finally:
+            caches['shared'].delete(self._refresh_key)
+            # the thread's database connections are not reused
+            connections.close_all()
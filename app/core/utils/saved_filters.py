@@ -0,0 +1,21 @@
+from django.http import QueryDict
+
+# query string parameters of /es-api/ that are not search filters
+SEARCH_PARAMETERS = ('keyword', 'p', 'sort', 'cursor', 'facets',
+                     'projection', 'profile')
+
+
+def parse_search_query(query):
+    """This method parses the /es-api/ query string of a saved filter into
+        its keyword, page, sort and filter values, in the form stored on the
+        SavedFilter"""
+    params = QueryDict(query.split('?', 1)[-1])
+
+    return {
+        'keyword': params.get('keyword', ''),
+        'page': params.get('p') or '1',
+        'sort': params.get('sort', ''),
+        'filters': {name: params.getlist(name) for name in sorted(params)
+                    if name not in SEARCH_PARAMETERS and
+                    any(params.getlist(name))},
+    }
@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class EsApiConfig(AppConfig):
     name = 'es_api'
+
+    def ready(self):
+        import es_api.signals
+        es_api.signals.organizations_changed
+        return super().ready()
@@ -0,0 +1,336 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from configurations.utils.snapshot import get_config_snapshot
+from core.utils.breaker import mark_stale
+from es_api import views
+from es_api.utils.async_queries import AsyncXSEQueries
+from es_api.utils.cache import (async_cached_search, facet_cache,
+                                search_result_cache)
+from es_api.utils.pagination import InvalidCursorError
+from es_api.utils.profiling import NULL_TIMER, request_timer
+
+logger = logging.getLogger('dict_config_logger')
+
+CONTACT_ADMIN = views.CONTACT_ADMIN
+
+
+class AsyncAPIView(APIView):
+    """APIView whose handlers are coroutines. Authentication, permission and
+        throttle checks run before the handler as in APIView, in a worker
+        thread as they may query the database, and exceptions are handled by
+        the DRF exception handler."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(),
+                                  self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+
+            # options and not allowed methods are answered synchronously
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args,
+                                               **kwargs)
+        return self.response
+
+
+async def _get_queries(request, with_user=True, timer=NULL_TIMER):
+    """This helper method returns the config snapshot and an AsyncXSEQueries
+        for the configured host and index"""
+    with timer.phase('config'):
+        config = await sync_to_async(get_config_snapshot)()
+
+    kwargs = {'timer': timer}
+
+    if with_user:
+        kwargs['user'] = request.user
+        kwargs['projection'] = request.GET.get('projection')
+
+    queries = AsyncXSEQueries(config.target_xse_host,
+                              config.target_xse_index, **kwargs)
+
+    return config, queries
+
+
+async def _get_results(queries, search, **kwargs):
+    """This helper method awaits one of the AsyncXSEQueries search methods
+        and returns its results JSON"""
+    response = await search(**kwargs)
+
+    return await sync_to_async(queries.get_results)(response)
+
+
+def _error_response(message):
+    """This helper method returns the JSON server error used by the views"""
+    return Response({"message": message},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _bad_request(message):
+    """This helper method returns the JSON bad request used by the views"""
+    return Response({"message": message}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _results_response(timer, results, age=None):
+    """This helper method returns the results JSON of a search as is"""
+    logger.info(results)
+
+    return timer.finish(mark_stale(HttpResponse(
+        results, content_type="application/json"), age))
+
+
+class SearchIndexView(AsyncAPIView, views.SearchIndexView):
+    """This method defines an async API for sending keyword queries to
+            ElasticSearch without using a model"""
+
+    async def get(self, request):
+        timer = request_timer(request)
+
+        keyword, filters = self.get_request_attributes(request)
+        # facets=false skips the filter aggregations when only paging
+        facets = request.GET.get('facets', '').lower() != 'false'
+
+        if keyword == '':
+            return _bad_request("Request is missing 'keyword' query paramater")
+
+        try:
+            config, queries = await _get_queries(request, timer=timer)
+            self.add_config_filters(request, config, filters)
+
+            def search():
+                return _get_results(queries, queries.search_by_keyword,
+                                    keyword=keyword, filters=filters,
+                                    facets=facets)
+
+            if 'cursor' in filters:
+                # cursor pages belong to a single point in time
+                return _results_response(timer, await search())
+
+            # drop cached results if the index contents changed
+            search_result_cache.sync_generation(
+                await queries.index_generation())
+            key = await sync_to_async(queries.search_cache_key)(
+                'keyword' if facets else 'keyword-hits', keyword, filters)
+            results, age = await async_cached_search(
+                key, search, cache=search_result_cache,
+                profile=timer.profile)
+        except InvalidCursorError as cursor_err:
+            return _bad_request(str(cursor_err))
+        except Exception as err:
+            logger.error(err)
+            return _error_response("error executing ElasticSearch query; " +
+                                   CONTACT_ADMIN)
+
+        return _results_response(timer, results, age)
+
+
+class FacetsView(AsyncAPIView, views.FacetsView):
+    """This method defines an async API for fetching the filter aggregations
+            of a keyword search without its hits"""
+
+    async def get(self, request):
+        timer = request_timer(request)
+
+        if request.GET.get('keyword', '') == '':
+            return _bad_request("Request is missing 'keyword' query paramater")
+
+        try:
+            config, queries = await _get_queries(request, timer=timer)
+            keyword, filters = self.get_request_attributes(request, config)
+
+            async def search():
+                response = await queries.search_facets(keyword=keyword,
+                                                       filters=filters)
+
+                return await sync_to_async(queries.get_facets)(response)
+
+            # drop cached facets if the index contents changed
+            facet_cache.sync_generation(await queries.index_generation())
+            key = await sync_to_async(queries.search_cache_key)(
+                'facets', keyword, filters)
+            results, age = await async_cached_search(
+                key, search, cache=facet_cache, profile=timer.profile)
+        except Exception as err:
+            logger.error(err)
+            return _error_response("error executing ElasticSearch query; " +
+                                   CONTACT_ADMIN)
+
+        return _results_response(timer, results, age)
+
+
+class SearchDerivedView(AsyncAPIView, views.SearchDerivedView):
+    """This method defines an async API for querying to ElasticSearch
+            for derived experiences"""
+
+    async def get(self, request):
+        timer = request_timer(request)
+
+        reference, filters = self.get_request_attributes(request)
+
+        if reference == '':
+            return _bad_request("Request is missing 'reference' query " +
+                                "parameter")
+
+        try:
+            config, queries = await _get_queries(request, timer=timer)
+            results = await _get_results(
+                queries, queries.search_for_derived, reference=reference,
+                filters=filters)
+        except InvalidCursorError as cursor_err:
+            return _bad_request(str(cursor_err))
+        except Exception as err:
+            logger.error(err)
+            return _error_response("error executing ElasticSearch query; " +
+                                   CONTACT_ADMIN)
+
+        return _results_response(timer, results)
+
+
+class SearchCompetencyView(AsyncAPIView, views.SearchCompetencyView):
+    """This method defines an async API for querying to ElasticSearch
+            for competencies"""
+
+    async def get(self, request):
+        timer = request_timer(request)
+
+        reference, filters = self.get_request_attributes(request)
+
+        if reference == '':
+            return _bad_request("Request is missing 'reference' query " +
+                                "parameter")
+
+        try:
+            config, queries = await _get_queries(request, timer=timer)
+            results = await _get_results(
+                queries, queries.search_by_competency, comp_uuid=reference,
+                filters=filters)
+        except InvalidCursorError as cursor_err:
+            return _bad_request(str(cursor_err))
+        except Exception as err:
+            logger.error(err)
+            return _error_response("error executing ElasticSearch query; " +
+                                   CONTACT_ADMIN)
+
+        return _results_response(timer, results)
+
+
+class GetMoreLikeThisView(AsyncAPIView, views.GetMoreLikeThisView):
+    """This method defines an async API for fetching results using the
+            more_like_this feature from elasticsearch for
+            more like this courses section of UI. """
+
+    async def get(self, request, doc_id):
+        timer = request_timer(request)
+
+        try:
+            config, queries = await _get_queries(request, timer=timer)
+            key = await sync_to_async(queries.search_cache_key)(
+                'more-like-this', doc_id)
+
+            def search():
+                return _get_results(queries, queries.more_like_this,
+                                    doc_id=doc_id)
+
+            results, age = await async_cached_search(key, search,
+                                                     profile=timer.profile)
+        except Exception as err:
+            logger.error(err)
+            return _error_response("error executing ElasticSearch query; " +
+                                   "please check the logs")
+
+        return _results_response(timer, results, age)
+
+
+class GetSimilarCoursesView(AsyncAPIView, views.GetSimilarCoursesView):
+    """This method defines an async API for fetching results by sending key
+            words to elasticsearch and looking for similar courses. """
+
+    async def get(self, request, key):
+        timer = request_timer(request)
+
+        if key == '':
+            return _bad_request("Request is missing 'key' query parameter")
+
+        try:
+            config, queries = await _get_queries(request, timer=timer)
+            cache_key = await sync_to_async(queries.search_cache_key)(
+                'similar-courses', key)
+
+            def search():
+                return _get_results(queries, queries.similar_courses,
+                                    keyword=key)
+
+            results, age = await async_cached_search(cache_key, search,
+                                                     profile=timer.profile)
+        except Exception as err:
+            logger.error(err)
+            return _error_response("error executing ElasticSearch query; " +
+                                   CONTACT_ADMIN)
+
+        return _results_response(timer, results, age)
+
+
+class FiltersView(AsyncAPIView, views.FiltersView):
+    """This method defines an async API for performing a filter search"""
+
+    async def get(self, request):
+        timer = request_timer(request)
+
+        try:
+            config, queries = await _get_queries(request, timer=timer)
+            page_num, filters = self.get_request_attributes(request, config)
+            results = await _get_results(
+                queries, queries.search_by_filters, page_num=page_num,
+                filters=filters)
+        except Exception as err:
+            logger.error(err)
+            return _error_response("error executing ElasticSearch query; " +
+                                   CONTACT_ADMIN)
+
+        return _results_response(timer, results)
+
+
+class SuggestionsView(AsyncAPIView, views.SuggestionsView):
+    """
+    This method defines an async API for retrieving suggested items from
+    Elastic
+    """
+
+    async def get(self, request):
+        # if partial not passed in or empty, return failstate
+        if ('partial' not in request.GET or request.GET['partial'] == ''):
+            return Response({"message": "No partial data sent"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            config, queries = await _get_queries(request, with_user=False)
+            results = await queries.cached_suggest(
+                partial=request.GET['partial'])
+
+            return Response(results, status=status.HTTP_200_OK)
+        except Exception as err:
+            logger.error(err)
+            return Response({"message": err.args[0]},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
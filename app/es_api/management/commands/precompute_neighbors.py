@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from configurations.utils.snapshot import get_config_snapshot
+from es_api.utils.neighbors import NeighborsBuilder, full_run_due
+from es_api.utils.queries import XSEQueries
+
+
+class Command(BaseCommand):
+    """This command stores the more like this and similar courses results of
+        every course in the index, run it on a schedule to refresh the
+        courses that changed"""
+    help = ('Store the more like this and similar courses results of the '
+            'courses that changed since the last run, and of the courses '
+            'and keywords whose neighbors changed or were removed. Courses '
+            'added since are only found as neighbors of unchanged courses by '
+            'a full run, made every NEIGHBORS_FULL_INTERVAL seconds or with '
+            '--full.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Recompute the neighbors of every course, not only of the '
+                 'courses that changed since the last run')
+
+    def handle(self, *args, **options):
+        config = get_config_snapshot()
+        computed = NeighborsBuilder(XSEQueries, config.target_xse_host,
+                                    config.target_xse_index,
+                                    full=options['full'] or
+                                    full_run_due()).run()
+        self.stdout.write(
+            self.style.SUCCESS(f"{computed} neighbors computed"))
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:29
+
+from django.db import migrations, models
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('es_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseNeighbors',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', model_utils.fields.AutoCreatedField(default=django.utils.timezone.now, editable=False, verbose_name='created')),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('kind', models.CharField(choices=[('more-like-this', 'More like this'), ('similar-courses', 'Similar courses')], max_length=20)),
+                ('key', models.CharField(help_text='The document ID or keyword the neighbors were computed for', max_length=255)),
+                ('neighbors', models.JSONField(default=list, help_text='The IDs of the neighboring documents, most similar first')),
+                ('version', models.CharField(blank=True, default='', help_text='The version of the document the neighbors were computed from', max_length=50)),
+            ],
+            options={
+                'unique_together': {('kind', 'key')},
+            },
+        ),
+    ]
@@ -1,3 +1,33 @@
-# from django.db import models
+from django.db import models
+from model_utils.models import TimeStampedModel
 
-# Create your models here.
+
+class CourseNeighbors(TimeStampedModel):
+    """Model to store the precomputed results of a more like this or similar
+        courses query"""
+    MORE_LIKE_THIS = 'more-like-this'
+    SIMILAR_COURSES = 'similar-courses'
+    KIND_CHOICES = [
+        (MORE_LIKE_THIS, 'More like this'),
+        (SIMILAR_COURSES, 'Similar courses'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    key = models.CharField(
+        max_length=255,
+        help_text='The document ID or keyword the neighbors were computed '
+                  'for')
+    neighbors = models.JSONField(
+        default=list,
+        help_text='The IDs of the neighboring documents, most similar first')
+    version = models.CharField(
+        max_length=50, blank=True, default='',
+        help_text='The version of the document the neighbors were computed '
+                  'from')
+
+    class Meta:
+        unique_together = ['kind', 'key']
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return f'{self.kind} {self.key}'
@@ -0,0 +1,31 @@
+import logging
+
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from es_api.utils.cache import invalidate_user_organizations
+from users.models import XDSUser
+
+logger = logging.getLogger('dict_config_logger')
+
+
+@receiver(m2m_changed, sender=XDSUser.organizations.through)
+def organizations_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    """Invalidates the cached organization filters of the users whose
+        memberships change"""
+    if not reverse:
+        user_pks = [instance.pk]
+    elif action == 'pre_clear':
+        # the members of a cleared organization are only known before
+        instance._cleared_user_pks = list(
+            instance.xdsuser_set.values_list('pk', flat=True))
+        return
+    elif action == 'post_clear':
+        user_pks = getattr(instance, '_cleared_user_pks', [])
+    else:
+        user_pks = pk_set or []
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        for user_pk in user_pks:
+            invalidate_user_organizations(user_pk)
@@ -1,14 +1,51 @@
+import copy
 import json
-from unittest.mock import Mock, patch
-
-from configurations.models import XDSConfiguration, XDSUIConfiguration
-from core.models import CourseSpotlight, SearchFilter, SearchSortOption
-from django.test import TestCase, tag
-from elasticsearch_dsl import Q, Search
+import logging
+import timeit
+from unittest.mock import AsyncMock, Mock, patch
+
+from asgiref.sync import async_to_sync
+
+from configurations.models import (CourseInformationMapping,
+                                   XDSConfiguration, XDSUIConfiguration)
+from configurations.utils.snapshot import (ConfigSnapshot,
+                                           get_config_snapshot,
+                                           invalidate_config_snapshot)
+from core.models import CourseSpotlight, SavedFilter, SearchFilter
+from core.utils.saved_filters import parse_search_query
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings, tag
+from elasticsearch import ConnectionError as ESConnectionError
+from elasticsearch_dsl import Q, Search, connections
+from es_api.utils.async_queries import AsyncXSEQueries
+from core.utils.breaker import CircuitOpenError
+from es_api.utils.cache import (GenerationalCache, LastGoodCache, LRUCache,
+                                PrefixCache, async_cached_search,
+                                cached_search, get_index_generation,
+                                last_good_cache, make_search_key,
+                                suggest_cache, user_organization_cache,
+                                user_organization_versions)
+from es_api.models import CourseNeighbors
+from es_api.utils.connections import (LeastLatencySelector, NodeStats,
+                                      NodeUnavailableError,
+                                      get_connection_alias, pool_stats,
+                                      reset_connections)
+from es_api.utils.neighbors import (FULL_RUN_KEY, NeighborsBuilder,
+                                    field_values, full_run_due)
+from es_api.utils.profiling import (NULL_TIMER, PhaseStats, PhaseTimer,
+                                    request_timer)
+from es_api.utils.pagination import (InvalidCursorError, decode_cursor,
+                                     encode_cursor)
 from es_api.utils.queries import XSEQueries
+from es_api.utils.saved_filters import search_arguments
+from es_api.utils.serializers import PartialResults, is_cacheable
+from es_api.utils.suggest import derive_suggestions, fuzzy_prefix_match
 from es_api.utils.queries_base import BaseQueries
 from users.models import Organization, XDSUser
 
+logger = logging.getLogger('dict_config_logger')
+
 
 @tag('unit')
 class UtilTests(TestCase):
@@ -28,11 +65,11 @@ class UtilTests(TestCase):
             with patch('elasticsearch_dsl.response.hit.to_dict') as to_dict, \
                     patch(
                         'es_api.utils.queries.'
-                        'SearchFilter.objects') as sfObj, \
+                        'get_config_snapshot') as sfObj, \
                     patch('elasticsearch_dsl.response.aggregations.'
                           'to_dict') as agg:
                 agg.return_value = {}
-                sfObj.return_value = []
+                sfObj.return_value = ConfigSnapshot()
                 to_dict.return_value = {
                     "key": "value"
                 }
@@ -48,7 +85,7 @@ class UtilTests(TestCase):
               search returns"""
         with patch('elasticsearch_dsl.Search.execute') as es_execute, \
                 patch('es_api.utils.queries.'
-                      'CourseInformationMapping.objects'):
+                      'get_config_snapshot'):
             resultVal = {
                 "test": "test"
             }
@@ -65,7 +102,7 @@ class UtilTests(TestCase):
               elastic search returns"""
         with patch('elasticsearch_dsl.Search.execute') as es_execute, \
                 patch('es_api.utils.queries.'
-                      'CourseInformationMapping.objects'):
+                      'get_config_snapshot'):
             resultVal = {
                 "test": "test"
             }
@@ -80,19 +117,14 @@ class UtilTests(TestCase):
     def test_search_by_keyword_error(self):
         """Test that calling search_by_keyword with a invalid page # \
              (e.g. string) value will throw an error"""
-        with patch('es_api.utils.queries.'
-                   'XDSConfiguration.objects') as xdsCfg, \
-                patch('elasticsearch_dsl.Search.execute') as es_execute, \
-                patch('es_api.utils.queries.SearchFilter.objects') as sfObj, \
-                patch('es_api.utils.queries.'
-                      'CourseInformationMapping.objects'):
+        with patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch('elasticsearch_dsl.Search.execute') as es_execute:
             configObj = XDSConfiguration(target_xis_metadata_api="dsds")
             uiConfigObj = XDSUIConfiguration(search_results_per_page=10,
                                              xds_configuration=configObj)
-            xdsCfg.xdsuiconfiguration = uiConfigObj
-            xdsCfg.first.return_value = configObj
-            sfObj.return_value = []
-            sfObj.filter.return_value = []
+            config.return_value = ConfigSnapshot(
+                xds_configuration=configObj, ui_configuration=uiConfigObj,
+                course_mapping=CourseInformationMapping())
             es_execute.return_value = {
                 "test": "test"
             }
@@ -237,9 +269,8 @@ class UtilTests(TestCase):
         query = XSEQueries('test', 'test')
         query.search = query.search.query(q)
 
-        with patch('es_api.utils.queries.SearchSortOption.objects') as \
-                sortOpts:
-            sortOpts.filter.return_value = []
+        with patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = ConfigSnapshot(sort_fields=frozenset())
             filters = {"test": "Test"}
             hasSort = False
 
@@ -260,13 +291,9 @@ class UtilTests(TestCase):
         query = XSEQueries('test', 'test')
         query.search = query.search.query(q)
 
-        with patch('es_api.utils.queries.SearchSortOption.objects') as \
-                sortOpts:
-            sortOption = SearchSortOption(display_name="test",
-                                          field_name="test-field",
-                                          xds_ui_configuration=None,
-                                          active=True)
-            sortOpts.filter.return_value = [sortOption]
+        with patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = ConfigSnapshot(
+                sort_fields=frozenset(['test-field']))
             filters = {"sort": "test-field"}
             hasSort = False
 
@@ -328,14 +355,13 @@ class UtilTests(TestCase):
 
     def test_search_by_filters(self):
         """Test that calling search_by_filters returns an JSON object"""
-        with patch('es_api.utils.queries.'
-                   'XDSConfiguration.objects') as xdsCfg, \
+        with patch('es_api.utils.queries.get_config_snapshot') as config, \
                 patch('elasticsearch_dsl.Search.execute') as es_execute:
             configObj = XDSConfiguration(target_xis_metadata_api="dsds")
             uiConfigObj = XDSUIConfiguration(search_results_per_page=10,
                                              xds_configuration=configObj)
-            xdsCfg.xdsuiconfiguration = uiConfigObj
-            xdsCfg.first.return_value = configObj
+            config.return_value = ConfigSnapshot(
+                xds_configuration=configObj, ui_configuration=uiConfigObj)
             expected_result = {
                 "test": "test"
             }
@@ -348,20 +374,15 @@ class UtilTests(TestCase):
     def test_search_for_derived(self):
         """Test that calling search_for_derived with a invalid page # \
         (e.g. string) value will throw an error"""
-        with patch('es_api.utils.queries.'
-                   'XDSConfiguration.objects') as xdsCfg, \
-                patch('elasticsearch_dsl.Search.execute') as es_execute, \
-                patch('es_api.utils.queries.SearchFilter.objects') as sfObj, \
-                patch('es_api.utils.queries.'
-                      'CourseInformationMapping.objects') as cimobj:
+        with patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch('elasticsearch_dsl.Search.execute') as es_execute:
             configObj = XDSConfiguration(target_xis_metadata_api="dsds")
             uiConfigObj = XDSUIConfiguration(search_results_per_page=10,
                                              xds_configuration=configObj)
-            cimobj.first().course_derived_from = "test"
-            xdsCfg.xdsuiconfiguration = uiConfigObj
-            xdsCfg.first.return_value = configObj
-            sfObj.return_value = []
-            sfObj.filter.return_value = []
+            config.return_value = ConfigSnapshot(
+                xds_configuration=configObj, ui_configuration=uiConfigObj,
+                course_mapping=CourseInformationMapping(
+                    course_derived_from="test"))
             es_execute.return_value = {
                 "test": "test"
             }
@@ -373,20 +394,15 @@ class UtilTests(TestCase):
     def test_search_by_competency(self):
         """Test that calling search_for_derived with a invalid page # \
         (e.g. string) value will throw an error"""
-        with patch('es_api.utils.queries.'
-                   'XDSConfiguration.objects') as xdsCfg, \
-                patch('elasticsearch_dsl.Search.execute') as es_execute, \
-                patch('es_api.utils.queries.SearchFilter.objects') as sfObj, \
-                patch('es_api.utils.queries.'
-                      'CourseInformationMapping.objects') as cimobj:
+        with patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch('elasticsearch_dsl.Search.execute') as es_execute:
             configObj = XDSConfiguration(target_xis_metadata_api="dsds")
             uiConfigObj = XDSUIConfiguration(search_results_per_page=10,
                                              xds_configuration=configObj)
-            cimobj.first().course_competency = "test"
-            xdsCfg.xdsuiconfiguration = uiConfigObj
-            xdsCfg.first.return_value = configObj
-            sfObj.return_value = []
-            sfObj.filter.return_value = []
+            config.return_value = ConfigSnapshot(
+                xds_configuration=configObj, ui_configuration=uiConfigObj,
+                course_mapping=CourseInformationMapping(
+                    course_competency="test"))
             es_execute.return_value = {
                 "test": "test"
             }
@@ -397,6 +413,12 @@ class UtilTests(TestCase):
 
 
 class XDSUserTests(TestCase):
+    def tearDown(self):
+        # organizations rolled back with the test are still cached
+        invalidate_config_snapshot()
+        user_organization_cache.clear()
+        user_organization_versions.clear()
+
     def test_user_org_filter_blank(self):
         """
         Test that user_organization_filtering returns a default Search
@@ -443,15 +465,66 @@ class XDSUserTests(TestCase):
 
         expected_search = Search(using='default',
                                  index='test'). \
-            query(Q("match", filter=org0.filter) |
-                  Q("match", filter=org1.filter))
+            filter('terms', filter=sorted([org0.filter, org1.filter]))
         query.user_organization_filtering()
         result = query.search
 
-        self.assertIn(expected_search.to_dict()['query']['bool']['should'][0],
-                      result.to_dict()['query']['bool']['should'])
-        self.assertIn(expected_search.to_dict()['query']['bool']['should'][1],
-                      result.to_dict()['query']['bool']['should'])
+        self.assertEqual(expected_search.to_dict(), result.to_dict())
+
+    def test_user_org_filter_cached(self):
+        """
+        Test that a user's organizations are cached until their memberships
+        change
+        """
+        org0 = Organization(name='cachedName', filter='cachedFilter')
+        org0.save()
+        org1 = Organization(name='otherCachedName', filter='otherCachedFilter')
+        org1.save()
+        user = XDSUser.objects.create_user('cached@test.com', 'test1234',
+                                           first_name='Jane',
+                                           last_name='doe')
+        user.organizations.add(org0)
+
+        self.assertEqual(
+            XSEQueries('test', 'test', user=user).organization_filters(),
+            [org0.filter])
+
+        with self.assertNumQueries(0):
+            XSEQueries('test', 'test', user=user).organization_filters()
+
+        version = get_config_snapshot().version
+        user.organizations.add(org1)
+
+        self.assertEqual(
+            XSEQueries('test', 'test', user=user).organization_filters(),
+            sorted([org0.filter, org1.filter]))
+        # only the changed user's organizations are reloaded
+        self.assertEqual(get_config_snapshot().version, version)
+
+    def test_user_org_filter_reverse_change(self):
+        """
+        Test that adding users to an organization and clearing it invalidates
+        the cached organizations of its members
+        """
+        org = Organization(name='reverseName', filter='reverseFilter')
+        org.save()
+        user = XDSUser.objects.create_user('reverse@test.com', 'test1234',
+                                           first_name='Jane',
+                                           last_name='doe')
+
+        self.assertIsNone(
+            XSEQueries('test', 'test', user=user).organization_filters())
+
+        org.xdsuser_set.add(user)
+
+        self.assertEqual(
+            XSEQueries('test', 'test', user=user).organization_filters(),
+            [org.filter])
+
+        org.xdsuser_set.clear()
+
+        self.assertIsNone(
+            XSEQueries('test', 'test', user=user).organization_filters())
 
     def test_filter_options_blank(self):
         """
@@ -559,3 +632,1187 @@ class XDSUserTests(TestCase):
         self.assertEqual(
             len(es.suggest.call_args[1]['completion']['contexts']['filter']),
             1)
+
+
+@tag('unit')
+class ConnectionTests(TestCase):
+
+    def tearDown(self):
+        reset_connections()
+
+    def test_get_connection_alias_reused(self):
+        """Test that requesting a client for the same host and index twice
+            returns the same pooled client"""
+        alias = get_connection_alias('http://es-one:9200', 'test')
+        client = connections.get_connection(alias)
+
+        self.assertEqual(alias, get_connection_alias('http://es-one:9200',
+                                                     'test'))
+        self.assertIs(client, connections.get_connection(alias))
+
+    def test_get_connection_alias_host_changed(self):
+        """Test that changing the host for an index drops the old client"""
+        old_alias = get_connection_alias('http://es-one:9200', 'test')
+        new_alias = get_connection_alias('http://es-two:9200', 'test')
+
+        self.assertNotEqual(old_alias, new_alias)
+        self.assertRaises(KeyError, connections.get_connection, old_alias)
+
+    def test_pool_stats(self):
+        """Test that pool_stats reports a pool for each registered client"""
+        get_connection_alias('http://es-one:9200', 'test')
+        stats = pool_stats()
+
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['index'], 'test')
+        self.assertEqual(stats[0]['in_use'], 0)
+        self.assertEqual(stats[0]['created'], 0)
+        self.assertFalse(stats[0]['dead'])
+        self.assertEqual(stats[0]['node']['requests'], 0)
+
+    @override_settings(XSE_HOST_SELECTOR='least-latency')
+    def test_get_connection_alias_several_hosts(self):
+        """Test that a client is created with a connection to each of the
+            comma separated hosts"""
+        alias = get_connection_alias('http://es-one:9200, http://es-two:9200',
+                                     'test')
+        connection_pool = connections.get_connection(alias).transport \
+            .connection_pool
+
+        self.assertEqual(sorted(conn.host for conn in
+                                connection_pool.connections),
+                         ['http://es-one:9200', 'http://es-two:9200'])
+        self.assertIsInstance(connection_pool.selector, LeastLatencySelector)
+        self.assertEqual(len(pool_stats()), 2)
+
+    def test_least_latency_selector(self):
+        """Test that the node with the lowest latency is selected, nodes
+            without a latency first"""
+        fast, slow, new = Mock(), Mock(), Mock()
+        fast.node_stats.latency = 0.01
+        slow.node_stats.latency = 0.5
+        new.node_stats.latency = None
+        selector = LeastLatencySelector({})
+
+        self.assertIs(selector.select([slow, fast]), fast)
+        self.assertIs(selector.select([slow, fast, new]), new)
+
+    def test_node_stats(self):
+        """Test that the moving average latency only counts successful
+            requests"""
+        stats = NodeStats()
+
+        with patch('es_api.utils.connections.time.monotonic') as monotonic:
+            monotonic.return_value = 1.0
+            stats.record(0.0, False)
+            stats.record(0.0, True)
+            monotonic.return_value = 2.0
+            stats.record(0.0, False)
+
+        self.assertEqual(stats.stats(), {'requests': 3, 'failures': 1,
+                                         'latency_ms': 1200.0})
+
+    def test_node_unavailable(self):
+        """Test that a node whose circuit is open fails like a lost
+            connection, so the request is retried on another node"""
+        err = NodeUnavailableError('xse:http://es-one:9200')
+
+        self.assertIsInstance(err, CircuitOpenError)
+        self.assertIsInstance(err, ESConnectionError)
+        self.assertEqual(err.status_code, 'N/A')
+        self.assertIn('es-one', str(err))
+
+
+@tag('unit')
+class CacheTests(TestCase):
+
+    def test_lru_cache_eviction(self):
+        """Test that the least recently used entry is evicted when full"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_last_good_cache(self):
+        """Test that the last good results are served with their age while
+            the circuit is open"""
+        cache = LastGoodCache(maxsize=2, ttl=60)
+
+        self.assertEqual(cache.remember('a', lambda: 'value'), ('value', None))
+        self.assertEqual(cache.remember(
+            'a', Mock(side_effect=CircuitOpenError('xse'))), ('value', 0))
+        self.assertRaises(CircuitOpenError, cache.remember, 'b',
+                          Mock(side_effect=CircuitOpenError('xse')))
+        self.assertEqual(cache.stats()['served'], 1)
+
+    def test_lru_cache_ttl(self):
+        """Test that expired entries are treated as misses"""
+        cache = LRUCache(maxsize=2, ttl=0)
+        cache.set('a', 1)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_lru_cache_get_or_set(self):
+        """Test that get_or_set only computes the value on a miss"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        compute = Mock(return_value='value')
+
+        self.assertEqual(cache.get_or_set('a', compute), 'value')
+        self.assertEqual(cache.get_or_set('a', compute), 'value')
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_generational_cache_sync(self):
+        """Test that a generational cache is emptied when the index
+            generation changes"""
+        cache = GenerationalCache(maxsize=2, ttl=60)
+        cache.sync_generation((1, 1, 0))
+        cache.set('a', 1)
+        cache.sync_generation((1, 1, 0))
+
+        self.assertEqual(cache.get('a'), 1)
+
+        cache.sync_generation((2, 2, 0))
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_make_search_key_canonical(self):
+        """Test that equivalent searches produce the same key"""
+        key = make_search_key('keyword', 'Data  Science',
+                              {'page': '1', 'type': ['b', 'a']},
+                              ['org2', 'org1'])
+        key2 = make_search_key('keyword', ' data science ',
+                               {'type': ['a', 'b'], 'page': 1},
+                               ['org1', 'org2'])
+        key3 = make_search_key('keyword', 'data science',
+                               {'page': '2', 'type': ['a', 'b']},
+                               ['org1', 'org2'])
+
+        self.assertEqual(key, key2)
+        self.assertNotEqual(key, key3)
+
+    def test_cached_search(self):
+        """Test that cached_search stores cacheable results, serves them on
+            a repeat and always runs a profiled search"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        search = Mock(return_value=b'{"partial":false}')
+        last_good_cache.clear()
+
+        self.assertEqual(cached_search('a', search, cache=cache),
+                         (b'{"partial":false}', None))
+        self.assertEqual(cached_search('a', search, cache=cache),
+                         (b'{"partial":false}', None))
+        self.assertEqual(search.call_count, 1)
+
+        cached_search('a', search, cache=cache, profile=True)
+
+        self.assertEqual(search.call_count, 2)
+
+    def test_cached_search_circuit_open(self):
+        """Test that the sync and async entry points serve the last good
+            results while the circuit is open"""
+        last_good_cache.clear()
+        cached_search('a', lambda: b'{}')
+        failing = AsyncMock(side_effect=CircuitOpenError('xse'))
+
+        self.assertEqual(async_to_sync(async_cached_search)('a', failing),
+                         (b'{}', 0))
+
+    def test_async_cached_search(self):
+        """Test that async_cached_search stores cacheable results and serves
+            them on a repeat"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        search = AsyncMock(return_value=b'{"partial":false}')
+        last_good_cache.clear()
+
+        for _ in range(2):
+            self.assertEqual(
+                async_to_sync(async_cached_search)('a', search, cache=cache),
+                (b'{"partial":false}', None))
+
+        self.assertEqual(search.await_count, 1)
+
+    def test_get_index_generation(self):
+        """Test that the index generation is read from the index stats"""
+        with patch('es_api.utils.cache.connections') as conns:
+            conns.get_connection.return_value.indices.stats.return_value = {
+                '_all': {'primaries': {
+                    'docs': {'count': 5},
+                    'indexing': {'index_total': 7, 'delete_total': 1}}}}
+
+            self.assertEqual(get_index_generation('gen-test', 'test'),
+                             (5, 7, 1))
+
+
+@tag('unit')
+class AsyncQueriesTests(TestCase):
+
+    def tearDown(self):
+        reset_connections()
+
+    def test_async_execute(self):
+        """Test that execute sends the built search to the async client and
+            wraps the response in a Response Object"""
+        with patch('es_api.utils.async_queries.get_async_connection') as conn:
+            client = conn.return_value
+            client.search = AsyncMock(return_value={
+                'hits': {'total': {'value': 1, 'relation': 'eq'},
+                         'hits': [{'_id': '1', '_source': {'a': 'b'}}]}})
+            queries = AsyncXSEQueries('http://es-one:9200', 'test')
+            queries.search = queries.search.query(Q('match', a='b'))[0:5]
+            response = async_to_sync(queries.execute)()
+
+            self.assertEqual(response.hits.total.value, 1)
+            self.assertEqual(response.hits[0].a, 'b')
+            self.assertEqual(client.search.call_args[1]['index'], ['test'])
+            self.assertEqual(client.search.call_args[1]['body'],
+                             queries.search.to_dict())
+
+    def test_async_more_like_this(self):
+        """Test that the async search methods build the same query as the
+            sync ones before executing it"""
+        with patch('es_api.utils.async_queries.get_async_connection'), \
+                patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch('es_api.utils.async_queries.AsyncXSEQueries.execute',
+                      new_callable=AsyncMock) as execute:
+            config.return_value.course_mapping = CourseInformationMapping(
+                course_title='Course.Title',
+                course_description='Course.Description',
+                course_provider='Course.Provider')
+            queries = AsyncXSEQueries('http://es-one:9200', 'test')
+            expected = XSEQueries('http://es-one:9200', 'test')
+            expected.build_more_like_this(doc_id='1')
+            response = async_to_sync(queries.more_like_this)(doc_id='1')
+
+            self.assertEqual(response, execute.return_value)
+            self.assertEqual(queries.search.to_dict(),
+                             expected.search.to_dict())
+
+
+@tag('unit')
+class PaginationTests(TestCase):
+
+    def tearDown(self):
+        reset_connections()
+
+    def test_cursor_round_trip(self):
+        """Test that a cursor token decodes to the values it was built from
+            and that tampered tokens are rejected"""
+        token = encode_cursor('pit-id', [1.5, 'abc', 7])
+
+        self.assertEqual(decode_cursor(token), ('pit-id', [1.5, 'abc', 7]))
+        self.assertRaises(InvalidCursorError, decode_cursor, 'not a cursor')
+        self.assertRaises(InvalidCursorError, decode_cursor,
+                          encode_cursor('pit-id', 'abc'))
+
+    def test_add_search_pagination_page(self):
+        """Test that page numbers still slice the results"""
+        queries = XSEQueries('http://es-one:9200', 'test')
+        queries.add_search_pagination(filters={'page': '3'}, page_size=10)
+        query = queries.search.to_dict()
+
+        self.assertEqual(query['from'], 20)
+        self.assertEqual(query['size'], 10)
+        self.assertIsNone(queries.pit_id)
+
+    def test_add_search_pagination_new_cursor(self):
+        """Test that an empty cursor opens a point in time and searches it
+            from the first hit"""
+        with patch('es_api.utils.queries.XSEQueries.open_point_in_time') \
+                as open_pit:
+            open_pit.return_value = 'new-pit'
+            queries = XSEQueries('http://es-one:9200', 'test')
+            queries.add_search_pagination(filters={'page': '1',
+                                                   'cursor': ''},
+                                          page_size=10)
+            query = queries.search.to_dict()
+
+            self.assertIsNone(queries.search._index)
+            self.assertEqual(query['pit']['id'], 'new-pit')
+            self.assertEqual(query['size'], 10)
+            self.assertEqual(query['sort'], ['_score', {'_shard_doc': 'asc'}])
+            self.assertNotIn('search_after', query)
+            self.assertNotIn('from', query)
+
+    def test_add_search_pagination_cursor(self):
+        """Test that a cursor continues after the hit it points at and keeps
+            the requested sort"""
+        queries = XSEQueries('http://es-one:9200', 'test')
+        queries.search = queries.search.sort('title.keyword')
+        queries.add_search_pagination(
+            filters={'page': '1', 'cursor': encode_cursor('pit', ['b', 4])},
+            page_size=10)
+        query = queries.search.to_dict()
+
+        self.assertEqual(query['pit']['id'], 'pit')
+        self.assertEqual(query['search_after'], ['b', 4])
+        self.assertEqual(query['sort'],
+                         ['title.keyword', {'_shard_doc': 'asc'}])
+
+    def test_next_cursor(self):
+        """Test that full pages return a cursor for the last hit and the
+            last page does not"""
+        queries = XSEQueries('http://es-one:9200', 'test')
+        queries.pit_id = 'pit'
+        queries.search = queries.search.extra(size=2)
+        hits = [{'_id': '1', '_source': {}, 'sort': [2.0, 5]},
+                {'_id': '2', '_source': {}, 'sort': [1.0, 9]}]
+        full = queries.search._response_class(queries.search, {
+            'pit_id': 'pit-2', 'hits': {'total': {'value': 3}, 'hits': hits}})
+        last = queries.search._response_class(queries.search, {
+            'hits': {'total': {'value': 3}, 'hits': hits[:1]}})
+
+        self.assertEqual(decode_cursor(queries.next_cursor(full)),
+                         ('pit-2', [1.0, 9]))
+        self.assertIsNone(queries.next_cursor(last))
+
+
+@tag('unit')
+class FacetTests(TestCase):
+
+    def setUp(self):
+        config_obj = XDSConfiguration(target_xis_metadata_api="dsds")
+        ui_config_obj = XDSUIConfiguration(search_results_per_page=10,
+                                           xds_configuration=config_obj)
+        self.config = ConfigSnapshot(
+            xds_configuration=config_obj, ui_configuration=ui_config_obj,
+            course_mapping=CourseInformationMapping(),
+            search_filters=(SearchFilter(display_name='Type',
+                                         field_name='type',
+                                         filter_type='terms'),))
+
+    def tearDown(self):
+        reset_connections()
+
+    def test_build_search_by_keyword_no_facets(self):
+        """Test that the keyword search skips the filter aggregations when
+            facets are turned off"""
+        with patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = self.config
+            query = XSEQueries('test', 'test')
+            query.build_search_by_keyword('test', {'page': '1'},
+                                          facets=False)
+
+            self.assertNotIn('aggs', query.search.to_dict())
+
+    def test_build_search_facets(self):
+        """Test that the facets query only requests the filter aggregations
+            and can use the shard request cache"""
+        with patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = self.config
+            query = XSEQueries('test', 'test')
+            query.build_search_facets('test', {'type': ['a']})
+            search_dict = query.search.to_dict()
+
+            self.assertEqual(search_dict['size'], 0)
+            self.assertIn('Type', search_dict['aggs'])
+            self.assertEqual(search_dict['query']['bool']['filter'],
+                             [{'terms': {'type.keyword': ['a']}}])
+            self.assertTrue(query.search._params['request_cache'])
+
+
+@tag('unit')
+class TotalHitsTests(TestCase):
+
+    def setUp(self):
+        config_obj = XDSConfiguration(target_xis_metadata_api="dsds")
+        self.ui_config = XDSUIConfiguration(search_results_per_page=2,
+                                            track_total_hits=100,
+                                            exact_total_on_last_page=True,
+                                            xds_configuration=config_obj)
+        self.config = ConfigSnapshot(
+            xds_configuration=config_obj, ui_configuration=self.ui_config,
+            course_mapping=CourseInformationMapping())
+
+    def tearDown(self):
+        reset_connections()
+
+    def page(self, page, hits, total, relation='gte'):
+        """Builds a search for a page and a response with the given number
+            of hits"""
+        query = XSEQueries('test', 'test')
+        query.build_search_by_keyword('test', {'page': str(page)},
+                                      facets=False)
+        raw = {'hits': {'total': {'value': total, 'relation': relation},
+                        'hits': [{'_id': str(i)} for i in range(hits)]}}
+
+        return query, raw
+
+    def test_track_total_hits(self):
+        """Test that searches count hits up to the configured threshold"""
+        with patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = self.config
+            query, raw = self.page(1, 2, 100)
+
+            self.assertEqual(query.search.to_dict()['track_total_hits'], 100)
+
+            self.ui_config.track_total_hits = None
+            query, raw = self.page(1, 2, 100)
+
+            self.assertTrue(query.search.to_dict()['track_total_hits'])
+
+    def test_exact_total_middle_page(self):
+        """Test that a lower bound total is kept before the last page"""
+        with patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch('elasticsearch_dsl.Search.count') as count:
+            config.return_value = self.config
+            query, raw = self.page(2, 2, 100)
+
+            self.assertEqual(query.exact_total(raw), (100, 'gte'))
+            count.assert_not_called()
+
+    def test_exact_total_short_page(self):
+        """Test that a short page gives the exact total without counting"""
+        with patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch('elasticsearch_dsl.Search.count') as count:
+            config.return_value = self.config
+            query, raw = self.page(3, 1, 100)
+
+            self.assertEqual(query.exact_total(raw), (5, 'eq'))
+            count.assert_not_called()
+
+    def test_exact_total_last_page(self):
+        """Test that the exact total is counted on the last page"""
+        with patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch('elasticsearch_dsl.Search.count') as count:
+            config.return_value = self.config
+            count.return_value = 250
+            query, raw = self.page(50, 2, 100)
+
+            self.assertEqual(query.exact_total(raw), (250, 'eq'))
+
+            self.ui_config.exact_total_on_last_page = False
+
+            self.assertEqual(query.exact_total(raw), (100, 'gte'))
+            count.assert_called_once()
+
+
+@tag('unit')
+class BudgetTests(TestCase):
+
+    def tearDown(self):
+        reset_connections()
+
+    @override_settings(SEARCH_BUDGET_MS=2000, SEARCH_BUDGET_MARGIN_MS=250,
+                       SEARCH_TERMINATE_AFTER=0)
+    def test_search_budget(self):
+        """Test that searches are sent with the timeout of the search budget
+            and a client timeout of the budget plus its margin"""
+        queries = XSEQueries('test', 'test')
+
+        with patch('elasticsearch_dsl.Search.execute'):
+            queries.execute()
+
+        self.assertEqual(queries.search.to_dict()['timeout'], '2000ms')
+        self.assertEqual(queries.search._params['request_timeout'], 2.25)
+        self.assertNotIn('terminate_after', queries.search.to_dict())
+
+    @override_settings(SUGGEST_BUDGET_MS=800, SEARCH_TERMINATE_AFTER=500)
+    def test_suggest_budget(self):
+        """Test that suggestions use their own budget and are not
+            terminated early"""
+        queries = XSEQueries('test', 'test')
+
+        with patch('elasticsearch_dsl.Search.execute'), \
+                patch.object(XSEQueries, 'build_suggest'):
+            queries.suggest('te')
+
+        self.assertEqual(queries.search.to_dict()['timeout'], '800ms')
+        self.assertNotIn('terminate_after', queries.search.to_dict())
+
+    @override_settings(SEARCH_BUDGET_MS=0)
+    def test_no_budget(self):
+        """Test that a budget of 0 leaves the search unbounded"""
+        queries = XSEQueries('test', 'test')
+
+        with patch('elasticsearch_dsl.Search.execute'):
+            queries.execute()
+
+        self.assertNotIn('timeout', queries.search.to_dict())
+        self.assertNotIn('request_timeout', queries.search._params)
+
+    def test_partial_results(self):
+        """Test that results missing timed out shards are flagged partial
+            and not cached"""
+        queries = XSEQueries('test', 'test')
+        raw = {'timed_out': True, '_shards': {'total': 2, 'failed': 0}}
+        results = queries.dump_results({'hits': []}, raw)
+
+        self.assertTrue(json.loads(results)['partial'])
+        self.assertTrue(json.loads(results)['timed_out'])
+        self.assertFalse(is_cacheable(results))
+
+        results = queries.dump_results({'hits': []}, {'timed_out': False})
+
+        self.assertFalse(json.loads(results)['partial'])
+        self.assertTrue(is_cacheable(results))
+
+    def test_partial_results_not_cached(self):
+        """Test that get_or_set does not store values that are not
+            cacheable"""
+        cache = LRUCache(10, 60)
+        cache.get_or_set('key', lambda: PartialResults(b'{}'),
+                         cacheable=is_cacheable)
+
+        self.assertIsNone(cache.get('key'))
+
+        cache.get_or_set('key', lambda: b'{}', cacheable=is_cacheable)
+
+        self.assertEqual(cache.get('key'), b'{}')
+
+
+@tag('unit')
+class SavedFilterTests(TestCase):
+
+    def test_parse_search_query(self):
+        """Test that a saved query string is parsed into its keyword, page,
+            sort and filter values"""
+        parsed = parse_search_query(
+            '/search?keyword=data+science&p=3&sort=Course.CourseTitle'
+            '&Course.CourseType=online&Course.CourseType=classroom'
+            '&Course.Empty=')
+
+        self.assertEqual(parsed, {
+            'keyword': 'data science', 'page': '3',
+            'sort': 'Course.CourseTitle',
+            'filters': {'Course.CourseType': ['online', 'classroom']}})
+
+    def test_search_arguments(self):
+        """Test that only the configured filters are searched and the page
+            can be overridden"""
+        parsed = parse_search_query('keyword=a&sort=b&type=c&other=d')
+        config = ConfigSnapshot(search_filters=(
+            SearchFilter(field_name='type'),))
+
+        self.assertEqual(search_arguments(parsed, config, page='4'),
+                         ('a', {'page': '4', 'sort': 'b', 'type': ['c']}))
+
+    def test_parsed_query_saved(self):
+        """Test that the parsed query is stored when the filter is saved and
+            parsed for filters saved before"""
+        owner = XDSUser.objects.create_user('saved@test.com', 'test1234',
+                                            first_name='saved',
+                                            last_name='filter')
+        saved_filter = SavedFilter.objects.create(owner=owner, name='a',
+                                                  query='keyword=a')
+
+        self.assertEqual(saved_filter.parsed_query['keyword'], 'a')
+
+        SavedFilter.objects.filter(pk=saved_filter.pk) \
+            .update(parsed_query=None)
+        saved_filter = SavedFilter.objects.get(pk=saved_filter.pk)
+
+        self.assertEqual(saved_filter.get_parsed_query()['keyword'], 'a')
+        self.assertIsNotNone(SavedFilter.objects.get(
+            pk=saved_filter.pk).parsed_query)
+
+
+def _benchmark_response(search, hit_count):
+    """Builds a search response shaped like an XSE course search"""
+    hits = []
+
+    for i in range(hit_count):
+        hits.append({
+            '_index': 'xse', '_type': '_doc', '_id': str(i),
+            '_score': 10.0 - i / hit_count,
+            '_source': {
+                'Course': {
+                    'CourseTitle': 'Course title %d' % i,
+                    'CourseShortDescription': 'Short description ' * 10,
+                    'CourseFullDescription': 'Full description ' * 60,
+                    'CourseCode': 'CODE-%d' % i,
+                    'CourseProviderName': 'Provider %d' % (i % 5),
+                    'DepartmentName': 'Department',
+                },
+                'CourseInstance': {
+                    'CourseLevel': str(i % 3),
+                    'DeliveryMode': 'Online',
+                    'Instructor': 'Instructor %d' % i,
+                    'StartDate': '2024-01-01T00:00:00',
+                    'EndDate': '2024-06-01T00:00:00',
+                },
+                'General_Information': {
+                    'StartDate': '2024-01-01', 'EndDate': '2024-06-01'},
+                'Technical_Information': {'Thumbnail': 'https://x/%d' % i},
+                'metadata_key_hash': '%032x' % i,
+                'filter': 'org-%d' % (i % 3),
+                'Teaches': ['comp-%d' % n for n in range(10)],
+            },
+        })
+
+    return search._response_class(search, {
+        'took': 5, 'timed_out': False,
+        'hits': {'total': {'value': hit_count, 'relation': 'eq'},
+                 'max_score': 10.0, 'hits': hits},
+        'aggregations': {'Type': {
+            'doc_count_error_upper_bound': 0, 'sum_other_doc_count': 0,
+            'buckets': [{'key': 'Provider %d' % n, 'doc_count': n}
+                        for n in range(5)]}},
+    })
+
+
+def _attr_dict_results(response):
+    """get_results as implemented before the raw response mode, building
+        AttrDicts for each hit and encoding with the json module"""
+    hit_arr = []
+    agg_dict = response.aggregations.to_dict()
+
+    for hit in response:
+        hit_dict = hit.to_dict()
+        hit_dict['meta'] = hit.meta.to_dict()
+        hit_arr.append(hit_dict)
+
+    for key in agg_dict:
+        agg_dict[key]['field_name'] = 'Course.CourseProviderName'
+
+    return json.dumps({"hits": hit_arr,
+                       "total": response.hits.total.value,
+                       "total_relation": response.hits.total.relation,
+                       "aggregations": agg_dict,
+                       "timed_out": False,
+                       "partial": False})
+
+
+@tag('unit')
+class GetResultsBenchmarkTests(TestCase):
+
+    def tearDown(self):
+        reset_connections()
+
+    def test_get_results_benchmark(self):
+        """Test that the raw response mode of get_results returns the same
+            results as building AttrDicts for 10, 50 and 100 hit responses.
+            The timings of both are only logged, wall clock comparisons are
+            too noisy on shared runners to fail a build"""
+        config = ConfigSnapshot(search_filters=(SearchFilter(
+            display_name='Type', field_name='Course.CourseProviderName'),))
+
+        with patch('es_api.utils.queries.get_config_snapshot') as snapshot:
+            snapshot.return_value = config
+            queries = XSEQueries('test', 'test')
+
+            for hit_count in (10, 50, 100):
+                raw = _benchmark_response(queries.search, hit_count)
+                legacy = copy.deepcopy(raw)
+
+                self.assertEqual(json.loads(queries.get_results(raw)),
+                                 json.loads(_attr_dict_results(legacy)))
+
+                fast_time = min(timeit.repeat(
+                    lambda: queries.get_results(raw), number=20, repeat=5))
+                legacy_time = min(timeit.repeat(
+                    lambda: _attr_dict_results(legacy), number=20, repeat=5))
+
+                logger.info('get_results benchmark, %d hits: raw %.4fs, '
+                            'AttrDict %.4fs', hit_count, fast_time,
+                            legacy_time)
+
+
+@tag('unit')
+class ProjectionTests(TestCase):
+
+    def setUp(self):
+        config_obj = XDSConfiguration(target_xis_metadata_api="dsds")
+        self.config = ConfigSnapshot(
+            xds_configuration=config_obj,
+            course_mapping=CourseInformationMapping(),
+            card_fields=('Course.CourseTitle', 'Course.Hours'))
+
+    def tearDown(self):
+        reset_connections()
+
+    def test_card_projection(self):
+        """Test that the card projection limits _source to the card fields"""
+        with patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = self.config
+            query = XSEQueries('test', 'test', projection='card')
+            query.build_similar_courses(keyword='test')
+
+            self.assertEqual(query.search.to_dict()['_source'],
+                             {'includes': ['Course.CourseTitle',
+                                           'Course.Hours']})
+
+    def test_no_projection(self):
+        """Test that the full _source is returned without a projection"""
+        with patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = self.config
+            query = XSEQueries('test', 'test', projection='unknown')
+            query.build_similar_courses(keyword='test')
+
+            self.assertNotIn('_source', query.search.to_dict())
+
+    def test_card_projection_cache_key(self):
+        """Test that projected results are cached separately"""
+        query = XSEQueries('test', 'test')
+        card_query = XSEQueries('test', 'test', projection='card')
+
+        self.assertNotEqual(query.search_cache_key('keyword', 'a'),
+                            card_query.search_cache_key('keyword', 'a'))
+
+    def test_unknown_projection_cache_key(self):
+        """Test that unknown projections share the cache key of searches
+            without a projection"""
+        query = XSEQueries('test', 'test')
+        unknown_query = XSEQueries('test', 'test', projection='x' * 100)
+
+        self.assertIsNone(unknown_query.projection)
+        self.assertEqual(query.search_cache_key('keyword', 'a'),
+                         unknown_query.search_cache_key('keyword', 'a'))
+
+
+def _suggestions(partial, *texts):
+    """Builds the autocomplete_suggestion entries of a completion response"""
+    return [{'text': partial, 'offset': 0, 'length': len(partial),
+             'options': [{'text': text, '_id': str(i), '_score': 1.0}
+                         for i, text in enumerate(texts)]}]
+
+
+@tag('unit')
+class SuggestCacheTests(TestCase):
+
+    def tearDown(self):
+        suggest_cache.clear()
+        reset_connections()
+
+    def test_fuzzy_prefix_match(self):
+        """Test that prefixes are matched within the allowed edits"""
+        self.assertTrue(fuzzy_prefix_match('Python Basics', 'pyth', 0))
+        self.assertFalse(fuzzy_prefix_match('Python Basics', 'pyht', 0))
+        self.assertTrue(fuzzy_prefix_match('Python Basics', 'pyht', 1))
+        self.assertTrue(fuzzy_prefix_match('Python Basics', 'pytn', 1))
+        self.assertFalse(fuzzy_prefix_match('Python Basics', 'pxtn', 1))
+        self.assertFalse(fuzzy_prefix_match('Python Basics', 'xyth', 1))
+        self.assertTrue(fuzzy_prefix_match('Python Basics', 'pythno b', 2))
+
+    def test_derive_suggestions(self):
+        """Test that a longer partial keeps the matching candidates of a
+            shorter one within the same fuzziness"""
+        suggestions = _suggestions('pyt', 'Python', 'Pytorch', 'Pascal')
+
+        derived = derive_suggestions(suggestions, 'pyt', 'pyth')
+
+        self.assertEqual([option['text'] for option in derived[0]['options']],
+                         ['Python', 'Pytorch'])
+        self.assertEqual(derived[0]['text'], 'pyth')
+        self.assertIsNone(derive_suggestions(suggestions, 'py', 'pyt'))
+
+    def test_prefix_cache_derives_complete_entries(self):
+        """Test that only complete shorter entries are used to answer a
+            longer partial"""
+        cache = PrefixCache(maxsize=10, ttl=60)
+        cache.set_suggestions('pyt', ('org',), _suggestions('pyt', 'Python'),
+                              True)
+        cache.set_suggestions('jav', ('org',), _suggestions('jav', 'Java'),
+                              False)
+
+        self.assertEqual(cache.get_suggestions('pyth', ('org',))[0]
+                         ['options'][0]['text'], 'Python')
+        self.assertIsNone(cache.get_suggestions('java', ('org',)))
+        self.assertIsNone(cache.get_suggestions('pyth', ('other',)))
+        self.assertEqual(cache.stats()['derived'], 1)
+
+    def test_cached_suggest(self):
+        """Test that repeated and narrowed partials are served without
+            querying Elasticsearch"""
+        Organization(name='suggestName', filter='suggestFilter').save()
+        invalidate_config_snapshot()
+        response = Mock()
+        response.to_dict.return_value = {'suggest': {
+            'autocomplete_suggestion': _suggestions('pyt', 'Python')}}
+
+        with patch('es_api.utils.queries.XSEQueries.suggest') as suggest:
+            suggest.return_value = response
+            query = XSEQueries('test', 'test')
+
+            query.cached_suggest('Pyt')
+            query.cached_suggest(' pyt ')
+            suggestions = query.cached_suggest('pyth')
+
+            self.assertEqual(suggest.call_count, 1)
+            self.assertEqual(suggestions[0]['options'][0]['text'], 'Python')
+
+        invalidate_config_snapshot()
+
+
+@tag('unit')
+class NeighborsTests(TestCase):
+
+    def setUp(self):
+        self.config = ConfigSnapshot(
+            xds_configuration=XDSConfiguration(target_xis_metadata_api="dsds"),
+            course_mapping=CourseInformationMapping(
+                course_competency='Course.Competency',
+                course_subject='Course.Subject'))
+
+    def tearDown(self):
+        reset_connections()
+
+    def neighbors_response(self, *doc_ids):
+        response = Mock()
+        response.to_dict.return_value = {'hits': {
+            'total': {'value': len(doc_ids)},
+            'hits': [{'_id': doc_id, '_source': {}} for doc_id in doc_ids]}}
+
+        return response
+
+    def test_more_like_this_precomputed(self):
+        """Test that stored neighbors are served in their computed order
+            without a live more like this query"""
+        CourseNeighbors(kind=CourseNeighbors.MORE_LIKE_THIS, key='doc',
+                        neighbors=['a', 'b', 'c']).save()
+
+        with patch('elasticsearch_dsl.Search.execute') as execute, \
+                patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = self.config
+            execute.return_value = self.neighbors_response('c', 'a', 'b')
+            query = XSEQueries('test', 'test')
+            response = query.more_like_this(doc_id='doc')
+
+            self.assertEqual(execute.call_count, 1)
+            self.assertEqual(query.search.to_dict()['query']['bool'][
+                'filter'][0], {'ids': {'values': ['a', 'b', 'c']}})
+            self.assertEqual(
+                [hit['_id'] for hit in response.to_dict()['hits']['hits']],
+                ['a', 'b', 'c'])
+
+    def test_more_like_this_precomputed_filtered(self):
+        """Test that a live query is made when the user may not see enough
+            of the stored neighbors"""
+        CourseNeighbors(kind=CourseNeighbors.MORE_LIKE_THIS, key='doc',
+                        neighbors=['a', 'b', 'c']).save()
+
+        with patch('elasticsearch_dsl.Search.execute') as execute, \
+                patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = self.config
+            execute.side_effect = [self.neighbors_response('a'),
+                                   self.neighbors_response('d', 'e')]
+            query = XSEQueries('test', 'test')
+            response = query.more_like_this(doc_id='doc')
+
+            self.assertEqual(execute.call_count, 2)
+            self.assertIn('more_like_this', query.search.to_dict()['query'])
+            self.assertEqual(len(response.to_dict()['hits']['hits']), 2)
+
+    def test_similar_courses_miss(self):
+        """Test that a live query is made when no neighbors are stored"""
+        with patch('elasticsearch_dsl.Search.execute') as execute, \
+                patch('es_api.utils.queries.get_config_snapshot') as config:
+            config.return_value = self.config
+            query = XSEQueries('test', 'test')
+            query.similar_courses(keyword='math')
+
+            self.assertEqual(execute.call_count, 1)
+            self.assertIn('multi_match', query.search.to_dict()['query'])
+
+    def test_field_values(self):
+        """Test that the strings at a dotted path are found in lists"""
+        source = {'Course': [{'Subject': 'math'}, {'Subject': ['art', 1]}]}
+
+        self.assertEqual(field_values(source, 'Course.Subject'),
+                         ['math', 'art'])
+        self.assertEqual(field_values(source, 'Course.Missing'), [])
+
+    def test_builder_incremental(self):
+        """Test that only documents that changed since the last run have
+            their neighbors recomputed"""
+        hits = [{'_id': 'a', '_seq_no': 1, '_primary_term': 1,
+                 '_source': {'Course': {'Subject': 'math'}}},
+                {'_id': 'b', '_seq_no': 2, '_primary_term': 1,
+                 '_source': {'Course': {'Subject': 'math'}}}]
+
+        with patch('es_api.utils.neighbors.get_config_snapshot') as config:
+            config.return_value = self.config
+            builder = NeighborsBuilder(XSEQueries, 'test', 'test')
+
+        with patch.object(builder, 'search_all') as search_all:
+            search_all.side_effect = lambda keys, *args: [['x'] for _ in keys]
+            builder.process(hits)
+            hits[1]['_seq_no'] = 3
+            builder.process(hits)
+
+            self.assertEqual(
+                [call.args[0] for call in search_all.call_args_list],
+                [['a', 'b'], ['math'], ['b'], []])
+            self.assertEqual(CourseNeighbors.objects.get(
+                kind=CourseNeighbors.MORE_LIKE_THIS, key='b').version, '1:3')
+            self.assertEqual(CourseNeighbors.objects.get(
+                kind=CourseNeighbors.SIMILAR_COURSES, key='math').neighbors,
+                ['x'])
+
+    def test_builder_removes_unseen(self):
+        """Test that neighbors of documents no longer in the index are
+            removed"""
+        CourseNeighbors(kind=CourseNeighbors.MORE_LIKE_THIS, key='gone',
+                        neighbors=['a']).save()
+
+        with patch('es_api.utils.neighbors.get_config_snapshot') as config:
+            config.return_value = self.config
+            builder = NeighborsBuilder(XSEQueries, 'test', 'test')
+
+        with patch.object(builder, 'walk') as walk:
+            walk.return_value = []
+            builder.run()
+
+            self.assertFalse(CourseNeighbors.objects.exists())
+
+    def test_builder_refreshes_stale(self):
+        """Test that unchanged documents and keywords whose neighbors
+            include a changed or removed document are recomputed"""
+        for key, neighbors in [('a', ['b']), ('b', ['a']), ('c', ['gone']),
+                               ('d', ['a']), ('gone', ['a'])]:
+            CourseNeighbors(kind=CourseNeighbors.MORE_LIKE_THIS, key=key,
+                            neighbors=neighbors, version='1:1').save()
+
+        CourseNeighbors(kind=CourseNeighbors.SIMILAR_COURSES, key='math',
+                        neighbors=['b']).save()
+        hits = [{'_id': doc_id, '_seq_no': 1, '_primary_term': 1,
+                 '_source': {'Course': {'Subject': 'math'}}}
+                for doc_id in 'abcd']
+        hits[1]['_seq_no'] = 2
+
+        with patch('es_api.utils.neighbors.get_config_snapshot') as config:
+            config.return_value = self.config
+            builder = NeighborsBuilder(XSEQueries, 'test', 'test')
+
+        with patch.object(builder, 'walk') as walk, \
+                patch.object(builder, 'search_all') as search_all:
+            walk.return_value = [hits]
+            search_all.side_effect = lambda keys, *args: [['x'] for _ in keys]
+            builder.run()
+
+            self.assertEqual(
+                [call.args[0] for call in search_all.call_args_list],
+                [['b'], ['math'], ['a', 'c']])
+            self.assertEqual(CourseNeighbors.objects.get(
+                kind=CourseNeighbors.MORE_LIKE_THIS, key='c').version, '1:1')
+            self.assertEqual(CourseNeighbors.objects.get(
+                kind=CourseNeighbors.MORE_LIKE_THIS, key='d').neighbors,
+                ['a'])
+            self.assertFalse(CourseNeighbors.objects.filter(
+                key='gone').exists())
+
+    @override_settings(NEIGHBORS_FULL_INTERVAL=3600)
+    def test_full_run_due(self):
+        """Test that a full run is due until one finished in the last
+            NEIGHBORS_FULL_INTERVAL seconds"""
+        caches['shared'].delete(FULL_RUN_KEY)
+
+        self.assertTrue(full_run_due())
+
+        with patch('es_api.utils.neighbors.get_config_snapshot') as config:
+            config.return_value = self.config
+            builder = NeighborsBuilder(XSEQueries, 'test', 'test', full=True)
+
+        with patch.object(builder, 'walk') as walk:
+            walk.return_value = []
+            builder.run()
+
+        self.assertFalse(full_run_due())
+
+        with self.settings(NEIGHBORS_FULL_INTERVAL=0):
+            caches['shared'].delete(FULL_RUN_KEY)
+
+            self.assertFalse(full_run_due())
+
+
+@tag('unit')
+class ProfilingTests(TestCase):
+
+    def test_nested_phases(self):
+        """Test that the time of a nested phase is only counted for the
+            inner phase"""
+        timer = PhaseTimer()
+
+        with patch('es_api.utils.profiling.time.perf_counter') as clock:
+            clock.side_effect = [0.0, 0.001, 0.003, 0.004]
+
+            with timer.phase('build'):
+                with timer.phase('organizations'):
+                    pass
+
+        self.assertAlmostEqual(timer.phases['build'], 2.0)
+        self.assertAlmostEqual(timer.phases['organizations'], 2.0)
+
+    def test_finish_profile(self):
+        """Test that a profiled response gets the timings in its headers and
+            JSON body"""
+        timer = PhaseTimer(profile=True)
+        timer.phases = {'execute': 1.5}
+        response = Mock()
+        response.to_dict.return_value = {'took': 3, 'profile': {'shards': []}}
+        timer.record_response(response)
+
+        finished = timer.finish(HttpResponse(json.dumps({'hits': []}),
+                                             content_type='application/json'))
+        body = json.loads(finished.content)
+
+        self.assertEqual(finished['Server-Timing'],
+                         'execute;dur=1.500, es-took;dur=3')
+        self.assertEqual(body['hits'], [])
+        self.assertEqual(body['profile']['es_profile'], {'shards': []})
+
+    def test_finish_sampled(self):
+        """Test that a sampled response is left as is"""
+        timer = PhaseTimer()
+        timer.phases = {'execute': 1.5}
+        response = HttpResponse('{}', content_type='application/json')
+
+        self.assertNotIn('Server-Timing', timer.finish(response))
+        self.assertEqual(response.content, b'{}')
+
+    def test_phase_stats(self):
+        """Test that the phase stats hold the count, mean and max of each
+            phase"""
+        stats = PhaseStats()
+        stats.record({'execute': 1.0})
+        stats.record({'execute': 3.0}, es_took=2)
+
+        self.assertEqual(stats.stats(), {
+            'requests': 2,
+            'phases': {
+                'execute': {'count': 2, 'mean_ms': 2.0, 'max_ms': 3.0},
+                'es-took': {'count': 1, 'mean_ms': 2.0, 'max_ms': 2.0}}})
+
+    @override_settings(PROFILE_SAMPLE_RATE=0)
+    def test_request_timer(self):
+        """Test that only staff may profile a request"""
+        request = RequestFactory().get('/es-api/?keyword=a&profile=1')
+        request.user = Mock(is_staff=False)
+
+        self.assertIs(request_timer(request), NULL_TIMER)
+
+        request.user = Mock(is_staff=True)
+
+        self.assertTrue(request_timer(request).profile)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_request_timer_sampled(self):
+        """Test that sampled requests are timed without being profiled"""
+        request = RequestFactory().get('/es-api/?keyword=a')
+        request.user = Mock(is_staff=False)
+        timer = request_timer(request)
+
+        self.assertIsInstance(timer, PhaseTimer)
+        self.assertFalse(timer.profile)
+
+    def test_execute_profile(self):
+        """Test that a profiled search asks Elasticsearch for its profile"""
+        queries = XSEQueries('test', 'test',
+                             timer=PhaseTimer(profile=True))
+
+        with patch('elasticsearch_dsl.Search.execute') as execute:
+            execute.return_value.to_dict.return_value = {'took': 1}
+            queries.execute()
+
+        self.assertTrue(queries.search.to_dict()['profile'])
+        self.assertIn('execute', queries.timer.phases)
+        self.assertEqual(queries.timer.es_took, 1)
+
+
+@tag('unit')
+class BulkSearchTests(TestCase):
+
+    def test_bulk_search(self):
+        """Test that bulk_search runs every query in one _msearch, sharing
+            the organization filters"""
+        queries = XSEQueries('test', 'test')
+        queries._organization_filters = ['org']
+        client = Mock()
+        client.msearch.return_value = {'responses': [
+            {'took': 1, 'hits': {'hits': [], 'total': {'value': 0}}},
+            {'error': {'type': 'search_phase_execution_exception',
+                       'reason': 'all shards failed'}}]}
+
+        with patch('es_api.utils.queries.connections.get_connection') \
+                as get_connection, \
+                patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch.object(XSEQueries, 'get_results') as get_results:
+            get_connection.return_value = client
+            config.return_value.search_results_per_page = 10
+            config.return_value.course_mapping.course_competency = 'comp'
+            config.return_value.course_mapping.course_derived_from = 'from'
+            get_results.return_value = b'{}'
+            results = queries.bulk_search([
+                ('competency', {'comp_uuid': 'a', 'filters': {'page': '1'}}),
+                ('filters', {'page_num': 'x', 'filters': {}}),
+                ('derived', {'reference': 'b', 'filters': {'page': '1'}})])
+
+        body = client.msearch.call_args[1]['body']
+
+        self.assertEqual(len(body), 4)
+        self.assertEqual(body[1]['query']['bool']['filter'],
+                         [{'terms': {'filter': ['org']}}])
+        self.assertEqual(results[0], (b'{}', None))
+        self.assertIsNone(results[1][0])
+        self.assertEqual(results[2], (None, 'all shards failed'))
+
+    @override_settings(SEARCH_BUDGET_MS=2000, SEARCH_BUDGET_MARGIN_MS=250,
+                       SEARCH_TERMINATE_AFTER=500)
+    def test_bulk_search_execute_options(self):
+        """Test that bulk searches get the budget, early termination and
+            profile of every other search, with one client timeout for the
+            whole _msearch"""
+        queries = XSEQueries('test', 'test', timer=PhaseTimer(profile=True))
+        queries._organization_filters = []
+        client = Mock()
+        client.msearch.return_value = {'responses': [
+            {'took': 1, 'hits': {'hits': [], 'total': {'value': 0}}}]}
+
+        with patch('es_api.utils.queries.connections.get_connection') \
+                as get_connection, \
+                patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch.object(XSEQueries, 'get_results') as get_results:
+            get_connection.return_value = client
+            config.return_value.search_results_per_page = 10
+            config.return_value.course_mapping.course_competency = 'comp'
+            get_results.return_value = b'{}'
+            queries.bulk_search([
+                ('competency', {'comp_uuid': 'a', 'filters': {'page': '1'}})])
+
+        body = client.msearch.call_args[1]['body']
+
+        self.assertEqual(body[0], {'index': 'test'})
+        self.assertEqual(body[1]['timeout'], '2000ms')
+        self.assertEqual(body[1]['terminate_after'], 500)
+        self.assertTrue(body[1]['profile'])
+        self.assertEqual(client.msearch.call_args[1]['request_timeout'],
+                         2.25)
+
+    def test_bulk_search_cursor(self):
+        """Test that bulk_search leaves the index out of the header of a
+            search against a point in time"""
+        queries = XSEQueries('test', 'test')
+        queries._organization_filters = []
+        client = Mock()
+        client.msearch.return_value = {'responses': [
+            {'took': 1, 'hits': {'hits': [], 'total': {'value': 0}}},
+            {'took': 1, 'hits': {'hits': [], 'total': {'value': 0}}}]}
+
+        with patch('es_api.utils.queries.connections.get_connection') \
+                as get_connection, \
+                patch('es_api.utils.queries.get_config_snapshot') as config, \
+                patch.object(XSEQueries, 'open_point_in_time') as pit, \
+                patch.object(XSEQueries, 'get_results') as get_results:
+            get_connection.return_value = client
+            config.return_value.search_results_per_page = 10
+            config.return_value.course_mapping.course_competency = 'comp'
+            config.return_value.course_mapping.course_derived_from = 'from'
+            pit.return_value = 'pit-id'
+            get_results.return_value = b'{}'
+            results = queries.bulk_search([
+                ('competency', {'comp_uuid': 'a', 'filters': {'cursor': ''}}),
+                ('derived', {'reference': 'b', 'filters': {'page': '1'}})])
+
+        body = client.msearch.call_args[1]['body']
+
+        self.assertNotIn('index', body[0])
+        self.assertEqual(body[1]['pit']['id'], 'pit-id')
+        self.assertEqual(body[2]['index'], 'test')
+        self.assertEqual(results, [(b'{}', None), (b'{}', None)])
@@ -1,11 +1,20 @@
 import json
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 
-from django.test import tag
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, tag
 from django.urls import reverse
+from es_api import async_views
+from core.utils.breaker import CircuitOpenError
+from core.models import SavedFilter, SearchFilter
+from es_api.utils.cache import (facet_cache, last_good_cache,
+                                saved_filter_cache,
+                                search_result_cache)
 from requests.exceptions import HTTPError
 from rest_framework import status
 from rest_framework.test import APITestCase
+from users.models import XDSUser
 
 from django.test import override_settings
 
@@ -34,10 +43,7 @@ class ViewTests(APITestCase):
         """
         url = "%s?keyword=hello&p=1&sort=1" % (reverse('es_api:search-index'))
         with patch('es_api.views.XSEQueries') as query, \
-                patch('es_api.views.SearchFilter.objects') as sfObj, \
-                patch('es_api.views.XDSConfiguration.objects'):
-            sfObj.return_value = []
-            sfObj.filter.return_value = []
+                patch('es_api.views.get_config_snapshot'):
             result_json = json.dumps({"test": "value"})
             query.get_results.return_value = result_json
             query.return_value = query
@@ -46,6 +52,134 @@ class ViewTests(APITestCase):
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(json.loads(response.content), {'test': "value"})
 
+    def test_search_index_cached(self):
+        """
+        Test that repeating an /es-api/ request with an equivalent query is
+        served from the result cache
+        """
+        url = "%s?keyword=hello&p=1" % (reverse('es_api:search-index'))
+        url2 = "%s?keyword=%%20Hello&p=1" % (reverse('es_api:search-index'))
+        search_result_cache.clear()
+        with patch('es_api.views.XSEQueries.search_by_keyword') as search, \
+                patch('es_api.views.XSEQueries.get_results') as results, \
+                patch('es_api.views.XSEQueries.index_generation') as gen, \
+                patch('es_api.views.get_config_snapshot'):
+            gen.return_value = (1, 1, 0)
+            results.return_value = json.dumps({"test": "value"})
+            response = self.client.get(url)
+            response2 = self.client.get(url2)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response2.content, response.content)
+            self.assertEqual(search.call_count, 1)
+
+    def test_search_index_stale(self):
+        """
+        Test that the last good results are served with an Age header while
+        the circuit to Elasticsearch is open
+        """
+        url = "%s?keyword=hello&p=1" % (reverse('es_api:search-index'))
+        search_result_cache.clear()
+        last_good_cache.clear()
+        with patch('es_api.views.XSEQueries.search_by_keyword') as search, \
+                patch('es_api.views.XSEQueries.get_results') as results, \
+                patch('es_api.views.XSEQueries.index_generation') as gen, \
+                patch('es_api.views.get_config_snapshot'):
+            gen.return_value = None
+            results.return_value = json.dumps({"test": "value"})
+            response = self.client.get(url)
+            search_result_cache.clear()
+            search.side_effect = CircuitOpenError('xse')
+            stale = self.client.get(url)
+
+            self.assertEqual(stale.status_code, status.HTTP_200_OK)
+            self.assertEqual(stale.content, response.content)
+            self.assertEqual(stale['Age'], '0')
+            self.assertNotIn('Age', response)
+
+    def test_search_index_profile(self):
+        """
+        Test that a staff user profiling an /es-api/ request bypasses the
+        result cache and gets the timings back
+        """
+        url = "%s?keyword=hello&p=1&profile=1" % (
+            reverse('es_api:search-index'))
+        user = XDSUser.objects.create_user('profile@test.com', 'test1234',
+                                           first_name='profile',
+                                           last_name='user', is_staff=True)
+        self.client.force_authenticate(user=user)
+        search_result_cache.clear()
+        with patch('es_api.views.XSEQueries.search_by_keyword') as search, \
+                patch('es_api.views.XSEQueries.get_results') as results, \
+                patch('es_api.views.XSEQueries.index_generation') as gen, \
+                patch('es_api.views.get_config_snapshot'):
+            gen.return_value = (1, 1, 0)
+            results.return_value = json.dumps({"test": "value"})
+            self.client.get(url)
+            response = self.client.get(url)
+            response_dict = json.loads(response.content)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(search.call_count, 2)
+            self.assertIn('config', response['Server-Timing'])
+            self.assertIn('config', response_dict['profile']['phases'])
+
+    def test_search_index_no_facets(self):
+        """
+        Test that the /es-api/ endpoint skips the aggregations when facets is
+        false
+        """
+        url = "%s?keyword=hello&facets=false" % (
+            reverse('es_api:search-index'))
+        search_result_cache.clear()
+        with patch('es_api.views.XSEQueries') as query, \
+                patch('es_api.views.get_config_snapshot'):
+            query.return_value.search_cache_key.return_value = 'hits-key'
+            query.return_value.get_results.return_value = '{}'
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(query.return_value.search_by_keyword
+                             .call_args[1]['facets'])
+
+    def test_facets(self):
+        """
+        Test that the /es-api/facets/ endpoint returns the facets and caches
+        them
+        """
+        url = "%s?keyword=hello" % (reverse('es_api:facets'))
+        facet_cache.clear()
+        with patch('es_api.views.XSEQueries.search_facets') as search, \
+                patch('es_api.views.XSEQueries.get_facets') as facets, \
+                patch('es_api.views.XSEQueries.index_generation') as gen, \
+                patch('es_api.views.get_config_snapshot'):
+            gen.return_value = (1, 1, 0)
+            facets.return_value = json.dumps({"aggregations": {}})
+            response = self.client.get(url)
+            response2 = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response2.content, response.content)
+            self.assertEqual(search.call_count, 1)
+
+    def test_facets_no_keyword(self):
+        """
+        Test that the /es-api/facets/ endpoint sends an HTTP error when no
+        keyword is provided
+        """
+        url = reverse('es_api:facets')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_index_invalid_cursor(self):
+        """
+        Test that the /es-api/ endpoint returns a bad request when the cursor
+        cannot be decoded
+        """
+        url = "%s?keyword=hello&cursor=bad" % (reverse('es_api:search-index'))
+        with patch('es_api.views.get_config_snapshot'), \
+                patch('es_api.utils.queries.get_config_snapshot'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
     def test_gmlt(self):
         """
         Test that the /es-api/more-like-this/{doc_id} endpoint returns code
@@ -54,7 +188,7 @@ class ViewTests(APITestCase):
         doc_id = 19
         url = reverse('es_api:get-more-like-this', args=(doc_id,))
         with patch('es_api.views.XSEQueries') as query, \
-                patch('es_api.views.XDSConfiguration.objects'):
+                patch('es_api.views.get_config_snapshot'):
             result_json = json.dumps({"test": "value"})
             query.get_results.return_value = result_json
             response = self.client.get(url)
@@ -69,7 +203,7 @@ class ViewTests(APITestCase):
         errorMsg = "error executing ElasticSearch query; please check the logs"
         url = reverse('es_api:get-more-like-this', args=(doc_id,))
         with patch('es_api.views.XSEQueries.more_like_this') as query, \
-                patch('es_api.views.XDSConfiguration.objects'):
+                patch('es_api.views.get_config_snapshot'):
             query.more_like_this.side_effect = [HTTPError]
             response = self.client.get(url)
             responseDict = json.loads(response.content)
@@ -86,7 +220,7 @@ class ViewTests(APITestCase):
         key = 'test'
         url = reverse('es_api:get-similar-courses', args=(key,))
         with patch('es_api.views.XSEQueries') as query, \
-                patch('es_api.views.XDSConfiguration.objects'):
+                patch('es_api.views.get_config_snapshot'):
             result_json = json.dumps({"test": "value"})
             query.get_results.return_value = result_json
             response = self.client.get(url)
@@ -97,16 +231,15 @@ class ViewTests(APITestCase):
         Test that the /es-api/filter-search? endpoint returns code
         200 when successful
         """
-        with patch('es_api.utils.queries.'
-                   'CourseInformationMapping.objects') as course_mapping:
+        with patch('es_api.views.get_config_snapshot') as config:
+            course_mapping = config.return_value.course_mapping
             course_mapping.course_title = "Course.CourseTitle"
             course_mapping.course_provider = "Course.CourseProviderName"
 
             url = "%s?Course.CourseTitle=hi" % (reverse('es_api:filters')) + \
                   "&Course.CourseProviderName=" \
                   "test&CourseInstance.CourseLevel=3&p=1"
-            with patch('es_api.views.XSEQueries') as query, \
-                    patch('es_api.views.XDSConfiguration.objects'):
+            with patch('es_api.views.XSEQueries') as query:
                 result_json = json.dumps({"test": "value"})
                 query.get_results.return_value = result_json
                 response = self.client.get(url)
@@ -117,8 +250,7 @@ class ViewTests(APITestCase):
         Test that the /es-api/filter-search? endpoint returns a server error
         when an exception is raised
         """
-        with patch('es_api.utils.queries.'
-                   'CourseInformationMapping.objects'):
+        with patch('es_api.views.get_config_snapshot'):
             errorMsg = "error executing ElasticSearch query; " \
                        "Please contact " + \
                        "an administrator"
@@ -139,11 +271,8 @@ class ViewTests(APITestCase):
         """
         url = "%s?partial=hi" % (reverse('es_api:suggest'))
         with patch('es_api.views.XSEQueries') as query, \
-                patch('es_api.views.XDSConfiguration.objects'):
-            result_json = {"autocomplete_suggestion": "test"}
-            query.to_dict.return_value = result_json
-            query.suggest = query
-            query.suggest.return_value = query
+                patch('es_api.views.get_config_snapshot'):
+            query.return_value.cached_suggest.return_value = "test"
 
             response = self.client.get(url)
 
@@ -199,10 +328,7 @@ class SearchDerivedTests(APITestCase):
         """
         url = "%s?reference=hello&p=1" % (reverse('es_api:search-derived'))
         with patch('es_api.views.XSEQueries') as query, \
-                patch('es_api.views.SearchFilter.objects') as sf1Obj, \
-                patch('es_api.views.XDSConfiguration.objects'):
-            sf1Obj.return_value = []
-            sf1Obj.filter.return_value = []
+                patch('es_api.views.get_config_snapshot'):
             result_json = json.dumps({"test": "value"})
             query.get_results.return_value = result_json
             query.return_value = query
@@ -235,13 +361,265 @@ class SearchCompetencyTests(APITestCase):
         """
         url = "%s?reference=hello&p=1" % (reverse('es_api:search-competency'))
         with patch('es_api.views.XSEQueries') as query, \
-                patch('es_api.views.SearchFilter.objects') as sf1Obj, \
-                patch('es_api.views.XDSConfiguration.objects'):
-            sf1Obj.return_value = []
-            sf1Obj.filter.return_value = []
+                patch('es_api.views.get_config_snapshot'):
             result_json = json.dumps({"test": "value"})
             query.get_results.return_value = result_json
             query.return_value = query
             response = self.client.get(url)
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(json.loads(response.content), {'test': "value"})
+
+
+@tag('unit')
+class BulkSearchTests(APITestCase):
+
+    def setUp(self):
+        settings_manager = override_settings(SECURE_SSL_REDIRECT=False)
+        settings_manager.enable()
+        self.addCleanup(settings_manager.disable)
+
+    def test_bulk_search_missing(self):
+        """
+        Test that the /es-api/bulk/ endpoint sends an HTTP error when no
+        queries are provided
+        """
+        url = reverse('es_api:bulk-search')
+        response = self.client.post(url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(BULK_SEARCH_MAX_QUERIES=1)
+    def test_bulk_search_too_many(self):
+        """
+        Test that the /es-api/bulk/ endpoint limits the number of queries
+        """
+        url = reverse('es_api:bulk-search')
+        queries = [{'type': 'derived', 'reference': 'a'}] * 2
+        response = self.client.post(url, {'queries': queries},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_search(self):
+        """
+        Test that the /es-api/bulk/ endpoint returns the results of each
+        query in order, with errors in place of invalid queries
+        """
+        url = reverse('es_api:bulk-search')
+        queries = [{'type': 'keyword', 'keyword': 'hello', 'page': 2},
+                   {'type': 'unknown'},
+                   {'type': 'competency', 'reference': 'abc'}]
+        with patch('es_api.views.XSEQueries') as query, \
+                patch('es_api.views.get_config_snapshot') as config:
+            config.return_value.search_filters = []
+            query.return_value.bulk_search.return_value = [
+                (b'{"hits":[1]}', None), (None, 'failed')]
+            response = self.client.post(url, {'queries': queries},
+                                        format='json')
+            specs = query.return_value.bulk_search.call_args[0][0]
+            response_dict = json.loads(response.content)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(specs, [
+                ('keyword', {'keyword': 'hello', 'filters': {'page': '2'},
+                             'facets': True}),
+                ('competency', {'comp_uuid': 'abc',
+                                'filters': {'page': '1'}})])
+            self.assertEqual(response_dict['responses'][0], {'hits': [1]})
+            self.assertIn('error', response_dict['responses'][1])
+            self.assertEqual(response_dict['responses'][2],
+                             {'error': 'failed'})
+
+
+@tag('unit')
+class SavedFilterResultsTests(APITestCase):
+
+    def setUp(self):
+        settings_manager = override_settings(SECURE_SSL_REDIRECT=False)
+        settings_manager.enable()
+        self.addCleanup(settings_manager.disable)
+        self.owner = XDSUser.objects.create_user(
+            'filters@test.com', 'test1234', first_name='filter',
+            last_name='owner')
+        self.saved_filter = SavedFilter.objects.create(
+            owner=self.owner, name='Python',
+            query='?keyword=python&p=2&Course.CourseType=online')
+        saved_filter_cache.clear()
+        self.client.force_authenticate(user=self.owner)
+
+    def test_saved_filter_results(self):
+        """
+        Test that the /es-api/saved-filters/<id>/ endpoint runs the saved
+        search and serves repeated requests from the cache
+        """
+        url = reverse('es_api:saved-filter-results',
+                      args=[self.saved_filter.pk])
+        with patch('es_api.views.XSEQueries.search_by_keyword') as search, \
+                patch('es_api.views.XSEQueries.get_results') as results, \
+                patch('es_api.views.XSEQueries.index_generation') as gen, \
+                patch('es_api.views.get_config_snapshot') as config:
+            gen.return_value = (1, 1, 0)
+            config.return_value.search_filters = [
+                SearchFilter(field_name='Course.CourseType')]
+            results.return_value = json.dumps({"test": "value"})
+            response = self.client.get(url)
+            self.client.get(url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), {'test': "value"})
+            self.assertEqual(search.call_count, 1)
+            self.assertEqual(search.call_args[1], {
+                'keyword': 'python',
+                'filters': {'page': '2',
+                            'Course.CourseType': ['online']}})
+
+    def test_saved_filter_results_not_found(self):
+        """
+        Test that the /es-api/saved-filters/<id>/ endpoint sends a not found
+        error for an unknown saved filter
+        """
+        url = reverse('es_api:saved-filter-results', args=[0])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_saved_filter_results_anonymous(self):
+        """
+        Test that the /es-api/saved-filters/<id>/ endpoint requires a
+        logged in user
+        """
+        self.client.force_authenticate(user=None)
+        url = reverse('es_api:saved-filter-results',
+                      args=[self.saved_filter.pk])
+        response = self.client.get(url)
+
+        self.assertIn(response.status_code, [status.HTTP_401_UNAUTHORIZED,
+                                             status.HTTP_403_FORBIDDEN])
+
+    def test_saved_filter_results_other_owner(self):
+        """
+        Test that the /es-api/saved-filters/<id>/ endpoint sends a not found
+        error for a saved filter of another user
+        """
+        other = XDSUser.objects.create_user(
+            'other@test.com', 'test1234', first_name='other',
+            last_name='user')
+        self.client.force_authenticate(user=other)
+        url = reverse('es_api:saved-filter-results',
+                      args=[self.saved_filter.pk])
+        with patch('es_api.views.get_config_snapshot'):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_saved_filter_results_no_keyword(self):
+        """
+        Test that the /es-api/saved-filters/<id>/ endpoint sends an HTTP
+        error for a saved filter without a keyword
+        """
+        saved_filter = SavedFilter.objects.create(
+            owner=self.owner, name='Empty', query='p=1')
+        url = reverse('es_api:saved-filter-results', args=[saved_filter.pk])
+        with patch('es_api.views.get_config_snapshot'):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@tag('unit')
+class StatsTests(APITestCase):
+
+    def setUp(self):
+        settings_manager = override_settings(SECURE_SSL_REDIRECT=False)
+        settings_manager.enable()
+        self.addCleanup(settings_manager.disable)
+
+    def test_stats_anonymous(self):
+        """
+        Test that the /es-api/stats/ endpoint is not open to anonymous users
+        """
+        url = reverse('es_api:stats')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_stats_staff(self):
+        """
+        Test that the /es-api/stats/ endpoint returns pool stats for staff
+        """
+        url = reverse('es_api:stats')
+        user = XDSUser.objects.create_user('stats@test.com', 'test1234',
+                                           first_name='stats',
+                                           last_name='user', is_staff=True)
+        self.client.force_authenticate(user=user)
+        with patch('es_api.views.pool_stats') as stats:
+            stats.return_value = []
+            response = self.client.get(url)
+            response_dict = json.loads(response.content)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response_dict['pools'], [])
+            self.assertIn('search', response_dict['caches'])
+
+
+@tag('unit')
+class AsyncViewTests(APITestCase):
+
+    def get(self, view, url, **kwargs):
+        request = RequestFactory().get(url)
+        request.user = AnonymousUser()
+
+        return async_to_sync(view.as_view())(request, **kwargs)
+
+    def test_async_search_index(self):
+        """
+        Test that the async /es-api/ view returns the search results
+        """
+        url = "%s?keyword=async&p=1" % (reverse('es_api:search-index'))
+        search_result_cache.clear()
+        with patch('es_api.async_views.AsyncXSEQueries') as query, \
+                patch('es_api.async_views.get_config_snapshot'):
+            query.return_value.index_generation = AsyncMock()
+            query.return_value.search_by_keyword = AsyncMock()
+            query.return_value.search_cache_key.return_value = 'async-key'
+            query.return_value.get_results.return_value = \
+                json.dumps({"test": "value"})
+            response = self.get(async_views.SearchIndexView, url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), {'test': "value"})
+
+    def test_async_gmlt_exception(self):
+        """
+        Test that the async /es-api/more-like-this/{doc_id} view returns a
+        server error when an exception is raised
+        """
+        url = reverse('es_api:get-more-like-this', args=(19,))
+        with patch('es_api.async_views.AsyncXSEQueries') as query, \
+                patch('es_api.async_views.get_config_snapshot'):
+            query.return_value.more_like_this = AsyncMock(
+                side_effect=[HTTPError])
+            response = self.get(async_views.GetMoreLikeThisView, url,
+                                doc_id=19)
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def test_async_permission_denied(self):
+        """
+        Test that the async views run the permission checks of the API
+        before their handler
+        """
+        url = "%s?keyword=async&p=1" % (reverse('es_api:search-index'))
+        with override_settings(OPEN_ENDPOINTS=[]), \
+                patch('es_api.async_views.AsyncXSEQueries') as query:
+            response = self.get(async_views.SearchIndexView, url)
+
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+            query.assert_not_called()
+
+    def test_async_suggestions_missing(self):
+        """
+        Test that the async /es-api/suggest? view returns a bad request
+        when partial is missing
+        """
+        url = "%s?partial=" % (reverse('es_api:suggest'))
+        response = self.get(async_views.SuggestionsView, url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,21 +1,35 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from es_api import views
 
+if settings.ES_API_ASYNC:
+    from es_api import async_views as search_views
+else:
+    search_views = views
+
 router = DefaultRouter()
 
 app_name = 'es_api'
 urlpatterns = [
-    path('more-like-this/<str:doc_id>/', views.GetMoreLikeThisView.as_view(),
+    path('more-like-this/<str:doc_id>/',
+         search_views.GetMoreLikeThisView.as_view(),
          name='get-more-like-this'),
-    path('filter-search/', views.FiltersView.as_view(), name='filters'),
-    path('', views.SearchIndexView.as_view(), name='search-index'),
-    path('suggest/', views.SuggestionsView.as_view(), name='suggest'),
-    path('derived-from/', views.SearchDerivedView.as_view(),
+    path('filter-search/', search_views.FiltersView.as_view(),
+         name='filters'),
+    path('', search_views.SearchIndexView.as_view(), name='search-index'),
+    path('suggest/', search_views.SuggestionsView.as_view(), name='suggest'),
+    path('facets/', search_views.FacetsView.as_view(), name='facets'),
+    path('derived-from/', search_views.SearchDerivedView.as_view(),
          name='search-derived'),
-    path('teaches/', views.SearchCompetencyView.as_view(),
+    path('teaches/', search_views.SearchCompetencyView.as_view(),
          name='search-competency'),
     path('similar-courses/<str:key>/',
-         views.GetSimilarCoursesView.as_view(), name='get-similar-courses'),
+         search_views.GetSimilarCoursesView.as_view(),
+         name='get-similar-courses'),
+    path('bulk/', views.BulkSearchView.as_view(), name='bulk-search'),
+    path('saved-filters/<int:filter_id>/',
+         views.SavedFilterResultsView.as_view(), name='saved-filter-results'),
+    path('stats/', views.StatsView.as_view(), name='stats'),
 ]
@@ -0,0 +1,35 @@
+import time
+
+from elasticsearch import AIOHttpConnection, TransportError
+
+from core.utils.breaker import get_breaker
+
+from .connections import NodeStats, NodeUnavailableError, is_upstream_error
+
+
+class AsyncBreakerConnection(AIOHttpConnection):
+    """AIOHttpConnection whose requests go through the circuit breaker of
+        its Elasticsearch node, shared with the sync clients"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = get_breaker('xse:' + self.host,
+                                   open_error=NodeUnavailableError)
+        self.node_stats = NodeStats()
+
+    async def perform_request(self, *args, **kwargs):
+        probe = await self.breaker.before_call_async()
+        started = time.monotonic()
+        failed = True
+
+        try:
+            response = await super().perform_request(*args, **kwargs)
+            failed = self.breaker.is_slow(started)
+
+            return response
+        except TransportError as err:
+            failed = is_upstream_error(err)
+            raise
+        finally:
+            await self.breaker.after_call_async(probe, failed)
+            self.node_stats.record(started, failed)
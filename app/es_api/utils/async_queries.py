@@ -0,0 +1,130 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from es_api.models import CourseNeighbors
+
+from .cache import async_get_index_generation, suggest_cache
+from .connections import get_async_connection
+from .queries import XSEQueries
+
+logger = logging.getLogger('dict_config_logger')
+
+
+class AsyncXSEQueries(XSEQueries):
+    """
+    Variant of XSEQueries whose search methods are coroutines executed on the
+    AsyncElasticsearch client. Queries are still built by the XSEQueries
+    build_* methods, which run in a thread as they read the database.
+    """
+
+    def __init__(self, host, index, **kwargs):
+        super().__init__(host, index, **kwargs)
+        self.client = get_async_connection(host, index)
+
+    async def execute(self, budget_ms=None):
+        """This method executes the current search on the async client within
+            the latency budget of the endpoint and returns the
+            elasticsearch_dsl Response Object"""
+        self.prepare_execute(budget_ms)
+
+        with self.timer.phase('execute'):
+            raw = await self.client.search(index=self.search._index,
+                                           body=self.search.to_dict(),
+                                           **self.search._params)
+
+        response = self.search._response_class(self.search, raw)
+        self.timer.record_response(response)
+
+        return response
+
+    async def index_generation(self):
+        return await async_get_index_generation(self.client, self.using,
+                                                self.index)
+
+    async def search_by_keyword(self, keyword="", filters={}, facets=True):
+        with self.timer.phase('build'):
+            await sync_to_async(self.build_search_by_keyword)(
+                keyword=keyword, filters=filters, facets=facets)
+
+        return await self.execute()
+
+    async def search_facets(self, keyword="", filters={}):
+        with self.timer.phase('build'):
+            await sync_to_async(self.build_search_facets)(
+                keyword=keyword, filters=filters)
+
+        return await self.execute()
+
+    async def search_by_competency(self, comp_uuid="", filters={}):
+        with self.timer.phase('build'):
+            await sync_to_async(self.build_search_by_competency)(
+                comp_uuid=comp_uuid, filters=filters)
+
+        return await self.execute()
+
+    async def search_for_derived(self, reference="", filters={}):
+        with self.timer.phase('build'):
+            await sync_to_async(self.build_search_for_derived)(
+                reference=reference, filters=filters)
+
+        return await self.execute()
+
+    async def precomputed_neighbors(self, kind, key, size):
+        with self.timer.phase('build'):
+            doc_ids = await sync_to_async(self.build_neighbors)(kind, key)
+
+        if doc_ids is None:
+            return None
+
+        return self.rank_neighbors(await self.execute(), doc_ids, size)
+
+    async def more_like_this(self, doc_id):
+        response = await self.precomputed_neighbors(
+            CourseNeighbors.MORE_LIKE_THIS, doc_id, self.more_like_this_size)
+
+        if response is not None:
+            return response
+
+        with self.timer.phase('build'):
+            await sync_to_async(self.build_more_like_this)(doc_id=doc_id)
+
+        return await self.execute()
+
+    async def similar_courses(self, keyword=""):
+        response = await self.precomputed_neighbors(
+            CourseNeighbors.SIMILAR_COURSES, keyword,
+            self.similar_courses_size)
+
+        if response is not None:
+            return response
+
+        with self.timer.phase('build'):
+            await sync_to_async(self.build_similar_courses)(keyword=keyword)
+
+        return await self.execute()
+
+    async def search_by_filters(self, page_num, filters={}):
+        with self.timer.phase('build'):
+            await sync_to_async(self.build_search_by_filters)(
+                page_num=page_num, filters=filters)
+
+        return await self.execute()
+
+    async def suggest(self, partial):
+        with self.timer.phase('build'):
+            await sync_to_async(self.build_suggest)(partial=partial)
+
+        return await self.execute(settings.SUGGEST_BUDGET_MS)
+
+    async def cached_suggest(self, partial):
+        partial_key, context = await sync_to_async(self.suggest_cache_key)(
+            partial)
+        suggestions = suggest_cache.get_suggestions(partial_key, context)
+
+        if suggestions is None:
+            suggestions = self.cache_suggestions(partial_key, context,
+                                                 await self.suggest(partial))
+
+        return suggestions
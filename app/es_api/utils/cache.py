@@ -0,0 +1,426 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from elasticsearch_dsl import connections
+
+from core.utils.breaker import CircuitOpenError
+from core.utils.coalesce import SingleFlight
+
+from .serializers import is_cacheable
+from .suggest import derive_suggestions
+
+logger = logging.getLogger('dict_config_logger')
+
+# shared version of the organization memberships of a user, by user id
+USER_ORGANIZATIONS_VERSION_KEY = 'xds:user-organizations-version:{}'
+
+
+class LRUCache():
+    """Thread safe, size bounded, in-process cache with a per entry TTL that
+        evicts the least recently used entry when full"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Returns the cached value for key or default when missing/expired"""
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def peek(self, key):
+        """Returns the cached value for key without counting a lookup or
+            updating its recency"""
+        entry = self._data.get(key)
+
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Stores value under key, evicting the oldest entries when full"""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key, default_func, ttl=None, cacheable=None):
+        """Returns the cached value for key, computing and storing it with
+            default_func on a miss. A computed value is not stored when
+            cacheable(value) is false."""
+        value = self.get(key)
+
+        if value is None:
+            value = default_func()
+
+            if cacheable is None or cacheable(value):
+                self.set(key, value, ttl=ttl)
+
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Returns the size and hit/miss counters of the cache"""
+        lookups = self.hits + self.misses
+
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class GenerationalCache(LRUCache):
+    """LRUCache that is emptied whenever the generation of the Elasticsearch
+        index backing its entries changes"""
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self.generation = None
+        self.invalidations = 0
+
+    def sync_generation(self, generation):
+        """Clears the cache when generation differs from the one the cached
+            entries were computed against"""
+        if generation is None or generation == self.generation:
+            return
+
+        with self._lock:
+            if self.generation is not None:
+                self._data.clear()
+                self.invalidations += 1
+            self.generation = generation
+
+    def stats(self):
+        stats = super().stats()
+        stats['invalidations'] = self.invalidations
+
+        return stats
+
+
+class PrefixCache(LRUCache):
+    """LRUCache of autocomplete suggestions keyed on (partial, context) that
+        answers a partial from the complete suggestions cached for a shorter
+        partial it starts with when possible"""
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self.derived = 0
+
+    def get_suggestions(self, partial, context):
+        """Returns the suggestions for a normalized partial, cached or
+            derived from a shorter partial, or None on a miss"""
+        cached = self.get((partial, context))
+
+        if cached is not None:
+            return cached['suggestions']
+
+        for length in range(len(partial) - 1, 0, -1):
+            shorter = self.peek((partial[:length], context))
+
+            if shorter is None or not shorter['complete']:
+                continue
+
+            suggestions = derive_suggestions(shorter['suggestions'],
+                                             partial[:length], partial)
+
+            if suggestions is None:
+                return None
+
+            self.derived += 1
+            self.set_suggestions(partial, context, suggestions, True)
+
+            return suggestions
+
+        return None
+
+    def set_suggestions(self, partial, context, suggestions, complete):
+        """Stores the suggestions for a normalized partial, complete is
+            whether they hold every candidate for it"""
+        self.set((partial, context), {'suggestions': suggestions,
+                                      'complete': complete})
+
+    def stats(self):
+        stats = super().stats()
+        lookups = self.hits + self.misses
+        stats['derived'] = self.derived
+        # share of lookups answered without a query to Elasticsearch
+        stats['hit_rate'] = round((self.hits + self.derived) / lookups, 4) \
+            if lookups else 0.0
+
+        return stats
+
+
+class LastGoodCache(LRUCache):
+    """LRUCache of the last good results of each search, served in place of
+        a search while the circuit to Elasticsearch is open"""
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self.served = 0
+
+    def remember(self, key, func):
+        """Returns func() along with an age of None, or when the circuit to
+            Elasticsearch is open, the last good results for key along with
+            their age in seconds"""
+        try:
+            value = func()
+        except CircuitOpenError as err:
+            return self._last_good(key, err)
+
+        self.set(key, (time.time(), value))
+
+        return value, None
+
+    async def remember_async(self, key, coro_func):
+        """Coroutine variant of remember for the async views"""
+        try:
+            value = await coro_func()
+        except CircuitOpenError as err:
+            return self._last_good(key, err)
+
+        self.set(key, (time.time(), value))
+
+        return value, None
+
+    def _last_good(self, key, err):
+        """This helper method returns the last good results for key and
+            their age, raising the open circuit error when there are none"""
+        entry = self.get(key)
+
+        if entry is None:
+            raise err
+
+        self.served += 1
+
+        return entry[1], int(time.time() - entry[0])
+
+    def stats(self):
+        stats = super().stats()
+        stats['served'] = self.served
+
+        return stats
+
+
+# (using, index) -> (checked_at, generation)
+_generations = {}
+
+
+def _known_generation(using, index):
+    """This helper method returns whether the cached generation for the index
+        is still fresh, along with the cached generation"""
+    checked_at, generation = _generations.get((using, index), (None, None))
+    fresh = checked_at is not None and time.monotonic() - checked_at < \
+        settings.INDEX_GENERATION_CHECK_INTERVAL
+
+    return fresh, generation
+
+
+def _generation_from_stats(stats):
+    """This helper method reduces an index stats response to a generation"""
+    primaries = stats['_all']['primaries']
+
+    return (primaries['docs']['count'],
+            primaries['indexing']['index_total'],
+            primaries['indexing']['delete_total'])
+
+
+def get_index_generation(using, index):
+    """This method returns a token that changes whenever documents are added,
+        updated or deleted in the index. The index stats are fetched at most
+        once every INDEX_GENERATION_CHECK_INTERVAL seconds per worker."""
+    fresh, generation = _known_generation(using, index)
+
+    if fresh:
+        return generation
+
+    try:
+        generation = _generation_from_stats(
+            connections.get_connection(using).indices.stats(
+                index=index, metric='docs,indexing'))
+    except Exception as err:
+        # keep serving against the last known generation
+        logger.error(err)
+
+    _generations[(using, index)] = (time.monotonic(), generation)
+
+    return generation
+
+
+async def async_get_index_generation(client, using, index):
+    """This method is the AsyncElasticsearch variant of
+        get_index_generation, sharing the same per worker cache"""
+    fresh, generation = _known_generation(using, index)
+
+    if fresh:
+        return generation
+
+    try:
+        generation = _generation_from_stats(
+            await client.indices.stats(index=index, metric='docs,indexing'))
+    except Exception as err:
+        logger.error(err)
+
+    _generations[(using, index)] = (time.monotonic(), generation)
+
+    return generation
+
+
+def make_search_key(kind, query, filters=None, organizations=None):
+    """This method returns a canonical cache key for a search so that
+        equivalent requests share a cache entry. Keywords are case folded and
+        whitespace collapsed, and filter values are sorted."""
+    normalized_filters = []
+
+    for name, value in sorted((filters or {}).items()):
+        if name == 'page':
+            value = int(value)
+        elif isinstance(value, (list, tuple)):
+            value = sorted(value)
+        normalized_filters.append([name, value])
+
+    return json.dumps([
+        kind,
+        ' '.join(str(query).casefold().split()),
+        normalized_filters,
+        None if organizations is None else sorted(organizations),
+    ])
+
+
+search_result_cache = GenerationalCache(
+    maxsize=settings.SEARCH_CACHE_MAXSIZE, ttl=settings.SEARCH_CACHE_TTL)
+
+facet_cache = GenerationalCache(
+    maxsize=settings.FACET_CACHE_MAXSIZE, ttl=settings.FACET_CACHE_TTL)
+
+# results of saved filters run by id, per filter and organization set
+saved_filter_cache = GenerationalCache(
+    maxsize=settings.SAVED_FILTER_CACHE_MAXSIZE,
+    ttl=settings.SAVED_FILTER_CACHE_TTL)
+
+# (user id, config snapshot version, memberships version) -> organization
+# filters of the user
+user_organization_cache = LRUCache(
+    maxsize=settings.USER_ORGANIZATION_CACHE_MAXSIZE,
+    ttl=settings.USER_ORGANIZATION_CACHE_TTL)
+
+# user id -> memberships version of the user, checked against the shared
+# version at most once every CONFIG_SNAPSHOT_CHECK_INTERVAL seconds
+user_organization_versions = LRUCache(
+    maxsize=settings.USER_ORGANIZATION_CACHE_MAXSIZE,
+    ttl=settings.CONFIG_SNAPSHOT_CHECK_INTERVAL)
+
+# search cache key -> (stored at, results), served while Elasticsearch is down
+last_good_cache = LastGoodCache(
+    maxsize=settings.LAST_GOOD_CACHE_MAXSIZE,
+    ttl=settings.LAST_GOOD_CACHE_TTL)
+
+# coalesces identical concurrent searches made by this worker
+search_flight = SingleFlight('search')
+
+# (normalized partial, organization filters) -> autocomplete suggestions
+suggest_cache = PrefixCache(
+    maxsize=settings.SUGGEST_CACHE_MAXSIZE, ttl=settings.SUGGEST_CACHE_TTL)
+
+
+def get_user_organizations_version(user_pk):
+    """This method returns the version of the organization memberships of a
+        user, which changes whenever they are added to or removed from an
+        organization"""
+    return user_organization_versions.get_or_set(
+        user_pk, lambda: caches['shared'].get(
+            USER_ORGANIZATIONS_VERSION_KEY.format(user_pk), 0))
+
+
+def invalidate_user_organizations(user_pk):
+    """This method bumps the shared memberships version of a user so that
+        every worker drops their cached organization filters, this one
+        right away and the others on their next check"""
+    cache = caches['shared']
+    key = USER_ORGANIZATIONS_VERSION_KEY.format(user_pk)
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+    user_organization_versions.delete(user_pk)
+
+
+def cached_search(key, search, cache=None, profile=False):
+    """This method returns the results of search() along with the age of the
+        last good results served in their place, if any. Results are looked
+        up in cache first when one is given, identical concurrent searches
+        share one call and the last good results are served while the
+        circuit to Elasticsearch is open. Profiled requests always run the
+        search."""
+    if profile:
+        return search(), None
+
+    def fetch():
+        return search_flight.do(key, search)
+
+    if cache is None:
+        return last_good_cache.remember(key, fetch)
+
+    return last_good_cache.remember(
+        key, lambda: cache.get_or_set(key, fetch, cacheable=is_cacheable))
+
+
+async def async_cached_search(key, search, cache=None, profile=False):
+    """Coroutine variant of cached_search for the async views, search
+        returns an awaitable"""
+    if profile:
+        return await search(), None
+
+    async def fetch():
+        results = None if cache is None else cache.get(key)
+
+        if results is None:
+            results = await search_flight.do_async(key, search)
+
+            if cache is not None and is_cacheable(results):
+                cache.set(key, results)
+
+        return results
+
+    return await last_good_cache.remember_async(key, fetch)
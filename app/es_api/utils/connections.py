@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from elasticsearch import (ConnectionError, ConnectionSelector,
+                           RoundRobinSelector, TransportError,
+                           Urllib3HttpConnection)
+from elasticsearch_dsl import connections
+
+from core.utils.breaker import CircuitOpenError, get_breaker
+
+from .serializers import OrjsonSerializer
+
+logger = logging.getLogger('dict_config_logger')
+
+# (host, index) -> connection alias registered with elasticsearch_dsl
+_registry = {}
+_registry_lock = threading.Lock()
+
+# (host, index) -> AsyncElasticsearch client, only used by the async views
+_async_registry = {}
+
+# shared by every client, responses are decoded once with orjson
+_serializer = OrjsonSerializer()
+
+
+def is_upstream_error(err):
+    """This method returns whether an Elasticsearch error is a failure of the
+        node, a lost connection or a server error, rather than a bad request
+        that should not trip its circuit breaker"""
+    return not isinstance(err.status_code, int) or err.status_code >= 500
+
+
+class NodeUnavailableError(CircuitOpenError, ConnectionError):
+    """Raised instead of a request to an Elasticsearch node whose circuit is
+        open. The client handles it like a failed connection and retries the
+        request on another node of the cluster."""
+
+    def __init__(self, name):
+        ConnectionError.__init__(self, 'N/A', f'Circuit to {name} is open',
+                                 None)
+        self.name = name
+
+
+class NodeStats():
+    """Request count, failures and moving average latency of the requests a
+        worker made to one Elasticsearch node"""
+    # weight of the latest request in the moving average
+    weight = 0.2
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        # seconds, None until a request succeeded
+        self.latency = None
+
+    def record(self, started, failed):
+        """Records a request started at the given monotonic time"""
+        self.requests += 1
+
+        if failed:
+            self.failures += 1
+            return
+
+        elapsed = time.monotonic() - started
+        latency = self.latency
+        self.latency = elapsed if latency is None else \
+            latency + self.weight * (elapsed - latency)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'latency_ms': None if self.latency is None
+            else round(self.latency * 1000, 3),
+        }
+
+
+class LeastLatencySelector(ConnectionSelector):
+    """Sends each request to the live node with the lowest moving average
+        latency, nodes without a successful request yet are tried first"""
+
+    def select(self, connections):
+        return min(connections, key=lambda conn: conn.node_stats.latency or 0)
+
+
+# XSE_HOST_SELECTOR -> connection selector of the clients
+SELECTORS = {
+    'round-robin': RoundRobinSelector,
+    'least-latency': LeastLatencySelector,
+}
+
+
+class BreakerConnection(Urllib3HttpConnection):
+    """Urllib3HttpConnection whose requests go through the circuit breaker of
+        its Elasticsearch node, so an unresponsive node fails fast"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = get_breaker('xse:' + self.host,
+                                   open_error=NodeUnavailableError)
+        self.node_stats = NodeStats()
+
+    def perform_request(self, *args, **kwargs):
+        probe = self.breaker.before_call()
+        started = time.monotonic()
+        failed = True
+
+        try:
+            response = super().perform_request(*args, **kwargs)
+            failed = self.breaker.is_slow(started)
+
+            return response
+        except TransportError as err:
+            failed = is_upstream_error(err)
+            raise
+        finally:
+            self.breaker.after_call(probe, failed)
+            self.node_stats.record(started, failed)
+
+
+def parse_hosts(host):
+    """This method returns the list of nodes in a target_xse_host, which
+        holds a single host or several comma separated hosts"""
+    return [node.strip() for node in host.split(',') if node.strip()]
+
+
+def client_options():
+    """This method returns the options shared by the sync and async clients
+        for node selection, dead node backoff and sniffing"""
+    options = {
+        'timeout': settings.XSE_CLIENT_TIMEOUT,
+        'maxsize': settings.XSE_POOL_MAXSIZE,
+        'serializer': _serializer,
+        'selector_class': SELECTORS[settings.XSE_HOST_SELECTOR],
+        # a failed node is skipped for this long, doubling on each
+        # consecutive failure
+        'dead_timeout': settings.XSE_DEAD_TIMEOUT,
+    }
+
+    # nodes are sniffed after a failure and then periodically, rather than
+    # on start up, so an unreachable seed host cannot fail the client
+    if settings.XSE_SNIFF_INTERVAL:
+        options.update(sniff_on_connection_fail=True,
+                       sniffer_timeout=settings.XSE_SNIFF_INTERVAL)
+
+    return options
+
+
+def _build_alias(host, index):
+    """This helper method returns a stable connection alias for a host and
+        index pair"""
+    digest = hashlib.sha1(f'{host}|{index}'.encode('utf-8')).hexdigest()
+
+    return 'xse-' + digest[:12]
+
+
+def _close_connection(alias):
+    """This helper method closes the pooled client registered under alias and
+        removes it from the elasticsearch_dsl registry"""
+    try:
+        client = connections.get_connection(alias)
+        client.transport.close()
+        connections.remove_connection(alias)
+    except KeyError:
+        pass
+    except Exception as err:
+        logger.error(err)
+
+
+def get_connection_alias(host, index):
+    """This method returns the alias of the long-lived Elasticsearch client
+        for a host and index, creating the client the first time the pair is
+        requested. Clients for a previously configured host on the same index
+        are closed so that only the active host keeps a pool open."""
+    key = (host, index)
+    alias = _registry.get(key)
+
+    if alias is not None:
+        return alias
+
+    with _registry_lock:
+        # another thread may have registered the client while we waited
+        if key in _registry:
+            return _registry[key]
+
+        # target_xse_host was changed, tear down the pool for the old host
+        for stale_key in [k for k in _registry
+                          if k[1] == index and k[0] != host]:
+            _close_connection(_registry.pop(stale_key))
+
+        alias = _build_alias(host, index)
+        connections.create_connection(alias=alias,
+                                      hosts=parse_hosts(host),
+                                      connection_class=BreakerConnection,
+                                      **client_options())
+        _registry[key] = alias
+        logger.info('Created Elasticsearch client pool for %s', host)
+
+    return alias
+
+
+def get_async_connection(host, index):
+    """This method returns the long-lived AsyncElasticsearch client for a
+        host and index. It must be called from within the event loop of an
+        ASGI worker, the client's aiohttp session is bound to that loop."""
+    # imported here as the async client needs the optional aiohttp package
+    from elasticsearch import AsyncElasticsearch
+
+    from .async_connections import AsyncBreakerConnection
+
+    key = (host, index)
+    client = _async_registry.get(key)
+
+    if client is not None:
+        return client
+
+    # target_xse_host was changed, close the session for the old host
+    for stale_key in [k for k in _async_registry
+                      if k[1] == index and k[0] != host]:
+        asyncio.ensure_future(_async_registry.pop(stale_key).close())
+
+    client = AsyncElasticsearch(hosts=parse_hosts(host),
+                                connection_class=AsyncBreakerConnection,
+                                **client_options())
+    _async_registry[key] = client
+    logger.info('Created async Elasticsearch client for %s', host)
+
+    return client
+
+
+def reset_connections():
+    """This method closes every pooled client in the registry"""
+    with _registry_lock:
+        for key in list(_registry):
+            _close_connection(_registry.pop(key))
+
+
+def pool_stats():
+    """This method returns connection pool statistics for every node of
+        every registered client so pool sizes can be tuned per worker, along
+        with the latency of the node and whether it is marked dead"""
+    stats = []
+
+    for (host, index), alias in list(_registry.items()):
+        try:
+            client = connections.get_connection(alias)
+        except KeyError:
+            continue
+
+        connection_pool = client.transport.connection_pool
+        dead_count = getattr(connection_pool, 'dead_count', {})
+
+        # a client with a single node has no dead nodes to leave out
+        for conn in getattr(connection_pool, 'orig_connections',
+                            connection_pool.connections):
+            pool = getattr(conn, 'pool', None)
+            queue = getattr(pool, 'pool', None)
+
+            if queue is None:
+                continue
+
+            # the queue is pre-filled with None placeholders up to maxsize,
+            # checked out slots are missing from it entirely
+            idle = sum(1 for item in list(queue.queue) if item is not None)
+            stats.append({
+                'host': conn.host,
+                'index': index,
+                'maxsize': settings.XSE_POOL_MAXSIZE,
+                'in_use': settings.XSE_POOL_MAXSIZE - queue.qsize(),
+                'idle': idle,
+                'created': pool.num_connections,
+                'requests': pool.num_requests,
+                'dead': conn not in connection_pool.connections,
+                'dead_count': dead_count.get(conn, 0),
+                'node': conn.node_stats.stats(),
+            })
+
+    return stats
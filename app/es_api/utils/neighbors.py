@@ -0,0 +1,252 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from elasticsearch_dsl import MultiSearch, connections
+
+from configurations.utils.snapshot import get_config_snapshot
+from es_api.models import CourseNeighbors
+
+logger = logging.getLogger('dict_config_logger')
+
+# longest keyword a similar courses result is stored for
+MAX_KEY_LENGTH = CourseNeighbors._meta.get_field('key').max_length
+
+# shared cache key of the time the last full run finished
+FULL_RUN_KEY = 'xds:neighbors:full-run'
+
+
+def full_run_due():
+    """This method returns whether NEIGHBORS_FULL_INTERVAL seconds passed
+        since the last full run, so that new documents reach the neighbors
+        of documents that did not change"""
+    if settings.NEIGHBORS_FULL_INTERVAL <= 0:
+        return False
+
+    finished = caches['shared'].get(FULL_RUN_KEY)
+
+    return finished is None or \
+        time.time() - finished >= settings.NEIGHBORS_FULL_INTERVAL
+
+
+def get_neighbors(kind, key):
+    """This method returns the stored neighbor IDs for a document ID or
+        keyword, or None when none were computed"""
+    return CourseNeighbors.objects.filter(kind=kind, key=key) \
+        .values_list('neighbors', flat=True).first()
+
+
+def field_values(source, path):
+    """This method returns the string values found at a dotted field path in
+        a document's source, descending into lists"""
+    values = [source]
+
+    for part in path.split('.'):
+        found = []
+
+        for value in values:
+            value = value.get(part) if isinstance(value, dict) else None
+
+            if isinstance(value, list):
+                found.extend(value)
+            elif value is not None:
+                found.append(value)
+
+        values = found
+
+    return [value for value in values if isinstance(value, str) and value]
+
+
+class NeighborsBuilder():
+    """Walks the search index through a point in time and stores the top
+        neighbors of every document, as served by the more like this and
+        similar courses views. Unless full is set, only documents whose
+        version changed since the last run are recomputed, along with the
+        documents and keywords whose stored neighbors include a changed or
+        removed document."""
+
+    def __init__(self, queries_class, host, index, full=False):
+        self.queries_class = queries_class
+        self.host = host
+        self.index = index
+        self.full = full
+        self.using = queries_class(host, index).using
+        course_mapping = get_config_snapshot().course_mapping
+        self.keyword_fields = [course_mapping.course_competency,
+                               course_mapping.course_subject]
+        self.seen_ids = set()
+        self.seen_keywords = set()
+        self.computed_keywords = set()
+        self.changed_ids = set()
+        self.computed = 0
+
+    def run(self):
+        """Computes the neighbors of the changed documents, removes those of
+            documents no longer in the index and returns the number of
+            results computed"""
+        for batch in self.walk():
+            self.process(batch)
+
+        if not self.full:
+            self.refresh_stale()
+
+        self.remove_unseen(CourseNeighbors.MORE_LIKE_THIS, self.seen_ids)
+        self.remove_unseen(CourseNeighbors.SIMILAR_COURSES,
+                           self.seen_keywords)
+        logger.info(f'Computed {self.computed} neighbors of '
+                    f'{len(self.seen_ids)} documents')
+
+        if self.full:
+            caches['shared'].set(FULL_RUN_KEY, time.time(), None)
+
+        return self.computed
+
+    def walk(self):
+        """This method yields the hits of the index in batches of
+            NEIGHBORS_BATCH_SIZE, with their version and keyword fields"""
+        client = connections.get_connection(self.using)
+        pit_id = client.open_point_in_time(
+            index=self.index,
+            keep_alive=settings.SEARCH_CURSOR_KEEP_ALIVE)['id']
+        search_after = None
+
+        try:
+            while True:
+                body = {
+                    'size': settings.NEIGHBORS_BATCH_SIZE,
+                    '_source': self.keyword_fields,
+                    'seq_no_primary_term': True,
+                    'sort': [{'_shard_doc': 'asc'}],
+                    'pit': {'id': pit_id,
+                            'keep_alive': settings.SEARCH_CURSOR_KEEP_ALIVE},
+                }
+
+                if search_after is not None:
+                    body['search_after'] = search_after
+
+                response = client.search(body=body)
+                hits = response['hits']['hits']
+                pit_id = response.get('pit_id', pit_id)
+
+                if not hits:
+                    break
+
+                yield hits
+
+                search_after = hits[-1]['sort']
+        finally:
+            client.close_point_in_time(body={'id': pit_id})
+
+    def process(self, hits):
+        """This method computes and stores the neighbors of the documents in
+            a batch that changed, along with those of their keywords"""
+        versions = {hit['_id']: f"{hit['_primary_term']}:{hit['_seq_no']}"
+                    for hit in hits}
+        self.seen_ids.update(versions)
+        stored = dict(CourseNeighbors.objects.filter(
+            kind=CourseNeighbors.MORE_LIKE_THIS, key__in=list(versions))
+            .values_list('key', 'version'))
+        doc_ids = [doc_id for doc_id, version in versions.items()
+                   if self.full or stored.get(doc_id) != version]
+        changed = set(doc_ids)
+        self.changed_ids.update(changed)
+        keywords = []
+
+        for hit in hits:
+            for field in self.keyword_fields:
+                for keyword in field_values(hit.get('_source', {}), field):
+                    if len(keyword) > MAX_KEY_LENGTH:
+                        continue
+
+                    self.seen_keywords.add(keyword)
+
+                    # a keyword is computed once per run, for the first
+                    # changed document it is found in
+                    if hit['_id'] in changed and \
+                            keyword not in self.computed_keywords:
+                        self.computed_keywords.add(keyword)
+                        keywords.append(keyword)
+
+        self.store(CourseNeighbors.MORE_LIKE_THIS, doc_ids, versions,
+                   self.search_all(doc_ids, 'build_more_like_this', 'doc_id'))
+        self.store(CourseNeighbors.SIMILAR_COURSES, keywords, {},
+                   self.search_all(keywords, 'build_similar_courses',
+                                   'keyword'))
+
+    def refresh_stale(self):
+        """This method recomputes the neighbors stored for unchanged
+            documents and keywords that include a document that changed or
+            is no longer in the index"""
+        stored_ids = CourseNeighbors.objects.filter(
+            kind=CourseNeighbors.MORE_LIKE_THIS).values_list('key', flat=True)
+        stale = self.changed_ids | {doc_id for doc_id in stored_ids.iterator()
+                                    if doc_id not in self.seen_ids}
+
+        if not stale:
+            return
+
+        for kind, seen, computed, build, argument in [
+                (CourseNeighbors.MORE_LIKE_THIS, self.seen_ids,
+                 self.changed_ids, 'build_more_like_this', 'doc_id'),
+                (CourseNeighbors.SIMILAR_COURSES, self.seen_keywords,
+                 self.computed_keywords, 'build_similar_courses',
+                 'keyword')]:
+            rows = CourseNeighbors.objects.filter(kind=kind) \
+                .values_list('key', 'version', 'neighbors')
+            versions = {key: version
+                        for key, version, neighbors in rows.iterator()
+                        if key in seen and key not in computed and
+                        not stale.isdisjoint(neighbors)}
+            keys = list(versions)
+
+            for start in range(0, len(keys), settings.NEIGHBORS_BATCH_SIZE):
+                batch = keys[start:start + settings.NEIGHBORS_BATCH_SIZE]
+                self.store(kind, batch, versions,
+                           self.search_all(batch, build, argument))
+
+    def search_all(self, keys, build, argument):
+        """This helper method runs the query built by the named XSEQueries
+            method for each key in one multi search and returns the IDs of
+            the hits of each"""
+        if not keys:
+            return []
+
+        multi_search = MultiSearch(using=self.using, index=self.index)
+
+        for key in keys:
+            queries = self.queries_class(self.host, self.index)
+            search = getattr(queries, build)(**{argument: key})
+            multi_search = multi_search.add(
+                search.source(False)[0:settings.NEIGHBORS_SIZE])
+
+        return [[hit.meta.id for hit in response]
+                for response in multi_search.execute()]
+
+    def store(self, kind, keys, versions, neighbors):
+        """This helper method replaces the stored neighbors for the keys"""
+        if not keys:
+            return
+
+        with transaction.atomic():
+            CourseNeighbors.objects.filter(kind=kind, key__in=keys).delete()
+            CourseNeighbors.objects.bulk_create([
+                CourseNeighbors(kind=kind, key=key, neighbors=key_neighbors,
+                                version=versions.get(key, ''))
+                for key, key_neighbors in zip(keys, neighbors)])
+
+        self.computed += len(keys)
+
+    def remove_unseen(self, kind, seen):
+        """This helper method removes the neighbors stored for keys that
+            were not found in the index"""
+        stored = CourseNeighbors.objects.filter(kind=kind) \
+            .values_list('key', flat=True)
+        unseen = [key for key in stored.iterator() if key not in seen]
+
+        for start in range(0, len(unseen), settings.NEIGHBORS_BATCH_SIZE):
+            CourseNeighbors.objects.filter(
+                kind=kind,
+                key__in=unseen[start:start + settings.NEIGHBORS_BATCH_SIZE]) \
+                .delete()
@@ -0,0 +1,33 @@
+import base64
+import binascii
+import json
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor sent by a client cannot be decoded"""
+
+
+def encode_cursor(pit_id, search_after):
+    """This method returns the opaque cursor token a client sends back to
+        fetch the page following the hit with the given sort values"""
+    payload = json.dumps({'pit': pit_id, 'after': search_after},
+                         separators=(',', ':'))
+
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    """This method returns the point in time id and search_after values
+        stored in a cursor token"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        pit_id = payload['pit']
+        search_after = payload['after']
+    except (binascii.Error, UnicodeError, ValueError, KeyError,
+            TypeError) as err:
+        raise InvalidCursorError('Invalid cursor') from err
+
+    if not isinstance(pit_id, str) or not isinstance(search_after, list):
+        raise InvalidCursorError('Invalid cursor')
+
+    return pit_id, search_after
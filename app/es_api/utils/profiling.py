@@ -0,0 +1,154 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import orjson
+from django.conf import settings
+
+
+class PhaseTimer():
+    """Records how long each phase of an /es-api/ request took, in
+        milliseconds. The time spent in a phase nested inside another is
+        only counted for the inner phase. With profile set, the search also
+        asks Elasticsearch for its profile."""
+
+    def __init__(self, profile=False):
+        self.profile = profile
+        self.phases = {}
+        self.es_took = None
+        self.es_profile = None
+        # time spent in the nested phases of each open phase
+        self._nested = []
+
+    @contextmanager
+    def phase(self, name):
+        """Times the code run in the with block as the named phase"""
+        started = time.perf_counter()
+        self._nested.append(0.0)
+
+        try:
+            yield
+        finally:
+            nested = self._nested.pop()
+            elapsed = time.perf_counter() - started
+            self.phases[name] = self.phases.get(name, 0.0) + \
+                (elapsed - nested) * 1000
+
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def record_response(self, response):
+        """Keeps the took time, and the profile when requested, reported by
+            Elasticsearch for a search response"""
+        raw = response.to_dict()
+        self.es_took = (self.es_took or 0) + raw.get('took', 0)
+
+        if self.profile:
+            self.es_profile = raw.get('profile')
+
+    def report(self):
+        """Returns the recorded timings"""
+        return {
+            'phases': {name: round(ms, 3) for name, ms in self.phases.items()},
+            'es_took': self.es_took,
+            'es_profile': self.es_profile,
+        }
+
+    def server_timing(self):
+        """Returns the timings as a Server-Timing header value"""
+        metrics = [f'{name};dur={ms:.3f}' for name, ms in self.phases.items()]
+
+        if self.es_took is not None:
+            metrics.append(f'es-took;dur={self.es_took}')
+
+        return ', '.join(metrics)
+
+    def finish(self, response):
+        """Adds the timings of a profiled request to its response headers
+            and JSON body, and collects them in the per worker stats"""
+        phase_stats.record(self.phases, self.es_took)
+
+        if self.profile:
+            response['Server-Timing'] = self.server_timing()
+            body = orjson.loads(response.content)
+
+            if isinstance(body, dict):
+                body['profile'] = self.report()
+                response.content = orjson.dumps(body)
+
+        return response
+
+
+class NullTimer():
+    """Stand in for PhaseTimer on requests that are not profiled"""
+    profile = False
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def record_response(self, response):
+        pass
+
+    def finish(self, response):
+        return response
+
+
+NULL_TIMER = NullTimer()
+
+
+class PhaseStats():
+    """Thread safe per worker totals of the phase timings of profiled and
+        sampled requests"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases = {}
+        self.requests = 0
+
+    def record(self, phases, es_took=None):
+        """Adds the phase timings of one request, in milliseconds"""
+        if es_took is not None:
+            phases = dict(phases, **{'es-took': es_took})
+
+        with self._lock:
+            self.requests += 1
+
+            for name, ms in phases.items():
+                count, total, highest = self._phases.get(name, (0, 0.0, 0.0))
+                self._phases[name] = (count + 1, total + ms, max(highest, ms))
+
+    def clear(self):
+        with self._lock:
+            self._phases.clear()
+            self.requests = 0
+
+    def stats(self):
+        """Returns the number of timed requests and the count, mean and max
+            of each phase"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'phases': {name: {'count': count,
+                                  'mean_ms': round(total / count, 3),
+                                  'max_ms': round(highest, 3)}
+                           for name, (count, total, highest)
+                           in self._phases.items()},
+            }
+
+
+phase_stats = PhaseStats()
+
+
+def request_timer(request):
+    """This method returns the timer of an /es-api/ request. Staff asking
+        for ?profile=1 are profiled, a PROFILE_SAMPLE_RATE share of the other
+        requests is timed for the per worker stats."""
+    if request.GET.get('profile') == '1' and request.user.is_staff:
+        return PhaseTimer(profile=True)
+
+    if random.random() < settings.PROFILE_SAMPLE_RATE:
+        return PhaseTimer()
+
+    return NULL_TIMER
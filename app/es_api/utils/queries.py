@@ -1,22 +1,38 @@
-import functools
-import json
 import logging
 
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from elasticsearch_dsl import A, Document, Q
+from elasticsearch_dsl import A, Document, Q, Search, connections
 from elasticsearch_dsl.query import MoreLikeThis
 
-from configurations.models import CourseInformationMapping, XDSConfiguration
-from core.models import (CourseSpotlight, SearchField, SearchFilter,
-                         SearchSortOption)
-from users.models import Organization
+from configurations.utils.snapshot import get_config_snapshot
+from core.models import CourseSpotlight
+from es_api.models import CourseNeighbors
 
+from .cache import (get_index_generation, get_user_organizations_version,
+                    make_search_key, suggest_cache, user_organization_cache)
+from .neighbors import get_neighbors
+from .pagination import decode_cursor, encode_cursor
 from .queries_base import BaseQueries
+from .serializers import PartialResults, dumps
+from .suggest import is_complete, normalize_partial
 
 logger = logging.getLogger('dict_config_logger')
 
 
 class XSEQueries(BaseQueries):
+    # id of the point in time a cursor paginated search runs against
+    pit_id = None
+    # number of courses returned by more_like_this and similar_courses
+    more_like_this_size = 6
+    similar_courses_size = 4
+    # build method of each type of bulk_search query
+    bulk_search_types = {
+        'keyword': 'build_search_by_keyword',
+        'filters': 'build_search_by_filters',
+        'competency': 'build_search_by_competency',
+        'derived': 'build_search_for_derived',
+    }
 
     def get_page_start(self, page_number, page_size):
         """
@@ -49,7 +65,7 @@ class XSEQueries(BaseQueries):
         result_search = self.search
 
         for filter_name in filters:
-            if filter_name != 'page' and filter_name != 'sort':
+            if filter_name not in ('page', 'sort', 'cursor'):
                 # .keyword is necessary for elastic search filtering
                 field_name = filter_name + '.keyword'
                 result_search = result_search\
@@ -67,29 +83,166 @@ class XSEQueries(BaseQueries):
 
         if 'sort' in filters:
             key = filters['sort']
-            sort_option = SearchSortOption.objects.filter(field_name=key,
-                                                          active=True)
 
             # checking that the passed field name is allowed
-            if sort_option:
+            if key in get_config_snapshot().sort_fields:
                 # need to add .keyword for Elasticsearch
                 result_search = result_search.sort(key + '.keyword')
 
         self.search = result_search
 
-    def search_by_keyword(self, keyword="", filters={}):
-        """This method takes in a keyword string + a page number and queries
-            ElasticSearch for the term then returns the Response Object"""
+    def add_source_projection(self):
+        """This helper method limits the _source returned for each hit to the
+            fields of the requested projection. The card projection returns
+            the fields mapped for the result cards."""
+        if self.projection == 'card':
+            card_fields = get_config_snapshot().card_fields
+
+            if card_fields:
+                self.search = self.search.source(includes=list(card_fields))
+
+    def add_total_hits_tracking(self):
+        """This helper method limits how many hits Elasticsearch counts
+            exactly to the configured threshold, larger totals come back as
+            a lower bound"""
+        self.search = self.search.extra(
+            track_total_hits=get_config_snapshot().track_total_hits)
+
+    def exact_total(self, raw):
+        """This helper method returns the total hits of a paginated search
+            response with its relation. A lower bound is replaced with the
+            exact count when the last page was requested and the
+            configuration asks for it."""
+        total = raw['hits']['total']
+        relation = total.get('relation', 'eq')
+
+        # cursor pages have no page number to tell the last page by
+        if relation == 'eq' or self.pit_id is not None or \
+                not get_config_snapshot().exact_total_on_last_page:
+            return total['value'], relation
+
+        start = self.search._extra.get('from', 0)
+        hits = len(raw['hits']['hits'])
+
+        # a short page is the last one, the hits before it are all known
+        if 0 < hits < self.search._extra.get('size', 10):
+            return start + hits, 'eq'
+
+        if start + hits < total['value']:
+            return total['value'], relation
+
+        with self.timer.phase('count'):
+            return self.search.count(), 'eq'
+
+    def open_point_in_time(self):
+        """This helper method opens a point in time on the index so that
+            cursor paginated searches see a consistent view of it"""
+        client = connections.get_connection(self.using)
+        response = client.open_point_in_time(
+            index=self.index, keep_alive=settings.SEARCH_CURSOR_KEEP_ALIVE)
+
+        return response['id']
+
+    def add_search_pagination(self, filters, page_size):
+        """This helper method limits the search to a single page, either
+            after the hit identified by the cursor in filters or at the
+            requested page number
+            filters = object containing all the request parameters
+            returns -> modified Elasticsearch search object"""
+        if 'cursor' not in filters:
+            start_index = self.get_page_start(int(filters['page']), page_size)
+            end_index = start_index + page_size
+            self.search = self.search[start_index:end_index]
+            return
+
+        # an empty cursor starts a new cursor session on the first page
+        if filters['cursor']:
+            self.pit_id, search_after = decode_cursor(filters['cursor'])
+        else:
+            self.pit_id, search_after = self.open_point_in_time(), None
+
+        # searches against a point in time must not target an index, the
+        # _shard_doc tiebreaker keeps the sort unique across pages
+        result_search = self.search.index().sort(
+            *(self.search._sort or ['_score']), {'_shard_doc': 'asc'})
+        result_search = result_search.extra(
+            size=page_size,
+            pit={'id': self.pit_id,
+                 'keep_alive': settings.SEARCH_CURSOR_KEEP_ALIVE})
+
+        if search_after:
+            result_search = result_search.extra(search_after=search_after)
+
+        self.search = result_search
+
+    def next_cursor(self, response):
+        """This helper method returns the cursor for the page following a
+            cursor paginated response, or None if it was the last page"""
+        raw = response.to_dict()
+        hits = raw['hits']['hits']
+
+        if len(hits) == 0 or len(hits) < self.search._extra.get('size', 0):
+            return None
+
+        # elasticsearch may hand back a new id for the point in time
+        pit_id = raw.get('pit_id', self.pit_id)
+
+        return encode_cursor(pit_id, hits[-1]['sort'])
+
+    def add_budget(self, budget_ms):
+        """This helper method limits the search to a latency budget in
+            milliseconds. Shards that miss it are left out of the response,
+            which is then flagged partial, and the client gives up on the
+            request SEARCH_BUDGET_MARGIN_MS after the budget."""
+        if not budget_ms:
+            return
+
+        self.search = self.search.extra(timeout=f'{budget_ms}ms').params(
+            request_timeout=(budget_ms + settings.SEARCH_BUDGET_MARGIN_MS) /
+            1000)
+
+    def prepare_execute(self, budget_ms):
+        """This helper method adds the latency budget of the endpoint,
+            SEARCH_BUDGET_MS unless given, and the profile of a profiled
+            request to the search before it is executed"""
+        if budget_ms is None:
+            budget_ms = settings.SEARCH_BUDGET_MS
+
+            # searches may also stop collecting hits on each shard early
+            if settings.SEARCH_TERMINATE_AFTER:
+                self.search = self.search.extra(
+                    terminate_after=settings.SEARCH_TERMINATE_AFTER)
+
+        self.add_budget(budget_ms)
+
+        if self.timer.profile:
+            self.search = self.search.extra(profile=True)
+
+    def execute(self, budget_ms=None):
+        """This method executes the current search within the latency budget
+            of the endpoint and returns the elasticsearch_dsl Response
+            Object"""
+        self.prepare_execute(budget_ms)
+
+        with self.timer.phase('execute'):
+            response = self.search.execute()
+
+        self.timer.record_response(response)
 
-        course_mapping = CourseInformationMapping.objects.first()
+        return response
+
+    def add_keyword_query(self, keyword):
+        """This helper method adds the keyword query over the configured
+            search fields to the search query"""
+        config = get_config_snapshot()
+        course_mapping = config.course_mapping
         fields = [
             course_mapping.course_title, course_mapping.course_description,
             course_mapping.course_code, course_mapping.course_provider,
             course_mapping.course_instructor,
             course_mapping.course_deliveryMode,
             course_mapping.course_competency,
-            *SearchField.objects.filter(
-                active=True).values_list('field_name', flat=True)
+            *config.search_fields
         ]
 
         q = Q("multi_match",
@@ -101,39 +254,88 @@ class XSEQueries(BaseQueries):
 
         self.user_organization_filtering()
 
+    def build_search_by_keyword(self, keyword="", filters={}, facets=True):
+        """This method takes in a keyword string + a page number and builds
+            the ElasticSearch query for the term without executing it. The
+            filter aggregations are left out when facets is False."""
+
+        config = get_config_snapshot()
+
+        self.add_keyword_query(keyword)
+
         # add sort if it's part of the request
         self.add_search_sort(filters=filters)
 
+        # create aggregations for each filter
+        if facets:
+            self.add_search_aggregations(filter_set=config.search_filters)
+
+        # add filters to the search query
+        self.add_search_filters(filters=filters)
+
         # getting the page size for result pagination
-        configuration = XDSConfiguration.objects.first()
-        uiConfig = configuration.xdsuiconfiguration
-        search_filters = SearchFilter.objects.filter(
-            xds_ui_configuration=uiConfig, active=True)
+        self.add_search_pagination(filters=filters,
+                                   page_size=config.search_results_per_page)
+
+        self.add_total_hits_tracking()
+
+        self.add_source_projection()
+
+        return self.search
+
+    def search_by_keyword(self, keyword="", filters={}, facets=True):
+        """This method takes in a keyword string + a page number and queries
+            ElasticSearch for the term then returns the Response Object"""
+        with self.timer.phase('build'):
+            self.build_search_by_keyword(keyword=keyword, filters=filters,
+                                         facets=facets)
+
+        # call to elasticsearch to execute the query
+        response = self.execute()
+        logger.info(self.search.to_dict())
+
+        return response
+
+    def build_search_facets(self, keyword="", filters={}):
+        """This method takes in a keyword string + the selected filters and
+            builds a hitless ElasticSearch query for the filter aggregations
+            without executing it"""
+        self.add_keyword_query(keyword)
 
         # create aggregations for each filter
-        self.add_search_aggregations(filter_set=search_filters)
+        self.add_search_aggregations(
+            filter_set=get_config_snapshot().search_filters)
 
         # add filters to the search query
         self.add_search_filters(filters=filters)
 
-        page_size = uiConfig.search_results_per_page
-        start_index = self.get_page_start(int(filters['page']), page_size)
-        end_index = start_index + page_size
-        self.search = self.search[start_index:end_index]
+        self.add_total_hits_tracking()
+
+        # size=0 requests can be served from the shard request cache
+        self.search = self.search.extra(size=0).params(request_cache=True)
+
+        return self.search
+
+    def search_facets(self, keyword="", filters={}):
+        """This method takes in a keyword string + the selected filters and
+            queries ElasticSearch for the filter aggregations then returns the
+            Response Object"""
+        with self.timer.phase('build'):
+            self.build_search_facets(keyword=keyword, filters=filters)
 
         # call to elasticsearch to execute the query
-        response = self.search.execute()
+        response = self.execute()
         logger.info(self.search.to_dict())
 
         return response
 
-    def search_by_competency(self, comp_uuid="", filters={}):
+    def build_search_by_competency(self, comp_uuid="", filters={}):
         """This method takes in a competency ID string + a page number and
-        queries ElasticSearch for the term then returns the Response Object"""
-        course_mapping = CourseInformationMapping.objects.first()
+        builds the ElasticSearch query for the term without executing it"""
+        config = get_config_snapshot()
 
         q = Q("match",
-              **{course_mapping.course_competency: comp_uuid})
+              **{config.course_mapping.course_competency: comp_uuid})
 
         # setting up the search object
         self.search = self.search.query(q)
@@ -141,29 +343,37 @@ class XSEQueries(BaseQueries):
         self.user_organization_filtering()
 
         # getting the page size for result pagination
-        configuration = XDSConfiguration.objects.first()
-        uiConfig = configuration.xdsuiconfiguration
+        self.add_search_pagination(filters=filters,
+                                   page_size=config.search_results_per_page)
 
-        page_size = uiConfig.search_results_per_page
-        start_index = self.get_page_start(int(filters['page']), page_size)
-        end_index = start_index + page_size
-        self.search = self.search[start_index:end_index]
+        self.add_total_hits_tracking()
+
+        self.add_source_projection()
+
+        return self.search
+
+    def search_by_competency(self, comp_uuid="", filters={}):
+        """This method takes in a competency ID string + a page number and
+        queries ElasticSearch for the term then returns the Response Object"""
+        with self.timer.phase('build'):
+            self.build_search_by_competency(comp_uuid=comp_uuid,
+                                            filters=filters)
 
         # call to elasticsearch to execute the query
-        response = self.search.execute()
+        response = self.execute()
         logger.info(self.search.to_dict())
 
         return response
 
-    def search_for_derived(self, reference="", filters={}):
-        """This method takes in a reference string and queries
-            ElasticSearch for the items derived from it then returns the
-            Response Object"""
+    def build_search_for_derived(self, reference="", filters={}):
+        """This method takes in a reference string and builds the
+            ElasticSearch query for the items derived from it without
+            executing it"""
 
-        course_mapping = CourseInformationMapping.objects.first()
+        config = get_config_snapshot()
 
         q = Q("match",
-              **{course_mapping.course_derived_from: reference})
+              **{config.course_mapping.course_derived_from: reference})
 
         # setting up the search object
         self.search = self.search.query(q)
@@ -171,23 +381,32 @@ class XSEQueries(BaseQueries):
         self.user_organization_filtering()
 
         # getting the page size for result pagination
-        configuration = XDSConfiguration.objects.first()
-        uiConfig = configuration.xdsuiconfiguration
+        self.add_search_pagination(filters=filters,
+                                   page_size=config.search_results_per_page)
 
-        page_size = uiConfig.search_results_per_page
-        start_index = self.get_page_start(int(filters['page']), page_size)
-        end_index = start_index + page_size
-        self.search = self.search[start_index:end_index]
+        self.add_total_hits_tracking()
+
+        self.add_source_projection()
+
+        return self.search
+
+    def search_for_derived(self, reference="", filters={}):
+        """This method takes in a reference string and queries
+            ElasticSearch for the items derived from it then returns the
+            Response Object"""
+        with self.timer.phase('build'):
+            self.build_search_for_derived(reference=reference,
+                                          filters=filters)
 
         # call to elasticsearch to execute the query
-        response = self.search.execute()
+        response = self.execute()
         logger.info(self.search.to_dict())
 
         return response
 
-    def more_like_this(self, doc_id):
-        """This method takes in a doc ID and queries the elasticsearch index
-            for courses with similar title or description"""
+    def build_more_like_this(self, doc_id):
+        """This method takes in a doc ID and builds the query for courses with
+            similar title or description without executing it"""
         likeObj = [
             {
                 "_index": self.index,
@@ -195,7 +414,7 @@ class XSEQueries(BaseQueries):
             }
         ]
 
-        course_mapping = CourseInformationMapping.objects.first()
+        course_mapping = get_config_snapshot().course_mapping
         fields = [
             course_mapping.course_title, course_mapping.course_description,
             course_mapping.course_provider
@@ -207,18 +426,79 @@ class XSEQueries(BaseQueries):
         self.user_organization_filtering()
 
         # only fetch the first 6 results
-        # TODO: make the size configurable
-        self.search = self.search[0:6]
-        response = self.search.execute()
+        self.search = self.search[0:self.more_like_this_size]
+
+        self.add_source_projection()
+
+        return self.search
+
+    def build_neighbors(self, kind, key):
+        """This method builds the query for the precomputed neighbors of a
+            document ID or keyword without executing it, and returns the
+            stored neighbor IDs or None when none were computed"""
+        doc_ids = get_neighbors(kind, key)
+
+        if doc_ids is None:
+            return None
+
+        self.search = self.search.filter('ids', values=doc_ids)
+        self.user_organization_filtering()
+        self.search = self.search[0:len(doc_ids)]
+        self.add_source_projection()
+
+        return doc_ids
+
+    def rank_neighbors(self, response, doc_ids, size):
+        """This helper method orders the hits of a neighbors query as they
+            were ranked when computed and keeps the first size of them. It
+            returns None when the user may not see enough of the neighbors,
+            or some were removed from the index, so a live query is needed."""
+        hits = response.to_dict()['hits']['hits']
+
+        if len(hits) < min(size, len(doc_ids)):
+            # the query is rebuilt from scratch for the live query
+            self.search = Search(using=self.using, index=self.index)
+            return None
+
+        rank = {doc_id: position for position, doc_id in enumerate(doc_ids)}
+        hits.sort(key=lambda hit: rank[hit['_id']])
+        del hits[size:]
+
+        return response
+
+    def precomputed_neighbors(self, kind, key, size):
+        """This method returns the response of a query for the precomputed
+            neighbors of a document ID or keyword, or None on a miss"""
+        with self.timer.phase('build'):
+            doc_ids = self.build_neighbors(kind, key)
+
+        if doc_ids is None:
+            return None
+
+        return self.rank_neighbors(self.execute(), doc_ids, size)
+
+    def more_like_this(self, doc_id):
+        """This method takes in a doc ID and queries the elasticsearch index
+            for courses with similar title or description"""
+        response = self.precomputed_neighbors(
+            CourseNeighbors.MORE_LIKE_THIS, doc_id, self.more_like_this_size)
+
+        if response is not None:
+            return response
+
+        with self.timer.phase('build'):
+            self.build_more_like_this(doc_id=doc_id)
+
+        response = self.execute()
         logger.info(response)
 
         return response
 
-    def similar_courses(self, keyword=""):
-        """This method takes in a keyword and queries the elasticsearch index
-           for 4 courses with similar competencies or subjects"""
+    def build_similar_courses(self, keyword=""):
+        """This method takes in a keyword and builds the query for 4 courses
+           with similar competencies or subjects without executing it"""
 
-        course_mapping = CourseInformationMapping.objects.first()
+        course_mapping = get_config_snapshot().course_mapping
         fields = [
             course_mapping.course_competency,
             course_mapping.course_subject
@@ -235,10 +515,27 @@ class XSEQueries(BaseQueries):
         self.user_organization_filtering()
 
         # sending back 4 responses
-        self.search = self.search[0:4]
+        self.search = self.search[0:self.similar_courses_size]
+
+        self.add_source_projection()
+
+        return self.search
+
+    def similar_courses(self, keyword=""):
+        """This method takes in a keyword and queries the elasticsearch index
+           for 4 courses with similar competencies or subjects"""
+        response = self.precomputed_neighbors(
+            CourseNeighbors.SIMILAR_COURSES, keyword,
+            self.similar_courses_size)
+
+        if response is not None:
+            return response
+
+        with self.timer.phase('build'):
+            self.build_similar_courses(keyword=keyword)
 
         # call to elasticsearch to execute the query
-        response = self.search.execute()
+        response = self.execute()
         logger.info(self.search.to_dict())
 
         return response
@@ -254,7 +551,7 @@ class XSEQueries(BaseQueries):
             id_list.append(spotlight.course_id)
 
         docs = Document.mget(id_list,
-                             using='default',
+                             using=self.using,
                              index=self.index,
                              raise_on_error=True,
                              missing='none',)
@@ -271,121 +568,351 @@ class XSEQueries(BaseQueries):
 
         return result
 
-    def search_by_filters(self, page_num, filters={}):
+    def build_search_by_filters(self, page_num, filters={}):
         """This method takes in a page number + a dict of field names and
-        values and queries ElasticSearch for the term then returns the
-            Response Object"""
+        values and builds the ElasticSearch query without executing it"""
 
         # setting up the search object
         self.user_organization_filtering()
-        # getting the page size for result pagination
-        configuration = XDSConfiguration.objects.first()
-        uiConfig = configuration.xdsuiconfiguration
 
         for field_name in filters:
             self.search = self.search.query(
                 Q("match", **{field_name: filters[field_name]}))
 
-        page_size = uiConfig.search_results_per_page
+        # getting the page size for result pagination
+        page_size = get_config_snapshot().search_results_per_page
         start_index = self.get_page_start(page_num, page_size)
         end_index = start_index + page_size
         self.search = self.search[start_index:end_index]
 
+        self.add_total_hits_tracking()
+
+        self.add_source_projection()
+
+        return self.search
+
+    def search_by_filters(self, page_num, filters={}):
+        """This method takes in a page number + a dict of field names and
+        values and queries ElasticSearch for the term then returns the
+            Response Object"""
+        with self.timer.phase('build'):
+            self.build_search_by_filters(page_num=page_num, filters=filters)
+
         # call to elasticsearch to execute the query
-        response = self.search.execute()
+        response = self.execute()
         logger.info(self.search.to_dict())
 
         return response
 
+    def sub_queries(self):
+        """This helper method returns an XSEQueries for another search of the
+            same request, sharing its organization filters"""
+        queries = type(self)(self.host, self.index, user=self.user,
+                             projection=self.projection, timer=self.timer)
+        queries._organization_filters = self.organization_filters()
+
+        return queries
+
+    def bulk_search(self, specs):
+        """This method takes in a list of (type, arguments) query specs,
+            builds each with the build method of its type and executes them
+            in a single _msearch. It returns the results JSON of each spec in
+            order, or its error message when it could not be run."""
+        searches = []
+        body = []
+        params = {}
+
+        for search_type, kwargs in specs:
+            queries = self.sub_queries()
+
+            try:
+                with self.timer.phase('build'):
+                    getattr(queries, self.bulk_search_types[search_type])(
+                        **kwargs)
+            except Exception as err:
+                logger.error(err)
+                searches.append((None, str(err)))
+                continue
+
+            searches.append((queries, None))
+            # every search shares the budget of the request
+            queries.prepare_execute(None)
+            header = dict(queries.search._params)
+
+            # the client timeout applies to the whole _msearch
+            if 'request_timeout' in header:
+                params['request_timeout'] = header.pop('request_timeout')
+
+            # searches against a point in time must not target an index
+            if queries.pit_id is None:
+                header['index'] = self.index
+
+            body.append(header)
+            body.append(queries.search.to_dict())
+
+        responses = []
+
+        if body:
+            with self.timer.phase('execute'):
+                responses = connections.get_connection(self.using).msearch(
+                    body=body, **params)['responses']
+
+        responses = iter(responses)
+        results = []
+
+        for queries, error in searches:
+            if queries is None:
+                results.append((None, error))
+                continue
+
+            raw = next(responses)
+
+            if 'error' in raw:
+                logger.error(raw['error'])
+                results.append((None, raw['error'].get('reason') or
+                                raw['error'].get('type')))
+                continue
+
+            response = queries.search._response_class(queries.search, raw)
+            self.timer.record_response(response)
+            results.append((queries.get_results(response), None))
+
+        return results
+
+    def get_aggregations(self, response):
+        """
+        This helper method returns the filter aggregations of an
+        ElasticSearch Query response labelled with their field names
+        """
+        # the raw response body is reshaped in place rather than copied
+        agg_dict = response.to_dict().get('aggregations', {})
+        config = get_config_snapshot()
+
+        for key in agg_dict:
+            search_filter = config.get_search_filter(key)
+            filter_obj = agg_dict[key]
+            filter_obj['field_name'] = search_filter.field_name
+
+        return agg_dict
+
+    def get_facets(self, response):
+        """
+        This helper method consumes the response of a facets query and
+        returns a dictionary representing the filter aggregations
+        """
+        with self.timer.phase('results'):
+            raw = response.to_dict()
+            total = raw['hits']['total']
+            resultObj = {
+                "total": total['value'],
+                "total_relation": total.get('relation', 'eq'),
+                "aggregations": self.get_aggregations(response)
+            }
+
+            return self.dump_results(resultObj, raw)
+
+    def dump_results(self, resultObj, raw):
+        """
+        This helper method flags results that are missing the hits of shards
+        that timed out or failed as partial and encodes them. Partial results
+        are returned as PartialResults so that they are not cached.
+        """
+        timed_out = raw.get('timed_out', False)
+        partial = timed_out or raw.get('_shards', {}).get('failed', 0) > 0
+        resultObj["timed_out"] = timed_out
+        resultObj["partial"] = partial
+
+        if partial:
+            return PartialResults(dumps(resultObj))
+
+        return dumps(resultObj)
+
     def get_results(self, response):
         """
         This helper method consumes the response of an ElasticSearch Query and
         adds the hits to an array then returns a dictionary representing the
-        results
+        results. The hits are built from the raw response body, with the
+        same shape as Hit.to_dict() plus its HitMeta, and encoded in a single
+        pass.
         """
-        hit_arr = []
-        agg_dict = response.aggregations.to_dict()
+        with self.timer.phase('results'):
+            raw = response.to_dict()
+            hit_arr = []
 
-        for hit in response:
-            hit_dict = hit.to_dict()
+            for hit in raw['hits']['hits']:
+                hit_dict = hit.get('_source', {})
 
-            # adding the meta data to the dictionary
-            hit_dict['meta'] = hit.meta.to_dict()
-            hit_arr.append(hit_dict)
+                if 'fields' in hit:
+                    hit_dict.update(hit['fields'])
 
-        for key in agg_dict:
-            search_filter = SearchFilter.objects.filter(display_name=key,
-                                                        active=True).first()
-            filter_obj = agg_dict[key]
-            filter_obj['field_name'] = search_filter.field_name
+                # adding the meta data to the dictionary
+                meta = {(k[1:] if k.startswith('_') else k): v
+                        for k, v in hit.items()
+                        if k not in ('_source', '_fields')}
 
-        resultObj = {
-            "hits": hit_arr,
-            "total": response.hits.total.value,
-            "aggregations": agg_dict
-        }
+                if 'type' in meta:
+                    meta['doc_type'] = meta.pop('type')
 
-        return json.dumps(resultObj)
+                hit_dict['meta'] = meta
+                hit_arr.append(hit_dict)
 
-    def suggest(self, partial):
+            total, relation = self.exact_total(raw)
+            resultObj = {
+                "hits": hit_arr,
+                "total": total,
+                "total_relation": relation,
+                "aggregations": self.get_aggregations(response)
+            }
+
+            if self.pit_id is not None:
+                resultObj["cursor"] = self.next_cursor(response)
+
+            return self.dump_results(resultObj, raw)
+
+    def build_suggest(self, partial):
         """
-        This method receives a partial to make a completion suggestion
-        request to Elastic
+        This method receives a partial and builds a completion suggestion
+        request without executing it
         """
         # common settings for suggest query
-        query_dict = {'field': 'autocomplete', 'fuzzy': {
-            'fuzziness': 'AUTO'
-        }}
-
-        # check if user is logged in and in an organization
-        if self.user.is_authenticated and self.user.organizations.count() > 0:
-            # gets context from orgs user is a member of
-            query_dict['contexts'] = {
-                'filter': [org.filter for org in
-                           self.user.organizations.all()]}
-        # check if there are any organizations
-        elif Organization.objects.count() > 0:
-            # add all organizations to filter so nothing is excluded
-            query_dict['contexts'] = {
-                'filter': [org.filter for org in Organization.objects.all()]}
-        # if no organizations
-        else:
-            # throw error, a filter is required for context suggestions
-            raise ObjectDoesNotExist("No Organizations configured")
+        query_dict = {'field': 'autocomplete', 'size': settings.SUGGEST_SIZE,
+                      'fuzzy': {
+                          'fuzziness': 'AUTO'
+                      }}
+
+        query_dict['contexts'] = {'filter': self.suggest_contexts()}
 
         # adds completion type suggestion to search query
         self.search = self.search.suggest('autocomplete_suggestion', partial,
                                           completion=query_dict)
 
-        response = self.search.execute()
+        return self.search
+
+    def suggest(self, partial):
+        """
+        This method receives a partial to make a completion suggestion
+        request to Elastic
+        """
+        with self.timer.phase('build'):
+            self.build_suggest(partial=partial)
+
+        response = self.execute(settings.SUGGEST_BUDGET_MS)
 
         return response
 
+    def suggest_contexts(self):
+        """
+        This helper method returns the organization filters used as the
+        context of completion suggestions
+        """
+        # gets context from orgs user is a member of, or all organizations
+        # so nothing is excluded
+        org_filters = self.organization_filters() or \
+            list(get_config_snapshot().organization_filters)
+
+        # throw error, a filter is required for context suggestions
+        if not org_filters:
+            raise ObjectDoesNotExist("No Organizations configured")
+
+        return org_filters
+
+    def suggest_cache_key(self, partial):
+        """
+        This helper method returns the normalized partial and context the
+        suggestions for partial are cached under
+        """
+        return normalize_partial(partial), tuple(self.suggest_contexts())
+
+    def cache_suggestions(self, partial_key, context, response):
+        """
+        This helper method stores and returns the suggestions of a completion
+        suggestion response
+        """
+        raw = response.to_dict()
+        suggestions = raw['suggest']['autocomplete_suggestion']
+
+        # suggestions cut short by the budget are not cached
+        if raw.get('timed_out', False):
+            return suggestions
+
+        suggest_cache.set_suggestions(
+            partial_key, context, suggestions,
+            is_complete(suggestions, settings.SUGGEST_SIZE))
+
+        return suggestions
+
+    def cached_suggest(self, partial):
+        """
+        This method returns the completion suggestions for a partial from
+        the prefix cache, only querying Elastic when they are neither cached
+        nor derivable from a cached shorter partial
+        """
+        partial_key, context = self.suggest_cache_key(partial)
+        suggestions = suggest_cache.get_suggestions(partial_key, context)
+
+        if suggestions is None:
+            suggestions = self.cache_suggestions(partial_key, context,
+                                                 self.suggest(partial))
+
+        return suggestions
+
+    def organization_filters(self):
+        """
+        This helper method returns the sorted organization filter values
+        that restrict results for the user, or None when results are not
+        restricted. The values are resolved once per instance and cached per
+        user until the configuration snapshot or their memberships change.
+        """
+        if hasattr(self, '_organization_filters'):
+            return self._organization_filters
+
+        with self.timer.phase('organizations'):
+            config = get_config_snapshot()
+
+            # if user logged in, filter on their organizations if they have
+            # any
+            if self.user.is_authenticated:
+                orgs = user_organization_cache.get_or_set(
+                    (self.user.pk, config.version,
+                     get_user_organizations_version(self.user.pk)),
+                    lambda: tuple(sorted(self.user.organizations
+                                         .values_list('filter', flat=True))))
+            # if user not logged in, filter on every organization
+            else:
+                orgs = config.organization_filters
+
+        self._organization_filters = list(orgs) if orgs else None
+
+        return self._organization_filters
+
     def user_organization_filtering(self):
         """
         This helper method returns an updated search with the organizations
         the user belongs to filtering the query
         """
-        # if user logged in and assigned organizations
-        if self.user.is_authenticated and self.user.organizations.count() > 0:
-            # generate queries for CourseProviderName from orgs
-            orgs = [Q("match", filter=org.filter)
-                    for org in self.user.organizations.all()]
-            # combine queries into a chained OR query
-            filtered_search = self.search.query(
-                functools.reduce(lambda a, b: a | b, orgs))
-            setattr(filtered_search, "minimum_should_match", 1)
-            self.search = filtered_search
-            return
-        # if user not logged in but organizations exist
-        if not self.user.is_authenticated and\
-                Organization.objects.all().count() > 0:
-            # generate queries for CourseProviderName from orgs
-            orgs = [Q("match", filter=org.filter)
-                    for org in Organization.objects.all()]
-            # combine queries into a chained OR query
-            filtered_search = self.search.query(
-                functools.reduce(lambda a, b: a | b, orgs))
-            setattr(filtered_search, "minimum_should_match", 1)
-            self.search = filtered_search
+        org_filters = self.organization_filters()
+
+        if org_filters is None:
             return
+
+        # a single terms clause in filter context does not affect scoring
+        # and can be cached by Elasticsearch
+        self.search = self.search.filter('terms', filter=org_filters)
+
+    def index_generation(self):
+        """
+        This helper method returns a token identifying the current contents
+        of the index, used to invalidate cached results
+        """
+        return get_index_generation(self.using, self.index)
+
+    def search_cache_key(self, kind, query, filters=None):
+        """
+        This helper method returns the result cache key for a search made by
+        the current user
+        """
+        if self.projection is not None:
+            kind = kind + ':' + self.projection
+
+        return make_search_key(kind, query, filters,
+                               self.organization_filters())
@@ -1,20 +1,32 @@
 import logging
 
 from django.contrib.auth.models import AnonymousUser
-from elasticsearch_dsl import A, Search, connections
+from elasticsearch_dsl import A, Search
+
+from .connections import get_connection_alias
+from .profiling import NULL_TIMER
 
 logger = logging.getLogger('dict_config_logger')
 
 
 class BaseQueries():
+    # _source projections that can be requested for search hits
+    projections = ('card',)
 
-    def __init__(self, host, index, user=AnonymousUser()):
+    def __init__(self, host, index, user=AnonymousUser(), projection=None,
+                 timer=None):
         self.host = host
         self.index = index
         self.user = user
-        self.search = Search(using='default', index=index)
-        connections.create_connection(alias='default',
-                                      hosts=[self.host, ], timeout=60)
+        # name of the _source projection applied to search hits, if any.
+        # Unknown names are dropped so they cannot split the result cache
+        self.projection = projection if projection in self.projections \
+            else None
+        # times the phases of the request, see profiling.request_timer
+        self.timer = timer or NULL_TIMER
+        # reuse the pooled client for this host and index across requests
+        self.using = get_connection_alias(host, index)
+        self.search = Search(using=self.using, index=index)
 
     def filter_options(self):
         """Aggregates options for filter field in XSE"""
@@ -0,0 +1,15 @@
+def search_arguments(parsed, config, page=None):
+    """This method returns the keyword and filters XSEQueries searches a
+        parsed saved filter with, only keeping the filters that are defined
+        in the configuration like /es-api/ does"""
+    filters = {'page': page or parsed['page']}
+
+    if parsed['sort']:
+        filters['sort'] = parsed['sort']
+
+    for curr_filter in config.search_filters:
+        if curr_filter.field_name in parsed['filters']:
+            filters[curr_filter.field_name] = \
+                parsed['filters'][curr_filter.field_name]
+
+    return parsed['keyword'], filters
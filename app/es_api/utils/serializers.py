@@ -0,0 +1,40 @@
+import orjson
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+
+class OrjsonSerializer(JSONSerializer):
+    """JSONSerializer for the Elasticsearch clients that decodes responses
+        and encodes requests with orjson"""
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        # don't serialize strings
+        if isinstance(data, str):
+            return data
+
+        try:
+            return orjson.dumps(data, default=self.default,
+                                option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError as e:
+            raise SerializationError(data, e)
+
+
+def dumps(data):
+    """This method encodes data as a JSON bytestring for HttpResponses"""
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+
+class PartialResults(bytes):
+    """Encoded results of a search that is missing the hits of shards that
+        timed out or failed, which must not be cached"""
+
+
+def is_cacheable(results):
+    """This method returns whether search results may be cached"""
+    return not isinstance(results, PartialResults)
@@ -0,0 +1,74 @@
+def normalize_partial(partial):
+    """This method returns the form of an autocomplete partial used in cache
+        keys, lower cased with whitespace collapsed like the completion
+        field's analyzer"""
+    return ' '.join(partial.lower().split())
+
+
+def allowed_edits(partial):
+    """This method returns the edits a fuzzy completion query with
+        fuzziness AUTO allows for a partial of this length"""
+    if len(partial) < 3:
+        return 0
+
+    return 1 if len(partial) <= 5 else 2
+
+
+def fuzzy_prefix_match(text, partial, edits, prefix_length=1):
+    """This method returns whether a prefix of text is within the given
+        number of edits, transpositions included, of partial. The first
+        prefix_length characters must match exactly as in Elasticsearch."""
+    text = text.lower()
+
+    if text[:prefix_length] != partial[:prefix_length]:
+        return False
+
+    if edits == 0:
+        return text.startswith(partial)
+
+    text = text[:len(partial) + edits]
+    # optimal string alignment distance between partial and each prefix of
+    # text, one row per character of partial
+    previous2 = None
+    previous = list(range(len(text) + 1))
+
+    for i in range(1, len(partial) + 1):
+        current = [i] + [0] * len(text)
+
+        for j in range(1, len(text) + 1):
+            cost = 0 if partial[i - 1] == text[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + cost)
+
+            if i > 1 and j > 1 and partial[i - 1] == text[j - 2] and \
+                    partial[i - 2] == text[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+
+        previous2, previous = previous, current
+
+    return min(previous) <= edits
+
+
+def is_complete(suggestions, size):
+    """This method returns whether a completion response holds every
+        candidate for its partial, rather than being cut off at size"""
+    return all(len(entry['options']) < size for entry in suggestions)
+
+
+def derive_suggestions(suggestions, shorter, partial):
+    """This method returns the suggestions for partial filtered from the
+        complete suggestions of a shorter partial it starts with, or None
+        when a longer partial may match candidates the shorter one did not"""
+    if allowed_edits(shorter) != allowed_edits(partial):
+        return None
+
+    edits = allowed_edits(partial)
+    derived = []
+
+    for entry in suggestions:
+        derived.append(dict(
+            entry, text=partial, length=len(partial),
+            options=[option for option in entry['options']
+                     if fuzzy_prefix_match(option['text'], partial, edits)]))
+
+    return derived
@@ -1,16 +1,30 @@
 import json
 import logging
 
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 from django.http import (HttpResponse, HttpResponseBadRequest,
-                         HttpResponseServerError)
+                         HttpResponseNotFound, HttpResponseServerError)
 from requests.exceptions import HTTPError
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from configurations.models import CourseInformationMapping, XDSConfiguration
-from core.models import SearchFilter
+from configurations.utils.snapshot import get_config_snapshot
+from core.models import SavedFilter
+from core.utils.breaker import breaker_stats, mark_stale
+from es_api.utils.cache import (cached_search, facet_cache, last_good_cache,
+                                saved_filter_cache, search_flight,
+                                search_result_cache, suggest_cache)
+from es_api.utils.connections import pool_stats
+from es_api.utils.pagination import InvalidCursorError
+from es_api.utils.profiling import phase_stats, request_timer
 from es_api.utils.queries import XSEQueries
+from es_api.utils.saved_filters import search_arguments
+from es_api.utils.serializers import dumps
+from xds_api.utils.xds_utils import metadata_cache, xis_flight
+from xds_api.utils.xis_client import xis_client
 
 logger = logging.getLogger('dict_config_logger')
 
@@ -34,15 +48,32 @@ class SearchIndexView(APIView):
         if (request.GET.get('p')) and (request.GET.get('p') != ''):
             filters['page'] = request.GET['p']
 
+        # an empty cursor starts a new cursor paginated session
+        if 'cursor' in request.GET:
+            filters['cursor'] = request.GET['cursor']
+
         if (request.GET.get('sort')) and (request.GET.get('sort') != ''):
             filters['sort'] = request.GET['sort']
 
         return keyword, filters
 
+    def add_config_filters(self, request, config, filters):
+        """helper method to add the filters that are defined in the
+            configuration, the rest is ignored"""
+        for curr_filter in config.search_filters:
+            if (request.GET.get(curr_filter.field_name)) and \
+                    (request.GET.get(curr_filter.field_name) != ''):
+                filters[curr_filter.field_name] = \
+                    request.GET.getlist(curr_filter.field_name)
+
     def get(self, request):
         results = []
+        age = None
 
         keyword, filters = self.get_request_attributes(request)
+        # facets=false skips the filter aggregations when only paging
+        facets = request.GET.get('facets', '').lower() != 'false'
+        timer = request_timer(request)
 
         if keyword != '':
             errorMsg = {
@@ -52,23 +83,114 @@ class SearchIndexView(APIView):
             errorMsgJSON = json.dumps(errorMsg)
 
             try:
-                search_filters = SearchFilter.objects.filter(active=True)
+                with timer.phase('config'):
+                    config = get_config_snapshot()
+
+                self.add_config_filters(request, config, filters)
+                queries = XSEQueries(
+                    config.target_xse_host,
+                    config.target_xse_index,
+                    user=request.user,
+                    projection=request.GET.get('projection'),
+                    timer=timer)
+
+                if 'cursor' in filters:
+                    # cursor pages belong to a single point in time
+                    results = queries.get_results(queries.search_by_keyword(
+                        keyword=keyword, filters=filters, facets=facets))
+                else:
+                    # drop cached results if the index contents changed
+                    search_result_cache.sync_generation(
+                        queries.index_generation())
+                    key = queries.search_cache_key(
+                        'keyword' if facets else 'keyword-hits', keyword,
+                        filters)
+
+                    def search():
+                        return queries.get_results(queries.search_by_keyword(
+                            keyword=keyword, filters=filters, facets=facets))
+
+                    results, age = cached_search(
+                        key, search, cache=search_result_cache,
+                        profile=timer.profile)
+            except InvalidCursorError as cursor_err:
+                return HttpResponseBadRequest(
+                    json.dumps({"message": str(cursor_err)}),
+                    content_type="application/json")
+            except HTTPError as http_err:
+                logger.error(http_err)
+                return HttpResponseServerError(errorMsgJSON,
+                                               content_type="application/json")
+            except Exception as err:
+                logger.error(err)
+                return HttpResponseServerError(errorMsgJSON,
+                                               content_type="application/json")
+            else:
+                logger.info(results)
+                return timer.finish(mark_stale(HttpResponse(
+                    results, content_type="application/json"), age))
+        else:
+            error = {
+                "message": "Request is missing 'keyword' query paramater"
+            }
+            errorJson = json.dumps(error)
+            return HttpResponseBadRequest(errorJson,
+                                          content_type="application/json")
+
+
+class FacetsView(APIView):
+    """This method defines an API for fetching the filter aggregations of a
+            keyword search without its hits"""
+
+    def get_request_attributes(self, request, config):
+        """helper method to get attributes"""
+        keyword = request.GET.get('keyword', '')
+        filters = {}
+
+        # only add the filters that are defined in the configuration,
+        # the rest is ignored
+        for curr_filter in config.search_filters:
+            if (request.GET.get(curr_filter.field_name)) and \
+                    (request.GET.get(curr_filter.field_name) != ''):
+                filters[curr_filter.field_name] = \
+                    request.GET.getlist(curr_filter.field_name)
+
+        return keyword, filters
+
+    def get(self, request):
+        results = []
+        age = None
+        timer = request_timer(request)
+
+        if request.GET.get('keyword', '') != '':
+            errorMsg = {
+                "message": "error executing ElasticSearch query; " +
+                CONTACT_ADMIN
+            }
+            errorMsgJSON = json.dumps(errorMsg)
 
-                # only add the filters that are defined in the configuration,
-                # the rest is ignored
-                for curr_filter in search_filters:
-                    if (request.GET.get(curr_filter.field_name)) and \
-                            (request.GET.get(curr_filter.field_name) != ''):
-                        filters[curr_filter.field_name] = \
-                            request.GET.getlist(curr_filter.field_name)
+            try:
+                with timer.phase('config'):
+                    config = get_config_snapshot()
 
+                keyword, filters = self.get_request_attributes(request,
+                                                               config)
                 queries = XSEQueries(
-                    XDSConfiguration.objects.first().target_xse_host,
-                    XDSConfiguration.objects.first().target_xse_index,
-                    user=request.user)
-                response = queries.search_by_keyword(
-                    keyword=keyword, filters=filters)
-                results = queries.get_results(response)
+                    config.target_xse_host,
+                    config.target_xse_index,
+                    user=request.user,
+                    timer=timer)
+
+                # drop cached facets if the index contents changed
+                facet_cache.sync_generation(queries.index_generation())
+                key = queries.search_cache_key('facets', keyword, filters)
+
+                def search():
+                    return queries.get_facets(queries.search_facets(
+                        keyword=keyword, filters=filters))
+
+                results, age = cached_search(key, search, cache=facet_cache,
+                                             profile=timer.profile)
             except HTTPError as http_err:
                 logger.error(http_err)
                 return HttpResponseServerError(errorMsgJSON,
@@ -79,7 +201,8 @@ class SearchIndexView(APIView):
                                                content_type="application/json")
             else:
                 logger.info(results)
-                return HttpResponse(results, content_type="application/json")
+                return timer.finish(mark_stale(HttpResponse(
+                    results, content_type="application/json"), age))
         else:
             error = {
                 "message": "Request is missing 'keyword' query paramater"
@@ -106,10 +229,14 @@ class SearchDerivedView(APIView):
         if (request.GET.get('p')) and (request.GET.get('p') != ''):
             filters['page'] = request.GET['p']
 
+        if 'cursor' in request.GET:
+            filters['cursor'] = request.GET['cursor']
+
         return reference, filters
 
     def get(self, request):
         results = []
+        timer = request_timer(request)
 
         reference, filters = self.get_request_attributes(request)
 
@@ -121,13 +248,22 @@ class SearchDerivedView(APIView):
             errorMsgJSON = json.dumps(errorMsg)
 
             try:
+                with timer.phase('config'):
+                    config = get_config_snapshot()
+
                 queries = XSEQueries(
-                    XDSConfiguration.objects.first().target_xse_host,
-                    XDSConfiguration.objects.first().target_xse_index,
-                    user=request.user)
+                    config.target_xse_host,
+                    config.target_xse_index,
+                    user=request.user,
+                    projection=request.GET.get('projection'),
+                    timer=timer)
                 response = queries.search_for_derived(
                     reference=reference, filters=filters)
                 results = queries.get_results(response)
+            except InvalidCursorError as cursor_err:
+                return HttpResponseBadRequest(
+                    json.dumps({"message": str(cursor_err)}),
+                    content_type="application/json")
             except HTTPError as http_err:
                 logger.error(http_err)
                 return HttpResponseServerError(errorMsgJSON,
@@ -138,7 +274,8 @@ class SearchDerivedView(APIView):
                                                content_type="application/json")
             else:
                 logger.info(results)
-                return HttpResponse(results, content_type="application/json")
+                return timer.finish(HttpResponse(
+                    results, content_type="application/json"))
         else:
             error = {
                 "message": "Request is missing 'reference' query " +
@@ -166,10 +303,14 @@ class SearchCompetencyView(APIView):
         if (request.GET.get('p')) and (request.GET.get('p') != ''):
             filters['page'] = request.GET['p']
 
+        if 'cursor' in request.GET:
+            filters['cursor'] = request.GET['cursor']
+
         return reference, filters
 
     def get(self, request):
         results = []
+        timer = request_timer(request)
 
         reference, filters = self.get_request_attributes(request)
 
@@ -181,13 +322,22 @@ class SearchCompetencyView(APIView):
             errorMsgJSON = json.dumps(errorMsg)
 
             try:
+                with timer.phase('config'):
+                    config = get_config_snapshot()
+
                 queries = XSEQueries(
-                    XDSConfiguration.objects.first().target_xse_host,
-                    XDSConfiguration.objects.first().target_xse_index,
-                    user=request.user)
+                    config.target_xse_host,
+                    config.target_xse_index,
+                    user=request.user,
+                    projection=request.GET.get('projection'),
+                    timer=timer)
                 response = queries.search_by_competency(
                     comp_uuid=reference, filters=filters)
                 results = queries.get_results(response)
+            except InvalidCursorError as cursor_err:
+                return HttpResponseBadRequest(
+                    json.dumps({"message": str(cursor_err)}),
+                    content_type="application/json")
             except HTTPError as http_err:
                 logger.error(http_err)
                 return HttpResponseServerError(errorMsgJSON,
@@ -198,7 +348,8 @@ class SearchCompetencyView(APIView):
                                                content_type="application/json")
             else:
                 logger.info(results)
-                return HttpResponse(results, content_type="application/json")
+                return timer.finish(HttpResponse(
+                    results, content_type="application/json"))
         else:
             error = {
                 "message": "Request is missing 'reference' query " +
@@ -216,6 +367,8 @@ class GetMoreLikeThisView(APIView):
 
     def get(self, request, doc_id):
         results = []
+        age = None
+        timer = request_timer(request)
 
         errorMsg = {
             "message": "error executing ElasticSearch query; " +
@@ -224,12 +377,22 @@ class GetMoreLikeThisView(APIView):
         errorMsgJSON = json.dumps(errorMsg)
 
         try:
+            with timer.phase('config'):
+                config = get_config_snapshot()
+
             queries = XSEQueries(
-                XDSConfiguration.objects.first().target_xse_host,
-                XDSConfiguration.objects.first().target_xse_index,
-                user=request.user)
-            response = queries.more_like_this(doc_id=doc_id)
-            results = queries.get_results(response)
+                config.target_xse_host,
+                config.target_xse_index,
+                user=request.user,
+                projection=request.GET.get('projection'),
+                timer=timer)
+            key = queries.search_cache_key('more-like-this', doc_id)
+
+            def search():
+                return queries.get_results(
+                    queries.more_like_this(doc_id=doc_id))
+
+            results, age = cached_search(key, search, profile=timer.profile)
         except HTTPError as http_err:
             logger.error(http_err)
             return HttpResponseServerError(errorMsgJSON,
@@ -240,7 +403,8 @@ class GetMoreLikeThisView(APIView):
                                            content_type="application/json")
         else:
             logger.info(results)
-            return HttpResponse(results, content_type="application/json")
+            return timer.finish(mark_stale(HttpResponse(
+                results, content_type="application/json"), age))
 
 
 class GetSimilarCoursesView(APIView):
@@ -249,6 +413,8 @@ class GetSimilarCoursesView(APIView):
 
     def get(self, request, key):
         results = []
+        age = None
+        timer = request_timer(request)
         if key != '':
             errorMsg = {
                 "message": "error executing ElasticSearch query; " +
@@ -257,13 +423,23 @@ class GetSimilarCoursesView(APIView):
             errorMsgJSON = json.dumps(errorMsg)
 
             try:
+                with timer.phase('config'):
+                    config = get_config_snapshot()
+
                 queries = XSEQueries(
-                    XDSConfiguration.objects.first().target_xse_host,
-                    XDSConfiguration.objects.first().target_xse_index,
-                    user=request.user)
-                response = queries.similar_courses(
-                    keyword=key)
-                results = queries.get_results(response)
+                    config.target_xse_host,
+                    config.target_xse_index,
+                    user=request.user,
+                    projection=request.GET.get('projection'),
+                    timer=timer)
+                cache_key = queries.search_cache_key('similar-courses', key)
+
+                def search():
+                    return queries.get_results(
+                        queries.similar_courses(keyword=key))
+
+                results, age = cached_search(cache_key, search,
+                                             profile=timer.profile)
             except HTTPError as http_err:
                 logger.error(http_err)
                 return HttpResponseServerError(errorMsgJSON,
@@ -274,7 +450,8 @@ class GetSimilarCoursesView(APIView):
                                                content_type="application/json")
             else:
                 logger.info(results)
-                return HttpResponse(results, content_type="application/json")
+                return timer.finish(mark_stale(HttpResponse(
+                    results, content_type="application/json"), age))
         else:
             error = {
                 "message": "Request is missing 'key' query parameter"
@@ -287,30 +464,31 @@ class GetSimilarCoursesView(APIView):
 class FiltersView(APIView):
     """This method defines an API for performing a filter search"""
 
-    def get(self, request):
-        course_mapping = CourseInformationMapping.objects.first()
-
-        results = []
+    def get_request_attributes(self, request, config):
+        """helper method to get attributes"""
+        course_mapping = config.course_mapping
         filters = {}
         page_num = 1
 
         if (request.GET.get('p')) and (request.GET.get('p') != ''):
             page_num = int(request.GET['p'])
 
-        if (request.GET.get(course_mapping.course_title) and
-                request.GET.get(course_mapping.course_title) != ''):
-            filters[course_mapping.course_title] = \
-                request.GET[course_mapping.course_title]
+        for field in (course_mapping.course_title,
+                      course_mapping.course_provider,
+                      'CourseInstance.CourseLevel'):
+            if request.GET.get(field) and request.GET.get(field) != '':
+                filters[field] = request.GET[field]
+
+        return page_num, filters
+
+    def get(self, request):
+        timer = request_timer(request)
 
-        if (request.GET.get(course_mapping.course_provider) and
-                request.GET.get(course_mapping.course_provider) != ''):
-            filters[course_mapping.course_provider] = \
-                request.GET[course_mapping.course_provider]
+        with timer.phase('config'):
+            config = get_config_snapshot()
 
-        if (request.GET.get('CourseInstance.CourseLevel') and
-                request.GET.get('CourseInstance.CourseLevel') != ''):
-            filters['CourseInstance.CourseLevel'] = \
-                request.GET['CourseInstance.CourseLevel']
+        results = []
+        page_num, filters = self.get_request_attributes(request, config)
 
         errorMsg = {
             "message": "error executing ElasticSearch query; " +
@@ -320,9 +498,11 @@ class FiltersView(APIView):
 
         try:
             queries = XSEQueries(
-                XDSConfiguration.objects.first().target_xse_host,
-                XDSConfiguration.objects.first().target_xse_index,
-                user=request.user)
+                config.target_xse_host,
+                config.target_xse_index,
+                user=request.user,
+                projection=request.GET.get('projection'),
+                timer=timer)
             response = queries.search_by_filters(
                 page_num=page_num, filters=filters)
             results = queries.get_results(response)
@@ -336,7 +516,205 @@ class FiltersView(APIView):
                                            content_type="application/json")
         else:
             logger.info(results)
-            return HttpResponse(results, content_type="application/json")
+            return timer.finish(HttpResponse(
+                results, content_type="application/json"))
+
+
+class BulkSearchView(APIView):
+    """This method defines an API for running several keyword, filter,
+            competency and derived searches in a single Elasticsearch round
+            trip"""
+
+    def get_query(self, spec, config):
+        """helper method to get the type and build arguments of a query spec,
+            only keeping the filters its endpoint accepts"""
+        if not isinstance(spec, dict):
+            raise ValueError("Query must be an object")
+
+        search_type = spec.get('type')
+        page = str(spec.get('page') or '1')
+        spec_filters = spec.get('filters') or {}
+
+        if not isinstance(spec_filters, dict):
+            raise ValueError("Query filters must be an object")
+
+        if search_type == 'keyword' and spec.get('keyword'):
+            filters = {'page': page}
+
+            if spec.get('sort'):
+                filters['sort'] = spec['sort']
+
+            for curr_filter in config.search_filters:
+                value = spec_filters.get(curr_filter.field_name)
+
+                if value:
+                    filters[curr_filter.field_name] = \
+                        value if isinstance(value, list) else [value]
+
+            # facets=false skips the filter aggregations
+            return search_type, {'keyword': spec['keyword'],
+                                 'filters': filters,
+                                 'facets': spec.get('facets') is not False}
+
+        if search_type == 'filters':
+            course_mapping = config.course_mapping
+            fields = (course_mapping.course_title,
+                      course_mapping.course_provider,
+                      'CourseInstance.CourseLevel')
+
+            return search_type, {
+                'page_num': int(page),
+                'filters': {field: spec_filters[field] for field in fields
+                            if spec_filters.get(field)}}
+
+        if search_type == 'competency' and spec.get('reference'):
+            return search_type, {'comp_uuid': spec['reference'],
+                                 'filters': {'page': page}}
+
+        if search_type == 'derived' and spec.get('reference'):
+            return search_type, {'reference': spec['reference'],
+                                 'filters': {'page': page}}
+
+        raise ValueError("Query must have a type of keyword, filters, "
+                         "competency or derived and its keyword or "
+                         "reference")
+
+    def post(self, request):
+        timer = request_timer(request)
+        specs = request.data.get('queries') \
+            if isinstance(request.data, dict) else None
+
+        if not isinstance(specs, list) or not specs:
+            return HttpResponseBadRequest(
+                json.dumps({"message": "Request is missing 'queries' list"}),
+                content_type="application/json")
+
+        if len(specs) > settings.BULK_SEARCH_MAX_QUERIES:
+            return HttpResponseBadRequest(
+                json.dumps({"message": "Request has more than " +
+                            f"{settings.BULK_SEARCH_MAX_QUERIES} queries"}),
+                content_type="application/json")
+
+        errorMsg = {
+            "message": "error executing ElasticSearch query; " +
+            CONTACT_ADMIN
+        }
+        errorMsgJSON = json.dumps(errorMsg)
+
+        try:
+            with timer.phase('config'):
+                config = get_config_snapshot()
+
+            queries = XSEQueries(
+                config.target_xse_host,
+                config.target_xse_index,
+                user=request.user,
+                projection=request.GET.get('projection'),
+                timer=timer)
+            # invalid specs are reported in place of their results
+            valid = []
+            errors = {}
+
+            for position, spec in enumerate(specs):
+                try:
+                    valid.append(self.get_query(spec, config))
+                except (ValueError, TypeError) as err:
+                    errors[position] = str(err)
+
+            bulk_results = iter(queries.bulk_search(valid))
+            responses = []
+
+            for position in range(len(specs)):
+                if position in errors:
+                    error = errors[position]
+                else:
+                    results, error = next(bulk_results)
+
+                responses.append(results if error is None
+                                 else dumps({'error': error}))
+        except HTTPError as http_err:
+            logger.error(http_err)
+            return HttpResponseServerError(errorMsgJSON,
+                                           content_type="application/json")
+        except Exception as err:
+            logger.error(err)
+            return HttpResponseServerError(errorMsgJSON,
+                                           content_type="application/json")
+        else:
+            # the results JSON of each query is inlined as is
+            return timer.finish(HttpResponse(
+                b'{"responses":[' + b','.join(responses) + b']}',
+                content_type="application/json"))
+
+
+class SavedFilterResultsView(APIView):
+    """This method defines an API for running the search of a saved filter
+            of the current user by its id"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, filter_id):
+        results = []
+        age = None
+        timer = request_timer(request)
+
+        errorMsg = {
+            "message": "error executing ElasticSearch query; " +
+            CONTACT_ADMIN
+        }
+        errorMsgJSON = json.dumps(errorMsg)
+
+        try:
+            saved_filter = SavedFilter.objects.get(pk=filter_id,
+                                                   owner=request.user)
+
+            with timer.phase('config'):
+                config = get_config_snapshot()
+
+            # p pages through the results of the saved filter
+            keyword, filters = search_arguments(
+                saved_filter.get_parsed_query(), config,
+                page=request.GET.get('p'))
+
+            if keyword == '':
+                return HttpResponseBadRequest(
+                    json.dumps({"message": "Saved filter has no keyword"}),
+                    content_type="application/json")
+
+            queries = XSEQueries(
+                config.target_xse_host,
+                config.target_xse_index,
+                user=request.user,
+                projection=request.GET.get('projection'),
+                timer=timer)
+            # drop cached results if the index contents changed
+            saved_filter_cache.sync_generation(queries.index_generation())
+            key = queries.search_cache_key(f'saved-filter:{filter_id}',
+                                           keyword, filters)
+
+            def search():
+                return queries.get_results(queries.search_by_keyword(
+                    keyword=keyword, filters=filters))
+
+            results, age = cached_search(key, search,
+                                         cache=saved_filter_cache,
+                                         profile=timer.profile)
+        except ObjectDoesNotExist as not_found_err:
+            logger.error(not_found_err)
+            return HttpResponseNotFound(
+                json.dumps({"message": "Saved filter not found"}),
+                content_type="application/json")
+        except HTTPError as http_err:
+            logger.error(http_err)
+            return HttpResponseServerError(errorMsgJSON,
+                                           content_type="application/json")
+        except Exception as err:
+            logger.error(err)
+            return HttpResponseServerError(errorMsgJSON,
+                                           content_type="application/json")
+        else:
+            logger.info(results)
+            return timer.finish(mark_stale(HttpResponse(
+                results, content_type="application/json"), age))
 
 
 class SuggestionsView(APIView):
@@ -351,16 +729,45 @@ class SuggestionsView(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
         try:
+            config = get_config_snapshot()
             queries = XSEQueries(
-                XDSConfiguration.objects.first().target_xse_host,
-                XDSConfiguration.objects.first().target_xse_index)
-            response = queries.suggest(
+                config.target_xse_host,
+                config.target_xse_index)
+            results = queries.cached_suggest(
                 partial=request.GET['partial'])
 
-            results = response.suggest.to_dict()['autocomplete_suggestion']
-
             return Response(results, status=status.HTTP_200_OK)
         except Exception as err:
             logger.error(err)
             return Response({"message": err.args[0]},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class StatsView(APIView):
+    """
+    This method defines an API for staff to inspect the Elasticsearch client
+    pools and caches held by the current worker process
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        stats = {
+            'pools': pool_stats(),
+            'caches': {
+                'search': search_result_cache.stats(),
+                'facets': facet_cache.stats(),
+                'suggest': suggest_cache.stats(),
+                'last_good': last_good_cache.stats(),
+                'saved_filters': saved_filter_cache.stats(),
+                'metadata': metadata_cache.stats(),
+            },
+            'coalescing': {
+                'search': search_flight.stats(),
+                'xis': xis_flight.stats(),
+            },
+            'breakers': breaker_stats(),
+            'profiling': phase_stats.stats(),
+            'xis': xis_client.stats(),
+        }
+
+        return Response(stats, status=status.HTTP_200_OK)
@@ -316,6 +316,178 @@ XAPI_ACTOR_ACCOUNT_NAME_JWT_FIELDS = [
 ]
 
 
+# Caches: 'default' is local to each worker process, 'shared' is visible to
+# every worker (table created by `createcachetable` in start-app.sh)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'xds_shared_cache',
+    },
+}
+
+# seconds a worker trusts its configuration snapshot before checking the
+# shared version for admin changes made in other workers
+CONFIG_SNAPSHOT_CHECK_INTERVAL = float(
+    os.environ.get('CONFIG_SNAPSHOT_CHECK_INTERVAL', '5'))
+
+# Elasticsearch client settings
+
+# seconds before a request to the XSE host times out
+XSE_CLIENT_TIMEOUT = int(os.environ.get('XSE_CLIENT_TIMEOUT', '60'))
+
+# max keep-alive connections held per XSE node by each worker process
+XSE_POOL_MAXSIZE = int(os.environ.get('XSE_POOL_MAXSIZE', '10'))
+
+# how requests are spread across the XSE nodes, round-robin or least-latency
+XSE_HOST_SELECTOR = os.environ.get('XSE_HOST_SELECTOR', 'round-robin')
+
+# latency budgets in milliseconds of the /es-api/ searches and of
+# autocomplete suggestions, shards that miss them are left out of partial
+# results and the client waits at most SEARCH_BUDGET_MARGIN_MS longer than
+# the budget, 0 disables them
+SEARCH_BUDGET_MS = int(os.environ.get('SEARCH_BUDGET_MS', '2000'))
+SUGGEST_BUDGET_MS = int(os.environ.get('SUGGEST_BUDGET_MS', '800'))
+SEARCH_BUDGET_MARGIN_MS = int(os.environ.get('SEARCH_BUDGET_MARGIN_MS',
+                                             '250'))
+
+# hits each shard collects before a search returns early, 0 collects all
+SEARCH_TERMINATE_AFTER = int(os.environ.get('SEARCH_TERMINATE_AFTER', '0'))
+
+# seconds a failed XSE node is skipped for, doubling on consecutive failures
+XSE_DEAD_TIMEOUT = int(os.environ.get('XSE_DEAD_TIMEOUT', '60'))
+
+# seconds between sniffs of the XSE cluster nodes, 0 only uses the
+# configured hosts
+XSE_SNIFF_INTERVAL = int(os.environ.get('XSE_SNIFF_INTERVAL', '0'))
+
+# seconds a worker trusts the last seen document count of the XSE index
+# before checking it again, cached results are dropped when it changes
+INDEX_GENERATION_CHECK_INTERVAL = float(
+    os.environ.get('INDEX_GENERATION_CHECK_INTERVAL', '30'))
+
+# per worker cache of keyword search results
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', '60'))
+SEARCH_CACHE_MAXSIZE = int(os.environ.get('SEARCH_CACHE_MAXSIZE', '1000'))
+
+# per worker cache of /es-api/facets/ filter aggregations
+FACET_CACHE_TTL = int(os.environ.get('FACET_CACHE_TTL', '300'))
+FACET_CACHE_MAXSIZE = int(os.environ.get('FACET_CACHE_MAXSIZE', '1000'))
+
+# seconds and number of entries kept of the results of saved filters run by
+# /es-api/saved-filters/<id>/, per filter and organization set
+SAVED_FILTER_CACHE_TTL = int(os.environ.get('SAVED_FILTER_CACHE_TTL', '600'))
+SAVED_FILTER_CACHE_MAXSIZE = int(
+    os.environ.get('SAVED_FILTER_CACHE_MAXSIZE', '2000'))
+
+# per worker cache of the XIS records of experiences by metadata_key_hash,
+# served by the course detail, interest list and most saved courses views
+METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL', '300'))
+METADATA_CACHE_MAXSIZE = int(
+    os.environ.get('METADATA_CACHE_MAXSIZE', '10000'))
+
+# per worker cache of /es-api/suggest/ autocomplete suggestions
+SUGGEST_CACHE_TTL = int(os.environ.get('SUGGEST_CACHE_TTL', '60'))
+SUGGEST_CACHE_MAXSIZE = int(os.environ.get('SUGGEST_CACHE_MAXSIZE', '5000'))
+
+# number of suggestions returned by /es-api/suggest/
+SUGGEST_SIZE = int(os.environ.get('SUGGEST_SIZE', '5'))
+
+# per worker cache of the organizations each user's results are filtered on
+USER_ORGANIZATION_CACHE_TTL = int(
+    os.environ.get('USER_ORGANIZATION_CACHE_TTL', '300'))
+USER_ORGANIZATION_CACHE_MAXSIZE = int(
+    os.environ.get('USER_ORGANIZATION_CACHE_MAXSIZE', '10000'))
+
+# how long the point in time behind a search cursor is kept open between
+# page requests, in Elasticsearch time units
+SEARCH_CURSOR_KEEP_ALIVE = os.environ.get('SEARCH_CURSOR_KEEP_ALIVE', '2m')
+
+# identical concurrent XSE/XIS requests made by a worker share one upstream
+# call, set SINGLE_FLIGHT_SHARED to also share them between workers through
+# a lock in the shared cache
+SINGLE_FLIGHT_SHARED = \
+    os.getenv('SINGLE_FLIGHT_SHARED', 'false').lower() == 'true'
+SINGLE_FLIGHT_LOCK_TIMEOUT = int(
+    os.environ.get('SINGLE_FLIGHT_LOCK_TIMEOUT', '10'))
+SINGLE_FLIGHT_RESULT_TTL = int(os.environ.get('SINGLE_FLIGHT_RESULT_TTL', '2'))
+SINGLE_FLIGHT_POLL_INTERVAL = float(
+    os.environ.get('SINGLE_FLIGHT_POLL_INTERVAL', '0.05'))
+
+# pooled XIS session of each worker: keep-alive connections held, seconds
+# to connect and to wait for a response, and GETs that fail to connect or
+# get a 502/503/504 are retried XIS_RETRIES times after a jittered backoff of
+# up to XIS_RETRY_BACKOFF seconds, doubling on each retry. Read timeouts are
+# not retried.
+XIS_POOL_MAXSIZE = int(os.environ.get('XIS_POOL_MAXSIZE', '10'))
+XIS_CONNECT_TIMEOUT = float(os.environ.get('XIS_CONNECT_TIMEOUT', '3.05'))
+XIS_READ_TIMEOUT = float(os.environ.get('XIS_READ_TIMEOUT', '3'))
+XIS_RETRIES = int(os.environ.get('XIS_RETRIES', '2'))
+XIS_RETRY_BACKOFF = float(os.environ.get('XIS_RETRY_BACKOFF', '0.2'))
+
+# threads of a request fetching the pages of a paginated XIS response
+# concurrently once the first page reported the count of results, or the
+# chunks of a long list of experience hashes
+XIS_PAGE_CONCURRENCY = int(os.environ.get('XIS_PAGE_CONCURRENCY', '4'))
+
+# most experience hashes requested from XIS in one metadata_key_hash_list
+# query, longer lists are split into chunks
+XIS_HASH_CHUNK_SIZE = int(os.environ.get('XIS_HASH_CHUNK_SIZE', '50'))
+
+# seconds before the materialized spotlight courses are refreshed in the
+# background, course spotlight changes refresh them sooner
+SPOTLIGHT_REFRESH_INTERVAL = int(
+    os.environ.get('SPOTLIGHT_REFRESH_INTERVAL', '900'))
+
+# seconds a worker may spend refreshing a materialized payload before
+# another worker may take over
+MATERIALIZED_REFRESH_TIMEOUT = int(
+    os.environ.get('MATERIALIZED_REFRESH_TIMEOUT', '60'))
+
+# number of neighbors stored per course by the precompute_neighbors command,
+# and the number of courses it reads from the index at a time
+NEIGHBORS_SIZE = int(os.environ.get('NEIGHBORS_SIZE', '20'))
+NEIGHBORS_BATCH_SIZE = int(os.environ.get('NEIGHBORS_BATCH_SIZE', '200'))
+
+# seconds between the full runs of precompute_neighbors, which find courses
+# added since as neighbors of courses that did not change, 0 only runs full
+# with --full
+NEIGHBORS_FULL_INTERVAL = int(
+    os.environ.get('NEIGHBORS_FULL_INTERVAL', '604800'))
+
+# circuit breakers of the Elasticsearch nodes, XIS and the LRS. A worker
+# trips a circuit when BREAKER_FAILURE_RATE of at least BREAKER_MIN_CALLS
+# calls in the last BREAKER_WINDOW seconds failed or took longer than
+# BREAKER_SLOW_CALL seconds. Every worker then fails fast for
+# BREAKER_OPEN_SECONDS before a single probe call may close it again.
+BREAKER_WINDOW = float(os.environ.get('BREAKER_WINDOW', '30'))
+BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', '10'))
+BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_SLOW_CALL = float(os.environ.get('BREAKER_SLOW_CALL', '5'))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_PROBE_TIMEOUT = int(os.environ.get('BREAKER_PROBE_TIMEOUT', '60'))
+BREAKER_CHECK_INTERVAL = float(
+    os.environ.get('BREAKER_CHECK_INTERVAL', '1'))
+
+# per worker copy of the last good results of each search, served with an
+# Age header while the circuit to Elasticsearch is open
+LAST_GOOD_CACHE_TTL = int(os.environ.get('LAST_GOOD_CACHE_TTL', '86400'))
+LAST_GOOD_CACHE_MAXSIZE = int(
+    os.environ.get('LAST_GOOD_CACHE_MAXSIZE', '2000'))
+
+# share of /es-api/ requests whose phase timings are collected in the per
+# worker stats, staff may profile a single request with ?profile=1
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+
+# largest number of searches a single /es-api/bulk/ request may run
+BULK_SEARCH_MAX_QUERIES = int(os.environ.get('BULK_SEARCH_MAX_QUERIES', '20'))
+
+# serve the /es-api/ endpoints with async views, requires the ASGI run mode
+ES_API_ASYNC = os.getenv('ES_API_ASYNC', 'false').lower() == 'true'
+
+
 # Accepts regex arguments
 OPEN_ENDPOINTS = [
     "/api/auth/register",
@@ -327,8 +499,10 @@ OPEN_ENDPOINTS = [
     "/es-api/more-like-this/[a-zA-Z0-9]+/",
     "/es-api/",
     "/es-api/suggest/",
+    "/es-api/facets/",
     "/es-api/derived-from/",
     "/es-api/teaches/",
+    "/es-api/bulk/",
     "/api/experiences/[a-zA-Z0-9]+/",
     "/api/spotlight-courses",
     "/es-api/similar-courses/[a-zA-Z0-9]+/",
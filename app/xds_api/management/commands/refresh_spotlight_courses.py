@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from xds_api.utils.xds_utils import xis_spotlight
+
+
+class Command(BaseCommand):
+    """This command rebuilds the materialized spotlight courses, run it on
+        start up and on a schedule so requests never build them"""
+
+    def handle(self, *args, **options):
+        try:
+            xis_spotlight.refresh()
+            self.stdout.write(
+                self.style.SUCCESS(f"Refreshed {xis_spotlight.name}"))
+        except Exception as err:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Could not refresh {xis_spotlight.name}: {err}"))
@@ -1,8 +1,12 @@
 import logging
 
-from django.db.models.signals import post_migrate
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
 
+from core.models import CourseSpotlight
+from xds_api.utils.xds_utils import xis_spotlight
+
 logger = logging.getLogger('dict_config_logger')
 
 GROUPS = ['System Operator', 'Experience Owner', 'Experience Manager',
@@ -54,3 +58,10 @@ def add_permissions(sender, verbosity, stdout, using, apps, **kwargs):
                             format(name))
                         stdout.flush()
                     continue
+
+
+@receiver([post_save, post_delete], sender=CourseSpotlight)
+def spotlight_changed(sender, **kwargs):
+    """Refreshes the materialized spotlight courses once a course
+        spotlight change is committed"""
+    transaction.on_commit(xis_spotlight.invalidate)
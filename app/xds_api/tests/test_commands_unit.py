@@ -25,3 +25,12 @@ class CommandTests(TestCase):
             gi.ensure_connection.side_effect = [OperationalError] * 5 + [True]
             call_command('waitdb')
             self.assertEqual(gi.ensure_connection.call_count, 6)
+
+    def test_refresh_spotlight_courses(self):
+        """Test that the materialized spotlight courses are refreshed"""
+        with patch('xds_api.management.commands.refresh_spotlight_courses.'
+                   'xis_spotlight') as xis_spotlight:
+            xis_spotlight.refresh.side_effect = ValueError
+            call_command('refresh_spotlight_courses')
+
+            xis_spotlight.refresh.assert_called_once()
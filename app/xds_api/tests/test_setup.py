@@ -5,6 +5,7 @@ from core.models import Experience, InterestList, SavedFilter
 from openlxp_notifications.models import email
 from rest_framework.test import APITestCase
 from users.models import XDSUser
+from xds_api.utils.xds_utils import metadata_cache
 
 from django.test import override_settings
 
@@ -18,6 +19,8 @@ class TestSetUp(APITestCase):
         settings_manager = override_settings(SECURE_SSL_REDIRECT=False)
         settings_manager.enable()
         self.addCleanup(settings_manager.disable)
+        # XIS records cached by other tests are not served
+        metadata_cache.clear()
 
         # self.patcher = patch('users.models.email_verification')
         # self.mock_email_verification = self.patcher.start()
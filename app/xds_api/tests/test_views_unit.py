@@ -3,7 +3,8 @@ import requests
 from unittest.mock import Mock, patch
 
 from configurations.models import XDSConfiguration
-from core.models import CourseSpotlight, InterestList, SavedFilter
+from core.models import (CourseSpotlight, Experience, InterestList,
+                         SavedFilter)
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
@@ -11,6 +12,7 @@ from django.test import tag
 from django.urls import reverse
 from requests.exceptions import HTTPError, RequestException
 from rest_framework import status
+from xds_api.views import InterestListView
 
 from .test_setup import TestSetUp
 
@@ -186,6 +188,98 @@ class InterestListsTests(TestSetUp):
             self.assertEqual(response.status_code, status.HTTP_200_OK)
             self.assertEqual(responseDict["experiences"], [None])
 
+    def test_get_interest_list_by_id_streamed(self):
+        """
+        Test that the courses of an interest list longer than one hash list
+        chunk are streamed in the order of the list.
+        """
+        self.list_1.experiences.add(Experience.objects.create(pk='5678'))
+        url = reverse('xds_api:interest-list', args=(self.list_1.pk,))
+        self.client.login(email=self.auth_email, password=self.auth_password)
+
+        def xis_page(api_url):
+            metadata_key_hash = api_url.rsplit('=', 1)[1]
+            response = Mock(status_code=200)
+            response.json.return_value = {"results": [{
+                "metadata": {"Metadata_Ledger": {}},
+                "unique_record_identifier": metadata_key_hash,
+                "metadata_key_hash": metadata_key_hash}]}
+
+            return response
+
+        with patch('xds_api.utils.xds_utils.get_request') as get_request, \
+                patch('xds_api.utils.xds_utils.get_config_snapshot',
+                      return_value=Mock(
+                          target_xis_metadata_api='www.test.com')), \
+                self.settings(XIS_HASH_CHUNK_SIZE=1):
+            get_request.side_effect = xis_page
+
+            response = self.client.get(url)
+            responseDict = json.loads(b''.join(response.streaming_content))
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(responseDict['name'], 'list 1')
+            self.assertEqual(
+                [course['meta']['metadata_key_hash']
+                 for course in responseDict['experiences']],
+                list(self.list_1.experiences.values_list('pk', flat=True)))
+
+    def test_get_interest_list_by_id_streamed_error(self):
+        """
+        Test that a streamed interest list ends with an error when XIS fails
+        on a later chunk of its courses.
+        """
+        self.list_1.experiences.add(Experience.objects.create(pk='5678'))
+        url = reverse('xds_api:interest-list', args=(self.list_1.pk,))
+        self.client.login(email=self.auth_email, password=self.auth_password)
+        first, _ = self.list_1.experiences.values_list('pk', flat=True)
+
+        def xis_page(api_url):
+            metadata_key_hash = api_url.rsplit('=', 1)[1]
+            response = Mock(status_code=200 if metadata_key_hash == first
+                            else 502)
+            response.json.return_value = {"results": [{
+                "metadata": {"Metadata_Ledger": {}},
+                "unique_record_identifier": metadata_key_hash,
+                "metadata_key_hash": metadata_key_hash}]}
+
+            return response
+
+        with patch('xds_api.utils.xds_utils.get_request') as get_request, \
+                patch('xds_api.utils.xds_utils.get_config_snapshot',
+                      return_value=Mock(
+                          target_xis_metadata_api='www.test.com')), \
+                self.settings(XIS_HASH_CHUNK_SIZE=1):
+            get_request.side_effect = xis_page
+
+            response = self.client.get(url)
+            responseDict = json.loads(b''.join(response.streaming_content))
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                [course['meta']['metadata_key_hash']
+                 for course in responseDict['experiences']], [first])
+            self.assertIn('message', responseDict['error'])
+
+    def test_get_interest_list_by_id_cached(self):
+        """
+        Test that an interest list whose courses are all cached is served
+        without adding to the error message of later requests.
+        """
+        url = reverse('xds_api:interest-list', args=(self.list_1.pk,))
+        self.client.login(email=self.auth_email, password=self.auth_password)
+        message = InterestListView.errorMsg["message"]
+
+        with patch('xds_api.views.iter_metadata_chunks') as chunks:
+            chunks.return_value = iter([(None, [{"test": "value"}])])
+
+            response = self.client.get(url)
+            responseDict = json.loads(response.content)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(responseDict["experiences"], [{"test": "value"}])
+            self.assertEqual(InterestListView.errorMsg["message"], message)
+
     def test_get_interest_list_by_id_no_xis(self):
         """
         Test that an authenticated user can get an interest list by id,
@@ -729,10 +823,7 @@ class SpotlightCoursesTests(TestSetUp):
 
         self.client.login(email=self.auth_email, password=self.auth_password)
 
-        with patch('xds_api.views.get_request') as get_request, \
-                patch('xds_api.views.'
-                      'get_spotlight_courses_api_url') as get_api_url:
-            get_api_url.return_value = "www.test.com"
+        with patch('xds_api.utils.xds_utils.get_request') as get_request:
             http_resp = Mock()
             get_request.return_value = http_resp
             http_resp.json.return_value = [{
@@ -755,10 +846,7 @@ class SpotlightCoursesTests(TestSetUp):
         self.client.login(email=self.auth_email, password=self.auth_password)
         CourseSpotlight(course_id='abc123').save()
 
-        with patch('xds_api.views.get_request') as get_request, \
-                patch('xds_api.views.'
-                      'get_spotlight_courses_api_url') as get_api_url:
-            get_api_url.return_value = "www.test.com"
+        with patch('xds_api.utils.xds_utils.get_request') as get_request:
             get_request.side_effect = [HTTPError]
 
             response = self.client.get(url)
@@ -768,6 +856,38 @@ class SpotlightCoursesTests(TestSetUp):
                              status.HTTP_500_INTERNAL_SERVER_ERROR)
             self.assertEqual(responseDict['message'], errorMsg)
 
+    def test_get_spotlight_courses_materialized(self):
+        """test that the spotlight courses are requested from XIS once and
+            then served from the materialized copy"""
+        url = reverse('xds_api:spotlight-courses')
+        permission = Permission.objects. \
+            get(name='Can view get spotlight courses')
+        self.auth_user.user_permissions.add(permission)
+        self.client.login(email=self.auth_email, password=self.auth_password)
+        CourseSpotlight(course_id='abc123').save()
+
+        with patch('xds_api.utils.xds_utils.get_request') as get_request:
+            http_resp = Mock()
+            get_request.return_value = http_resp
+            http_resp.json.return_value = {"results": [], "next": None}
+            http_resp.status_code = 200
+
+            self.client.get(url)
+            response = self.client.get(url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), [])
+            self.assertEqual(get_request.call_count, 1)
+
+    def test_spotlight_change_refreshes(self):
+        """test that committing a course spotlight change refreshes the
+            materialized spotlight courses"""
+        with patch('xds_api.signals.xis_spotlight') as xis_spotlight, \
+                self.captureOnCommitCallbacks(execute=True):
+            CourseSpotlight(course_id='abc123').save()
+
+        xis_spotlight.invalidate.assert_called_once()
+
     def test_get_spotlight_courses_empty(self):
         """test that calling the endpoint /api/spotlight-courses returns
             nothing if there are no spotlight courses"""
@@ -777,10 +897,7 @@ class SpotlightCoursesTests(TestSetUp):
         self.auth_user.user_permissions.add(permission)
         self.client.login(email=self.auth_email, password=self.auth_password)
 
-        with patch('xds_api.views.get_request'), \
-                patch('xds_api.views.'
-                      'get_spotlight_courses_api_url'):
-
+        with patch('xds_api.utils.xds_utils.get_request'):
             response = self.client.get(url)
 
             self.assertEqual(response.status_code,
@@ -799,7 +916,7 @@ class ViewTests(TestSetUp):
         errorMsg = "error reaching out to configured XIS API; " + \
                    "please check the XIS logs"
         self.client.login(email=self.auth_email, password=self.auth_password)
-        with patch('xds_api.views.get_request') as get_request:
+        with patch('xds_api.utils.xds_utils.get_request') as get_request:
             get_request.side_effect = RequestException
 
             response = self.client.get(url)
@@ -820,7 +937,7 @@ class ViewTests(TestSetUp):
         # login user and get token
         self.client.login(email=self.auth_email, password=self.auth_password)
 
-        with patch('xds_api.views.get_request') as get_request:
+        with patch('xds_api.utils.xds_utils.get_request') as get_request:
             get_request.side_effect = ObjectDoesNotExist
 
             response = self.client.get(url)
@@ -828,6 +945,32 @@ class ViewTests(TestSetUp):
             self.assertEqual(response.status_code,
                              status.HTTP_404_NOT_FOUND)
 
+    def test_get_experiences_cached(self):
+        """Test that a course fetched from XIS is served from the metadata
+            cache on the next request"""
+        url = reverse('xds_api:get_courses', args=('123456',))
+        self.client.login(email=self.auth_email, password=self.auth_password)
+
+        with patch('xds_api.utils.xds_utils.get_request') as get_request, \
+                patch('xds_api.utils.xds_utils.get_config_snapshot',
+                      return_value=Mock(
+                          target_xis_metadata_api='www.test.com')):
+            http_resp = Mock(status_code=200)
+            http_resp.json.return_value = {"results": [{
+                "metadata": {"Metadata_Ledger": {"Course": {}}},
+                "unique_record_identifier": "abc",
+                "metadata_key_hash": "123456"}], "next": None}
+            get_request.return_value = http_resp
+
+            self.client.get(url)
+            response = self.client.get(url)
+            responseDict = json.loads(response.content)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(responseDict['meta']['metadata_key_hash'],
+                             '123456')
+            self.assertEqual(get_request.call_count, 1)
+
 
 VALID_STATEMENT = {
     "actor": {
@@ -1102,48 +1245,30 @@ class CourseMostSavedTests(TestSetUp):
         mock_mapping.course_title = 'test-core.Title'
 
         with (
-            patch('xds_api.views.metadata_to_target') as metadata_to_target,
-            patch('xds_api.views.interest_list_check') as interest_list_check,
             patch(
-                'xds_api.views.CourseInformationMapping.objects.first',
-                return_value=mock_mapping,
+                'xds_api.views.get_config_snapshot',
+                return_value=Mock(course_mapping=mock_mapping),
             ),
             patch(
-                'xds_api.views.interest_list_get_search_str'
-            ) as interest_list_get_search_str,
+                'xds_api.views.get_experience_metadata'
+            ) as get_experience_metadata,
         ):
 
-            # Mock interest_list_check
-            interest_list_check.return_value = (
-                ['1234'],  # list of hashes
-                '?metadata_key_hash_list=1234',
-            )
-
             # Mock the response
             mock_resp = Mock()
             mock_resp.status_code = 200
-            mock_json_data = {
-                'results': [
+
+            # Mock the formatted records
+            get_experience_metadata.return_value = (
+                mock_resp,
+                [
                     {
-                        'test': 'value',
+                        'test-core': {'Title': 'Test Course 998'},
+                        'meta': {'metadata_key_hash': '1234'}
                     }
                 ]
-            }
-
-            # Mock interest_list_get_search_str
-            interest_list_get_search_str.return_value = (
-                mock_resp,
-                mock_json_data
             )
 
-            # Mock the metadata formatting
-            metadata_to_target.return_value = [
-                {
-                    'test-core': {'Title': 'Test Course 998'},
-                    'meta': {'metadata_key_hash': '1234'}
-                }
-            ]
-
             response = self.client.get(url)
             responseDict = json.loads(response.content)
 
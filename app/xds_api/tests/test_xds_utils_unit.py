@@ -1,35 +1,24 @@
 import json
-from unittest.mock import patch
+import os
+import threading
+from unittest.mock import Mock, patch
 
-from configurations.models import XDSConfiguration
-from core.models import CourseSpotlight, Experience
-from django.test import TestCase, tag
-from xds_api.utils.xds_utils import (get_spotlight_courses_api_url,
-                                     metadata_to_target, save_experiences)
+from core.models import Experience
+from django.test import TestCase, override_settings, tag
+from requests.exceptions import ConnectTimeout, HTTPError
+from xds_api.utils.xds_utils import (get_all_pages, get_chunked_metadata,
+                                     get_experience_metadata, get_request,
+                                     iter_experience_metadata,
+                                     iter_metadata_chunks, iter_pages,
+                                     metadata_cache, metadata_to_target,
+                                     pooled_map, save_experiences,
+                                     stream_json, xis_page_urls)
+from xds_api.utils.xis_client import JitteredRetry, XISClient
 
 
 @tag('unit')
 class UtilTests(TestCase):
 
-    def test_get_spotlight_courses_api_url(self):
-        """Test that get_spotlight_courses_api_url returns a full url using
-            configured XIS api and saved spotlight courses IDs"""
-        spotlight = CourseSpotlight(course_id='123')
-        config = XDSConfiguration(target_xis_metadata_api="test.com/")
-        expected_result = 'test.com/?metadata_key_hash_list=123'
-
-        with patch('xds_api.utils.xds_utils.CourseSpotlight.objects') as \
-            courseSpotlight, patch('xds_api.utils.xds_utils'
-                                   '.XDSConfiguration.objects') as xdsConfig:
-            courseSpotlight.return_value = courseSpotlight
-            xdsConfig.return_value = xdsConfig
-            courseSpotlight.filter.return_value = [spotlight, ]
-            xdsConfig.first.return_value = config
-
-            actual_result = get_spotlight_courses_api_url()
-
-            self.assertEqual(expected_result, actual_result)
-
     def test_metadata_to_target(self):
         """Test that given a course/record JSON, calling metadata_to_target
             returns a JSON object similar to { "meta": {"id": "1234"}, ...}"""
@@ -65,3 +54,443 @@ class UtilTests(TestCase):
         save_experiences([course_1.pk, '456'])
 
         self.assertEqual(len(Experience.objects.all()), 2)
+
+
+def _xis_record(metadata_key_hash):
+    return {"metadata": {"Metadata_Ledger": {"Course": {}}},
+            "unique_record_identifier": metadata_key_hash + "-id",
+            "metadata_key_hash": metadata_key_hash}
+
+
+def _xis_pages(queries):
+    """Returns the pages mock of the metadata_key_hash_list queries, by
+        query, of the patched xis/ api"""
+    pages = Mock(side_effect=lambda api_url: iter(
+        [queries[api_url[len('xis/'):]]]))
+
+    return patch('xds_api.utils.xds_utils.iter_pages', pages)
+
+
+def _patch_xis_api(test):
+    """Patches the configured XIS api of a test to xis/"""
+    patcher = patch('xds_api.utils.xds_utils.get_config_snapshot',
+                    return_value=Mock(target_xis_metadata_api='xis/'))
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+@tag('unit')
+class MetadataCacheTests(TestCase):
+
+    def setUp(self):
+        metadata_cache.clear()
+        _patch_xis_api(self)
+
+    def test_get_experience_metadata(self):
+        """Test that cached records are served locally, only the missing
+            hashes are requested from XIS in one query and the records are
+            returned in the order of their hashes"""
+        metadata_cache.set('b', json.dumps(
+            metadata_to_target(_xis_record('b'))).encode())
+
+        with _xis_pages({'?metadata_key_hash_list=a,c': (
+                Mock(status_code=200),
+                [_xis_record('c'), _xis_record('a')])}) as pages:
+            response, records = get_experience_metadata(['a', 'b', 'c'])
+
+            pages.assert_called_once_with('xis/?metadata_key_hash_list=a,c')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [record['meta']['metadata_key_hash'] for record in records],
+                ['a', 'b', 'c'])
+
+            response, records = get_experience_metadata(['c', 'a'])
+
+            self.assertIsNone(response)
+            self.assertEqual(len(records), 2)
+            self.assertEqual(pages.call_count, 1)
+
+    def test_get_chunked_metadata(self):
+        """Test that long hash lists are requested in chunks whose records
+            are merged in order"""
+        chunks = {
+            '?metadata_key_hash_list=a,b': (Mock(status_code=200),
+                                            [_xis_record('b'),
+                                             _xis_record('a')]),
+            '?metadata_key_hash_list=c,d': (Mock(status_code=200),
+                                            [_xis_record('d')]),
+            '?metadata_key_hash_list=e': (Mock(status_code=200),
+                                          [_xis_record('e')]),
+        }
+
+        with _xis_pages(chunks) as pages, \
+                self.settings(XIS_HASH_CHUNK_SIZE=2, XIS_PAGE_CONCURRENCY=3):
+            response, records = get_chunked_metadata(['a', 'b', 'c', 'd', 'e'])
+
+            self.assertEqual(pages.call_count, 3)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([record['metadata_key_hash']
+                              for record in records], ['b', 'a', 'd', 'e'])
+
+            with self.assertLogs('dict_config_logger', 'WARNING') as logs:
+                response, records = get_experience_metadata(
+                    ['a', 'b', 'c', 'd', 'e'])
+
+            self.assertEqual(
+                [record['meta']['metadata_key_hash'] for record in records],
+                ['a', 'b', 'd', 'e'])
+            self.assertIn('c', logs.output[0])
+
+    def test_get_chunked_metadata_error(self):
+        """Test that the response of a failed chunk is returned"""
+        chunks = {
+            '?metadata_key_hash_list=a': (Mock(status_code=200),
+                                          [_xis_record('a')]),
+            '?metadata_key_hash_list=b': (Mock(status_code=502), []),
+        }
+
+        with _xis_pages(chunks), self.settings(XIS_HASH_CHUNK_SIZE=1):
+            response, records = get_experience_metadata(['a', 'b'])
+
+            self.assertEqual(response.status_code, 502)
+            self.assertIsNone(records)
+
+    def test_get_experience_metadata_lazy(self):
+        """Test that the cache is only read for the chunks that are
+            loaded"""
+        chunks = {f'?metadata_key_hash_list={metadata_key_hash}': (
+            Mock(status_code=200), [_xis_record(metadata_key_hash)])
+            for metadata_key_hash in 'abcd'}
+
+        with _xis_pages(chunks), \
+                self.settings(XIS_HASH_CHUNK_SIZE=1, XIS_PAGE_CONCURRENCY=2), \
+                patch.object(metadata_cache, 'get',
+                             wraps=metadata_cache.get) as cache_get:
+            chunk_records = iter_metadata_chunks(list('abcd'))
+            next(chunk_records)
+
+            self.assertLessEqual(cache_get.call_count, 2)
+            chunk_records.close()
+
+    def test_get_experience_metadata_copies(self):
+        """Test that changing a returned record leaves the cached copy
+            unchanged"""
+        with _xis_pages({'?metadata_key_hash_list=a': (
+                Mock(status_code=200), [_xis_record('a')])}):
+            get_experience_metadata(['a'])[1][0]['meta']['id'] = 'changed'
+            records = get_experience_metadata(['a'])[1]
+
+            self.assertEqual(records[0]['meta']['id'], 'a-id')
+
+    def test_get_experience_metadata_error(self):
+        """Test that no records are returned or cached when XIS responds
+            with an error"""
+        with _xis_pages({'?metadata_key_hash_list=a': (
+                Mock(status_code=500), [])}):
+            response, records = get_experience_metadata(['a'])
+
+            self.assertEqual(response.status_code, 500)
+            self.assertIsNone(records)
+            self.assertIsNone(metadata_cache.peek('a'))
+
+
+def _xis_page(status_code=200, **page):
+    response = Mock(status_code=status_code)
+    response.json.return_value = page
+
+    return response
+
+
+@tag('unit')
+class PaginationTests(TestCase):
+
+    def test_xis_page_urls(self):
+        """Test that the urls of the remaining pages are derived from the
+            page or offset parameter of the next link"""
+        self.assertEqual(
+            xis_page_urls('http://xis/api/?a=1,2&page=2', 25, 10),
+            ['http://xis/api/?a=1%2C2&page=2',
+             'http://xis/api/?a=1%2C2&page=3'])
+        self.assertEqual(
+            xis_page_urls('http://xis/api/?limit=10&offset=10', 25, 10),
+            ['http://xis/api/?limit=10&offset=10',
+             'http://xis/api/?limit=10&offset=20'])
+        self.assertIsNone(xis_page_urls('http://xis/api/?cursor=abc', 25, 10))
+        self.assertIsNone(xis_page_urls('http://xis/api/?page=last', 25, 10))
+
+    def test_get_all_pages_concurrent(self):
+        """Test that once the first page reports the count, every other page
+            is requested directly and the results are merged in order"""
+        pages = {
+            'http://xis/api/?q=1': _xis_page(
+                count=5, results=[1, 2], next='http://xis/api/?q=1&page=2'),
+            'http://xis/api/?q=1&page=2': _xis_page(
+                count=5, results=[3, 4], next='http://xis/api/?q=1&page=3'),
+            'http://xis/api/?q=1&page=3': _xis_page(
+                count=5, results=[5], next=None),
+        }
+
+        with patch('xds_api.utils.xds_utils.get_request') as get_request, \
+                self.settings(XIS_PAGE_CONCURRENCY=2):
+            get_request.side_effect = pages.get
+
+            response, results = get_all_pages('http://xis/api/?q=1')
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(results, [1, 2, 3, 4, 5])
+            self.assertEqual(get_request.call_count, 3)
+
+        for page in pages.values():
+            page.json.assert_called_once()
+
+    def test_get_all_pages_sequential(self):
+        """Test that the next links are followed one page at a time when
+            the count is unknown"""
+        pages = {
+            'http://xis/api/': _xis_page(
+                results=[1], next='http://xis/api/?cursor=b'),
+            'http://xis/api/?cursor=b': _xis_page(results=[2], next=None),
+        }
+
+        with patch('xds_api.utils.xds_utils.get_request') as get_request:
+            get_request.side_effect = pages.get
+
+            response, results = get_all_pages('http://xis/api/')
+
+            self.assertEqual(results, [1, 2])
+
+    def test_get_all_pages_error(self):
+        """Test that the first failed page response is returned"""
+        pages = {
+            'http://xis/api/': _xis_page(
+                count=3, results=[1], next='http://xis/api/?page=2'),
+            'http://xis/api/?page=2': _xis_page(503),
+            'http://xis/api/?page=3': _xis_page(count=3, results=[3]),
+        }
+
+        with patch('xds_api.utils.xds_utils.get_request') as get_request:
+            get_request.side_effect = pages.get
+
+            response, results = get_all_pages('http://xis/api/')
+
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(results, [1])
+
+
+@tag('unit')
+class StreamingTests(TestCase):
+
+    def setUp(self):
+        metadata_cache.clear()
+
+    def test_pooled_map(self):
+        """Test that results are yielded in order while at most one call per
+            thread is pending"""
+        calls = []
+
+        def square(number):
+            calls.append(number)
+
+            return number * number
+
+        with self.settings(XIS_PAGE_CONCURRENCY=2):
+            squares = pooled_map(square, range(5), 'test')
+
+            self.assertEqual(next(squares), 0)
+            self.assertLessEqual(len(calls), 3)
+            self.assertEqual(list(squares), [1, 4, 9, 16])
+            self.assertEqual(list(pooled_map(square, [], 'test')), [])
+
+    def test_pooled_map_nested(self):
+        """Test that a pooled_map called from a pool thread makes its calls
+            in that thread"""
+        threads = set()
+
+        def inner(number):
+            threads.add(threading.current_thread().name)
+
+            return number
+
+        def outer(number):
+            return list(pooled_map(inner, range(number), 'inner'))
+
+        with self.settings(XIS_PAGE_CONCURRENCY=2):
+            results = list(pooled_map(outer, [3, 3, 3], 'outer'))
+
+        self.assertEqual(results, [[0, 1, 2]] * 3)
+        self.assertLessEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('outer') for name in threads))
+
+    def test_get_chunked_metadata_empty(self):
+        """Test that no XIS request is made for an empty hash list"""
+        with _xis_pages({}) as pages:
+            self.assertEqual(get_chunked_metadata([]), (None, []))
+            pages.assert_not_called()
+
+    def test_iter_pages(self):
+        """Test that pages are yielded one at a time and a failed page ends
+            the iteration"""
+        pages = {
+            'http://xis/api/': _xis_page(
+                results=[1], next='http://xis/api/?cursor=b'),
+            'http://xis/api/?cursor=b': _xis_page(
+                results=[2], next='http://xis/api/?cursor=c'),
+            'http://xis/api/?cursor=c': _xis_page(500),
+        }
+
+        with patch('xds_api.utils.xds_utils.get_request') as get_request:
+            get_request.side_effect = pages.get
+
+            iterator = iter_pages('http://xis/api/')
+
+            self.assertEqual(next(iterator)[1], [1])
+            self.assertEqual(get_request.call_count, 1)
+            self.assertEqual([(response.status_code, results)
+                              for response, results in iterator],
+                             [(200, [2]), (500, [])])
+
+    def test_stream_json(self):
+        """Test that the streamed parts make up the JSON object with the
+            items under key"""
+        parts = list(stream_json({'name': 'list', 'experiences': ['a']},
+                                 'experiences', iter([{'a': 1}, None]),
+                                 {'message': 'error'}))
+
+        self.assertEqual(json.loads(b''.join(parts)),
+                         {'name': 'list', 'experiences': [{'a': 1}, None]})
+        self.assertEqual(json.loads(b''.join(stream_json({}, 'a', [], {}))),
+                         {'a': []})
+
+    def test_stream_json_error(self):
+        """Test that items failing to load once streamed end the object
+            with the error"""
+        def items():
+            yield 1
+            raise HTTPError('XIS responded with 502')
+
+        parts = list(stream_json({'name': 'list'}, 'experiences', items(),
+                                 {'message': 'error'}))
+
+        self.assertEqual(json.loads(b''.join(parts)),
+                         {'name': 'list', 'experiences': [1],
+                          'error': {'message': 'error'}})
+
+    def test_iter_experience_metadata_error(self):
+        """Test that a chunk XIS failed on raises once the records before it
+            were yielded"""
+        _patch_xis_api(self)
+        chunks = {
+            '?metadata_key_hash_list=a': (Mock(status_code=200),
+                                          [_xis_record('a')]),
+            '?metadata_key_hash_list=b': (Mock(status_code=502), []),
+        }
+
+        with _xis_pages(chunks), self.settings(XIS_HASH_CHUNK_SIZE=1):
+            records = iter_experience_metadata(
+                iter_metadata_chunks(['a', 'b']))
+
+            self.assertEqual(next(records)['meta']['metadata_key_hash'], 'a')
+
+            with self.assertRaises(HTTPError):
+                next(records)
+
+
+@tag('unit')
+class XISClientTests(TestCase):
+
+    @override_settings(XIS_POOL_MAXSIZE=4, XIS_RETRIES=3,
+                       XIS_RETRY_BACKOFF=0.5)
+    def test_build_session(self):
+        """Test that the XIS session pools keep-alive connections, asks for
+            gzip and retries failed idempotent GETs with a jittered
+            backoff"""
+        session = XISClient().build_session()
+        adapter = session.get_adapter('https://xis.example/')
+        retry = adapter.max_retries
+
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertIsInstance(retry, JitteredRetry)
+        self.assertEqual(retry.total, 3)
+        self.assertEqual(retry.read, 0)
+        self.assertEqual(retry.backoff_factor, 0.5)
+        self.assertIn(503, retry.status_forcelist)
+        self.assertIn('GET', retry.allowed_methods)
+        self.assertNotIn('POST', retry.allowed_methods)
+        self.assertIn('gzip', session.headers['Accept-Encoding'])
+        self.assertEqual(session.headers['Connection'], 'keep-alive')
+
+    def test_jittered_backoff(self):
+        """Test that the retry backoff is picked between zero and the
+            exponential backoff"""
+        retry = JitteredRetry(total=5, backoff_factor=1)
+
+        for _ in range(3):
+            retry = retry.increment(method='GET', url='/')
+
+        with patch('xds_api.utils.xis_client.random.uniform') as uniform:
+            uniform.return_value = 1.5
+
+            self.assertEqual(retry.get_backoff_time(), 1.5)
+            uniform.assert_called_once_with(0, 4)
+
+    def test_session_reused(self):
+        """Test that a worker reuses its session, and builds a new one once
+            forked"""
+        client = XISClient()
+        session = client.session
+
+        self.assertIs(client.session, session)
+
+        with patch('xds_api.utils.xis_client.os.getpid') as getpid:
+            getpid.return_value = -1
+
+            self.assertIsNot(client.session, session)
+
+    @override_settings(XIS_CONNECT_TIMEOUT=1.5, XIS_READ_TIMEOUT=7)
+    def test_get(self):
+        """Test that GETs use separate connect and read timeouts and are
+            timed"""
+        client = XISClient()
+        client._session = Mock()
+        client._session.get.return_value = Mock(status_code=200)
+        client._pid = os.getpid()
+
+        response = client.get('https://xis.example/api/')
+
+        self.assertEqual(response.status_code, 200)
+        client._session.get.assert_called_once_with(
+            'https://xis.example/api/', timeout=(1.5, 7))
+        stats = client.stats()
+        self.assertEqual(stats['requests'], 1)
+        self.assertEqual(stats['failures'], 0)
+        self.assertIsNotNone(stats['latency_ms'])
+
+    def test_get_failed(self):
+        """Test that GETs failing to connect or with a server error are
+            counted as failures"""
+        client = XISClient()
+        client._session = Mock()
+        client._pid = os.getpid()
+        client._session.get.side_effect = [Mock(status_code=503),
+                                           ConnectTimeout]
+
+        client.get('https://xis.example/api/')
+
+        with self.assertRaises(ConnectTimeout):
+            client.get('https://xis.example/api/')
+
+        stats = client.stats()
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['failures'], 2)
+        self.assertIsNone(stats['latency_ms'])
+
+    def test_get_request(self):
+        """Test that get_request goes through the pooled XIS client"""
+        with patch('xds_api.utils.xds_utils.xis_client') as client:
+            client.get.return_value = Mock(status_code=200)
+
+            response = get_request('https://xis.example/api/?page=2')
+
+            self.assertEqual(response.status_code, 200)
+            client.get.assert_called_once_with(
+                'https://xis.example/api/?page=2')
@@ -1,39 +1,225 @@
 import json
-
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from math import ceil
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+
+import orjson
 import requests
-from configurations.models import XDSConfiguration
+from configurations.utils.snapshot import get_config_snapshot
 from core.models import CourseSpotlight, Experience
+from core.utils.breaker import CircuitOpenError, get_breaker
+from core.utils.coalesce import SingleFlight
+from core.utils.materialize import MaterializedPayload
+from django.conf import settings
+from django.db import connections
+from es_api.utils.cache import LRUCache
 from rest_framework import status
 from rest_framework.response import Response
+from xds_api.utils.xis_client import xis_client
+
+
+logger = logging.getLogger('dict_config_logger')
+
+# coalesces identical concurrent XIS requests made by this worker
+xis_flight = SingleFlight('xis')
+
+# per worker cache of the XIS records of experiences in the search engine
+# format, by metadata_key_hash
+metadata_cache = LRUCache(settings.METADATA_CACHE_MAXSIZE,
+                          settings.METADATA_CACHE_TTL)
+
+
+class UpstreamUnavailableError(CircuitOpenError,
+                               requests.exceptions.ConnectionError):
+    """Raised instead of an XIS or LRS request while its circuit is open,
+        callers handle it like a failed connection"""
+
+
+def is_server_error(response):
+    """This method returns whether an XIS or LRS response counts as a
+        failure for its circuit breaker"""
+    return response.status_code >= 500
+
+
+xis_breaker = get_breaker('xis', open_error=UpstreamUnavailableError)
+lrs_breaker = get_breaker('lrs', open_error=UpstreamUnavailableError)
 
 
 def get_request(request_url):
     """This method handles a simple HTTP get request to the passe in
-        request_url"""
-    response = requests.get(request_url, timeout=3.0)
+        request_url over the pooled XIS session of the worker, concurrent
+        requests for the same url share one call. It fails fast while the
+        circuit to XIS is open."""
+    response = xis_flight.do(
+        request_url, lambda: xis_breaker.call(
+            lambda: xis_client.get(request_url),
+            failed=is_server_error))
 
     return response
 
 
-def get_spotlight_courses_api_url():
-    """This method gets the list of configured course spotlight IDs, the
-        configured XIS api url and generates the query to request records"""
-    # get XIS API url
-    course_spotlights = CourseSpotlight.objects.filter(active=True)
-    # get search string
-    composite_api_url = XDSConfiguration.objects.first()\
-        .target_xis_metadata_api
-    queryString = '?metadata_key_hash_list='
+def is_success(response):
+    """This method returns whether an XIS response is a 2xx page"""
+    return response.status_code // 10 == 20
+
 
-    for num, spotlight in enumerate(course_spotlights):
-        if num >= (len(course_spotlights) - 1):
-            queryString += spotlight.course_id
+def xis_page_urls(next_url, count, page_size):
+    """This method returns the urls of the pages from the next link of the
+        first page to the last of count results, or None when the link has
+        no page or offset parameter to derive them from"""
+    parts = urlsplit(next_url)
+    params = parse_qs(parts.query, keep_blank_values=True)
+
+    try:
+        if 'page' in params:
+            name = 'page'
+            values = range(int(params['page'][0]),
+                           ceil(count / page_size) + 1)
+        elif 'offset' in params:
+            name = 'offset'
+            values = range(int(params['offset'][0]), count,
+                           int(params.get('limit', [page_size])[0]))
         else:
-            queryString += spotlight.course_id + ','
+            return None
+    except ValueError:
+        return None
+
+    return [urlunsplit(parts._replace(query=urlencode(
+        dict(params, **{name: [str(value)]}), doseq=True)))
+        for value in values]
+
+
+# marks the threads of a pooled_map, whose own XIS calls are not pooled again
+_pool_thread = threading.local()
+
+
+def _pool_call(func, argument):
+    """This helper method returns func(argument) in a pool thread and closes
+        the database connections the thread opened"""
+    _pool_thread.active = True
+
+    try:
+        return func(argument)
+    finally:
+        connections.close_all()
+
+
+def pooled_map(func, arguments, name):
+    """This method yields func(argument) for each argument, in order. The
+        calls are made by at most XIS_PAGE_CONCURRENCY threads, and no more
+        results are held than there are threads. Called from one of those
+        threads, as when the pages of a chunk of hashes are fetched, the
+        calls are made in that thread so that a request never uses more
+        threads than that."""
+    arguments = list(arguments)
+
+    if len(arguments) <= 1 or getattr(_pool_thread, 'active', False):
+        for argument in arguments:
+            yield func(argument)
+
+        return
+
+    workers = min(settings.XIS_PAGE_CONCURRENCY, len(arguments))
+
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix=name) as executor:
+        pending = deque()
+
+        for argument in arguments:
+            pending.append(executor.submit(_pool_call, func, argument))
+
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_pages(api_url):
+    """This method yields the response and results of each page of a
+        paginated XIS response, in order, parsing each page once. When the
+        first page reports the count of results, the other pages are
+        requested concurrently through pooled_map, otherwise the next links
+        are followed one page at a time. It stops after a failed response,
+        which is yielded with no results."""
+    response = get_request(api_url)
+
+    if not is_success(response):
+        yield response, []
+        return
+
+    page = response.json()
+    next_url = page.get('next')
+    urls = None
+
+    if next_url is not None and page.get('count') and page['results']:
+        urls = xis_page_urls(next_url, page['count'], len(page['results']))
+
+    yield response, page['results']
+
+    if urls:
+        for response in pooled_map(get_request, urls, 'xis-pages'):
+            if not is_success(response):
+                yield response, []
+                return
 
-    full_api_string = composite_api_url + queryString
+            yield response, response.json()['results']
 
-    return full_api_string
+        return
+
+    while next_url is not None:
+        response = get_request(next_url)
+
+        if not is_success(response):
+            yield response, []
+            return
+
+        page = response.json()
+        next_url = page.get('next')
+
+        yield response, page['results']
+
+
+def get_all_pages(api_url):
+    """This method requests every page of a paginated XIS response and
+        returns the last response, or the first one that failed, along with
+        the results of all pages in order"""
+    results = []
+
+    for response, page_results in iter_pages(api_url):
+        results += page_results
+
+    return response, results
+
+
+def get_spotlight_courses():
+    """This method requests the active course spotlights from XIS and
+        returns them as a JSON string in the search engine format, or None
+        when no course spotlights are active"""
+    if not CourseSpotlight.objects.filter(active=True).exists():
+        return None
+
+    # make API calls
+    response, responseJSON = get_chunked_metadata(list(
+        CourseSpotlight.objects.filter(active=True)
+        .values_list('course_id', flat=True)))
+
+    # an error page is not stored in place of the spotlights
+    if response.status_code != 200:
+        raise requests.exceptions.HTTPError(
+            f'XIS responded with {response.status_code}', response=response)
+
+    return json.dumps(metadata_to_target(responseJSON))
+
+
+# the spotlight courses from XIS, kept for every worker and refreshed in the
+# background
+xis_spotlight = MaterializedPayload('xis-spotlight', get_spotlight_courses,
+                                    'SPOTLIGHT_REFRESH_INTERVAL')
 
 
 def format_metadata(exp_record):
@@ -67,13 +253,7 @@ def metadata_to_target(metadata_JSON):
     result = None
 
     if isinstance(metadata_dict, list):
-        result_list = []
-
-        for record in metadata_dict:
-            formatted_record = format_metadata(record)
-            result_list.append(formatted_record)
-
-        result = result_list
+        result = list(iter_target(metadata_dict))
 
     elif isinstance(metadata_dict, dict):
         formatted_record = format_metadata(metadata_dict)
@@ -82,10 +262,16 @@ def metadata_to_target(metadata_JSON):
     return result
 
 
+def iter_target(records):
+    """This method yields the records one at a time in the search engine
+        format"""
+    for record in records:
+        yield format_metadata(record)
+
+
 def get_courses_api_url(course_id):
     """This method gets the metadata api url to fetch single records"""
-    composite_api_url = XDSConfiguration.objects.first()\
-        .target_xis_metadata_api
+    composite_api_url = get_config_snapshot().target_xis_metadata_api
     full_api_url = composite_api_url + course_id
 
     return full_api_url
@@ -117,22 +303,174 @@ def interest_list_check(coursesDict, courseQuery):
 
 def interest_list_get_search_str(courseQuery):
     # get search string
-    composite_api_url = XDSConfiguration.objects.first() \
-        .target_xis_metadata_api
+    composite_api_url = get_config_snapshot().target_xis_metadata_api
     api_url = composite_api_url + courseQuery
 
-    # make API call
-    response = get_request(api_url)
-    responseJSON = []
-    while response.status_code//10 == 20:
-        responseJSON += response.json()['results']
+    # make API calls
+    return get_all_pages(api_url)
 
-        if 'next' in response.json() and\
-                response.json()['next'] is not None:
-            response = get_request(response.json()['next'])
-        else:
+
+def hash_list_query(metadata_key_hashes):
+    """This method returns the XIS query of the records of the hashes"""
+    return interest_list_check(metadata_key_hashes,
+                               '?metadata_key_hash_list=')[1]
+
+
+def hash_chunks(metadata_key_hashes):
+    """This method splits the hashes into lists of at most
+        XIS_HASH_CHUNK_SIZE, so that long lists do not make urls that
+        proxies truncate or reject"""
+    size = settings.XIS_HASH_CHUNK_SIZE
+
+    return [metadata_key_hashes[start:start + size]
+            for start in range(0, len(metadata_key_hashes), size)]
+
+
+def get_chunked_metadata(metadata_key_hashes):
+    """This method requests the XIS records of experiences one chunk of
+        hashes at a time, concurrently through pooled_map. It returns the
+        response of the first chunk that failed, or else of the last, along
+        with the records of the chunks in order. The response is None when
+        there are no hashes."""
+    response = None
+    results = []
+
+    for response, records in pooled_map(
+            interest_list_get_search_str,
+            map(hash_list_query, hash_chunks(metadata_key_hashes)),
+            'xis-chunks'):
+        if not is_success(response):
             break
-    return response, responseJSON
+
+        results += records
+
+    return response, results
+
+
+def _load_chunk(composite_api_url, chunk):
+    """This helper method returns the XIS response of a chunk of hashes, or
+        None when every record was cached, along with the records of the
+        chunk in the search engine format, in the order of their hashes. The
+        cache is read when the chunk is loaded, and the missing records are
+        formatted one XIS page at a time. The records are None when XIS
+        responded with an error."""
+    records = {}
+    misses = []
+
+    for metadata_key_hash in chunk:
+        cached = metadata_cache.get(metadata_key_hash)
+
+        if cached is None:
+            misses.append(metadata_key_hash)
+        else:
+            records[metadata_key_hash] = orjson.loads(cached)
+
+    response = None
+    unkeyed = []
+
+    if misses:
+        for response, results in iter_pages(composite_api_url +
+                                            hash_list_query(misses)):
+            for record in iter_target(results):
+                metadata_key_hash = (record or {}).get('meta', {}) \
+                    .get('metadata_key_hash')
+
+                if metadata_key_hash is None:
+                    unkeyed.append(record)
+                    continue
+
+                # callers get their own copy of the cached record
+                metadata_cache.set(metadata_key_hash, orjson.dumps(record))
+                records[metadata_key_hash] = record
+
+        if response.status_code != 200:
+            return response, None
+
+        missing = [metadata_key_hash for metadata_key_hash in misses
+                   if metadata_key_hash not in records]
+
+        if missing:
+            logger.warning(f'XIS has no records for {len(missing)} '
+                           f'experiences: {", ".join(missing)}')
+
+    ordered = [records.pop(metadata_key_hash) for metadata_key_hash in chunk
+               if metadata_key_hash in records]
+
+    return response, ordered + list(records.values()) + unkeyed
+
+
+def iter_metadata_chunks(metadata_key_hashes):
+    """This method yields the XIS response of each chunk of hashes, or None
+        when every record of the chunk was cached, along with the records of
+        the chunk, loaded concurrently through pooled_map. Only the hashes
+        missing from the metadata cache are requested, and those XIS has no
+        record for are logged. It stops after a chunk XIS responded to with
+        an error, whose records are None."""
+    # read once here rather than in every pool thread
+    composite_api_url = get_config_snapshot().target_xis_metadata_api
+
+    for response, records in pooled_map(
+            partial(_load_chunk, composite_api_url),
+            hash_chunks(list(dict.fromkeys(metadata_key_hashes))),
+            'xis-chunks'):
+        yield response, records
+
+        if records is None:
+            return
+
+
+def get_experience_metadata(metadata_key_hashes):
+    """This method returns the records of experiences in the search engine
+        format, in the order of their hashes, along with the last XIS
+        response they were requested with, or None when every record was
+        cached. The records are None when XIS responded with an error."""
+    response = None
+    results = []
+
+    for chunk_response, records in iter_metadata_chunks(metadata_key_hashes):
+        if records is None:
+            return chunk_response, None
+
+        response = chunk_response or response
+        results += records
+
+    return response, results
+
+
+def iter_experience_metadata(chunks):
+    """This method yields the records of the chunks of iter_metadata_chunks
+        one at a time, raising HTTPError when XIS responded to a chunk with
+        an error"""
+    for response, records in chunks:
+        if records is None:
+            raise requests.exceptions.HTTPError(
+                f'XIS responded with {response.status_code}',
+                response=response)
+
+        yield from records
+
+
+def stream_json(payload, key, items, error):
+    """This method yields a JSON object in parts, the payload with the items
+        written one at a time into the array under key, so that the items
+        are never all held in memory. When the items fail to load once the
+        response was started, the array is closed and the error is written
+        under "error", so that the object stays well formed."""
+    head = orjson.dumps({name: value for name, value in payload.items()
+                         if name != key})[:-1]
+
+    yield head + (b',' if len(head) > 1 else b'') + orjson.dumps(key) + \
+        b':['
+
+    try:
+        for index, item in enumerate(items):
+            yield (b',' if index else b'') + orjson.dumps(item)
+    except requests.exceptions.RequestException as err:
+        logger.error(err)
+        yield b'],"error":' + orjson.dumps(error) + b'}'
+        return
+
+    yield b']}'
 
 
 def get_multilevel_dict(dictionary, path):
@@ -0,0 +1,127 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger('dict_config_logger')
+
+
+class JitteredRetry(Retry):
+    """Retry policy whose exponential backoff is spread uniformly between
+        zero and its full value, so that workers retrying after the same
+        XIS failure do not retry in step"""
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+
+class XISClient():
+    """Keep-alive HTTP session of a worker for its XIS requests. Connections
+        are pooled, idempotent GETs that fail to connect or get a 502, 503 or
+        504 are retried with a jittered backoff, and every call is timed.
+        Slow responses are not retried. The session is rebuilt in a forked
+        worker so that pooled connections are never shared between
+        processes."""
+    # responses retried before they are returned to the caller
+    retry_statuses = (502, 503, 504)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self.requests = 0
+        self.failures = 0
+        # milliseconds, None until a call succeeded
+        self.latency = None
+        self.slowest = 0.0
+
+    def build_session(self):
+        """Returns a new session with the configured pool and retry policy"""
+        retry = JitteredRetry(
+            total=settings.XIS_RETRIES,
+            # a read timeout means XIS is slow, retrying would only add to
+            # the time the worker is blocked
+            read=0,
+            backoff_factor=settings.XIS_RETRY_BACKOFF,
+            status_forcelist=self.retry_statuses,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=settings.XIS_POOL_MAXSIZE,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                                'Connection': 'keep-alive'})
+
+        return session
+
+    @property
+    def session(self):
+        """Returns the session of this worker process"""
+        pid = os.getpid()
+
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self.build_session()
+                    self._pid = pid
+
+        return self._session
+
+    def get(self, url):
+        """Returns the response of a GET request to XIS"""
+        started = time.monotonic()
+
+        try:
+            response = self.session.get(
+                url, timeout=(settings.XIS_CONNECT_TIMEOUT,
+                              settings.XIS_READ_TIMEOUT))
+        except requests.exceptions.RequestException:
+            self.record(started, True)
+            raise
+
+        elapsed = self.record(started, response.status_code >= 500)
+        logger.debug(f'XIS GET {url} {response.status_code} in '
+                     f'{elapsed:.1f}ms')
+
+        return response
+
+    def record(self, started, failed):
+        """Records a call started at the given monotonic time and returns
+            how long it took in milliseconds"""
+        elapsed = (time.monotonic() - started) * 1000
+
+        with self._lock:
+            self.requests += 1
+
+            if failed:
+                self.failures += 1
+            else:
+                latency = self.latency
+                self.latency = elapsed if latency is None else \
+                    latency + 0.2 * (elapsed - latency)
+                self.slowest = max(self.slowest, elapsed)
+
+        return elapsed
+
+    def stats(self):
+        """Returns the calls made by this worker and their latency"""
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'latency_ms': None if self.latency is None
+            else round(self.latency, 3),
+            'max_ms': round(self.slowest, 3),
+        }
+
+
+# XIS client of this worker
+xis_client = XISClient()
@@ -1,29 +1,31 @@
 import json
 import logging
 from collections import OrderedDict
+from itertools import chain
 
 import requests
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Count
-from django.http import HttpResponse, HttpResponseServerError, JsonResponse
+from django.http import (HttpResponse, HttpResponseServerError, JsonResponse,
+                         StreamingHttpResponse)
 from requests.exceptions import ConnectionError, HTTPError
 from rest_framework import status, viewsets, serializers
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from configurations.models import CourseInformationMapping, XDSConfiguration
+from configurations.utils.snapshot import get_config_snapshot
 from core.management.utils.xds_internal import bleach_data_to_json
-from core.models import CourseSpotlight, Experience, InterestList, SavedFilter
+from core.models import Experience, InterestList, SavedFilter
 from xds_api.serializers import (CourseMostSavedSerializer,
                                  InterestListMostSubscribedSerializer,
                                  InterestListSerializer,
                                  SavedFilterSerializer)
-from xds_api.utils.xds_utils import (get_request,
-                                     get_spotlight_courses_api_url,
-                                     interest_list_check,
-                                     interest_list_get_search_str,
-                                     metadata_to_target, save_experiences)
+from xds_api.utils.xds_utils import (get_experience_metadata,
+                                     is_server_error, iter_experience_metadata,
+                                     iter_metadata_chunks, lrs_breaker,
+                                     save_experiences, stream_json,
+                                     xis_spotlight)
 from xds_api.xapi import (actor_with_account, actor_with_mbox,
                           filter_allowed_statements,
                           get_or_set_registration_uuid, jwt_account_name)
@@ -45,33 +47,16 @@ class GetSpotlightCoursesView(APIView):
         errorMsgJSON = json.dumps(errorMsg)
 
         try:
-            if CourseSpotlight.objects.filter(active=True).count() > 0:
-                api_url = get_spotlight_courses_api_url()
-                logger.info(api_url)
-                # make API call
-                response = get_request(api_url)
-                responseJSON = []
-                while response.status_code // 10 == 20:
-                    responseJSON += response.json()['results']
-
-                    if 'next' in response.json() and \
-                            response.json()['next'] is not None:
-                        response = get_request(response.json()['next'])
-                    else:
-                        break
-
-                if response.status_code == 200:
-                    formattedResponse = json.dumps(
-                        metadata_to_target(responseJSON))
-
-                    return HttpResponse(formattedResponse,
-                                        content_type="application/json")
-                else:
-                    return HttpResponse(responseJSON,
-                                        content_type="application/json")
-            else:
+            # served from the materialized copy, XIS is only called when no
+            # worker has built it yet
+            formattedResponse = xis_spotlight.get()
+
+            if formattedResponse is None:
                 return HttpResponse([])
 
+            return HttpResponse(formattedResponse,
+                                content_type="application/json")
+
         except requests.exceptions.RequestException as e:
             errorMsg = {"message": "error reaching out to configured XIS" +
                         " API; please check the XIS logs"}
@@ -92,28 +77,19 @@ class GetExperiencesView(APIView):
             "; please check the XDS logs"
         }
         errorMsgJSON = json.dumps(errorMsg)
+        response = None
 
         try:
-            composite_api_url = XDSConfiguration.objects.first() \
-                .target_xis_metadata_api
-            courseQuery = "?metadata_key_hash_list=" + exp_hash
-            api_url = composite_api_url + courseQuery
-            logger.info(api_url)
-            # make API call
-            response = get_request(api_url)
-            logger.info(api_url)
-            responseJSON = []
-            # expected response is a list of 1 element
-            if response.status_code//10 == 20:
-                responseJSON += response.json()['results']
+            # served from the metadata cache, XIS is only called on a miss
+            response, records = get_experience_metadata([exp_hash])
 
-                if not responseJSON:
+            # expected response is a list of 1 element
+            if records is not None:
+                if not records:
                     return Response({"message": "Key not found"},
                                     status.HTTP_404_NOT_FOUND)
 
-                logger.info(responseJSON)
-                formattedResponse = json.dumps(
-                    metadata_to_target(responseJSON[0]))
+                formattedResponse = json.dumps(records[0])
 
                 return HttpResponse(formattedResponse,
                                     content_type="application/json")
@@ -205,6 +181,10 @@ class InterestListView(APIView):
 
     def get(self, request, list_id):
         """This method gets a single interest list"""
+        # the XIS response is only added to the message of this request
+        errorMsg = {
+            "message": self.errorMsg["message"]
+        }
 
         try:
             queryset = InterestList.objects.get(pk=list_id)
@@ -220,21 +200,29 @@ class InterestListView(APIView):
 
             # fetch actual courses for each id in the courses array
             interestList = serializer_class.data
-            courseQuery = "?metadata_key_hash_list="
             coursesDict = interestList['experiences']
 
-            # for each hash key in the courses list, append them to the query
-            coursesDict, courseQuery = (
-                interest_list_check(coursesDict, courseQuery))
-
             if len(coursesDict) > 0:
-                response, responseJSON = (
-                    interest_list_get_search_str(courseQuery))
-
-                self.errorMsg["message"] += str(response)
-
-                if response.status_code == 200:
-                    formattedResponse = metadata_to_target(responseJSON)
+                # cached courses are not requested from XIS again
+                chunks = iter_metadata_chunks(coursesDict)
+                response, formattedResponse = next(chunks)
+
+                if response is not None:
+                    errorMsg["message"] += str(response)
+
+                # the courses of long lists are written as they are fetched
+                if formattedResponse is not None and \
+                        len(coursesDict) > settings.XIS_HASH_CHUNK_SIZE:
+                    return StreamingHttpResponse(
+                        stream_json(interestList, 'experiences', chain(
+                            formattedResponse,
+                            iter_experience_metadata(chunks)),
+                            {"message": "error fetching the courses of the "
+                             "interest list from XIS; please check the XIS "
+                             "logs"}),
+                        content_type="application/json")
+
+                if formattedResponse is not None:
                     interestList['experiences'] = formattedResponse
 
                     return Response(interestList,
@@ -244,14 +232,14 @@ class InterestListView(APIView):
                                     status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except HTTPError as http_err:
             logger.error(http_err)
-            return Response(self.errorMsg,
+            return Response(errorMsg,
                             status.HTTP_500_INTERNAL_SERVER_ERROR)
         except ObjectDoesNotExist as not_found_err:
             logger.error(not_found_err)
-            return Response(self.errorMsg, status.HTTP_404_NOT_FOUND)
+            return Response(errorMsg, status.HTTP_404_NOT_FOUND)
         except Exception as err:
             logger.error(err)
-            return Response(self.errorMsg,
+            return Response(errorMsg,
                             status.HTTP_500_INTERNAL_SERVER_ERROR)
         else:
             return Response(serializer_class.data, status.HTTP_200_OK)
@@ -668,7 +656,7 @@ class StatementForwardView(APIView):
     def post(self, request):
         """Forward statements to an LRS"""
 
-        config = XDSConfiguration.objects.first()
+        config = get_config_snapshot().xds_configuration
         if not config:
             return Response({'message': 'No XDS configuration found.'},
                             status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -735,12 +723,13 @@ class StatementForwardView(APIView):
         }
 
         try:
-            resp = requests.post(
+            # fails fast while the circuit to the LRS is open
+            resp = lrs_breaker.call(lambda: requests.post(
                 url=f"{lrs_endpoint}/statements",
                 json=allowed_statements,
                 headers=headers,
                 auth=(lrs_username, lrs_password),
-            )
+            ), failed=is_server_error)
         except ConnectionError:
             return Response({'message': 'Could not connect to LRS'},
                             status.HTTP_502_BAD_GATEWAY)
@@ -788,24 +777,19 @@ class CourseMostSavedViewSet(viewsets.ReadOnlyModelViewSet):
         """Get course mapping and formatted response for serializer context"""
         context = super().get_serializer_context()
         context['formatted_response'] = []
-        context['course_mapping'] = CourseInformationMapping.objects.first()
+        context['course_mapping'] = get_config_snapshot().course_mapping
 
         try:
-            course_query = '?metadata_key_hash_list='
             courses = list(
                 self.queryset.values_list('metadata_key_hash', flat=True)
             )
 
-            courses, course_query = (
-               interest_list_check(courses, course_query))
-
             if len(courses) > 0:
-                response, response_json = (
-                    interest_list_get_search_str(course_query))
+                response, formatted_response = (
+                    get_experience_metadata(courses))
 
-                if response.status_code == 200:
-                    context['formatted_response'] = \
-                        metadata_to_target(response_json)
+                if formatted_response is not None:
+                    context['formatted_response'] = formatted_response
         except Exception as err:
             logger.error(err)
         return context